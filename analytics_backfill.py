@@ -0,0 +1,117 @@
+"""
+Analytics Backfill for NeuroShield
+Folds brain states written before the write-behind buffer into session aggregates and rollups
+"""
+
+import threading
+import time
+
+from brain_state_buffer import UPDATE_SESSION_AGGREGATES, session_deltas
+from rollups import apply_rollups
+
+
+# One watermark row: brain_states ids in (last_id, max_id] still need folding.
+# Rows above max_id were written by the buffer, which maintains the aggregates
+# and rollups itself. Rollups are only filled by the buffer, so empty rollups
+# mean every existing row predates it (upgrade from the original schema);
+# otherwise the database was created by this version and there is nothing to
+# fold.
+SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS analytics_backfill (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        last_id INTEGER NOT NULL,
+        max_id INTEGER NOT NULL
+    );
+
+    INSERT OR IGNORE INTO analytics_backfill (id, last_id, max_id)
+    SELECT 1, 0, CASE WHEN EXISTS (SELECT 1 FROM brain_state_rollup_hour) THEN 0
+                      ELSE COALESCE(MAX(id), 0) END
+    FROM brain_states;
+'''
+
+SELECT_BATCH = '''
+    SELECT b.id, e.user_id, b.session_id, b.timestamp, b.state, b.confidence, b.risk_score
+    FROM brain_states b LEFT JOIN eeg_sessions e ON e.id = b.session_id
+    WHERE b.id > ? AND b.id <= ?
+    ORDER BY b.id LIMIT ?
+'''
+
+
+def watermark(db):
+    """(last_id, max_id) of the backfill"""
+    return tuple(db.execute('SELECT last_id, max_id FROM analytics_backfill').fetchone())
+
+
+def fold_rows(db, rows):
+    """Apply (id, user_id, session_id, timestamp, state, confidence, risk_score) rows like the buffer does"""
+    states = [(session_id, timestamp, state, confidence, risk_score)
+              for _, _, session_id, timestamp, state, confidence, risk_score in rows]
+    db.executemany(UPDATE_SESSION_AGGREGATES, session_deltas(states))
+    apply_rollups(db, [
+        (user_id, str(timestamp), state, risk_score)
+        for _, user_id, _, timestamp, state, _, risk_score in rows
+        if user_id is not None
+    ])
+
+
+# brain_states rows whose aggregates exist: folded already, or written by the buffer
+FOLDED_ROW = '''
+    (id <= (SELECT last_id FROM analytics_backfill) OR id > (SELECT max_id FROM analytics_backfill))
+'''
+
+
+class BatchTaken(Exception):
+    """Another runner moved the watermark while this batch was being folded"""
+
+
+def backfill_batch(db, batch_size=1000):
+    """Fold the next batch of pre-buffer rows; returns rows folded"""
+    try:
+        with db:
+            last_id, max_id = watermark(db)
+            if last_id >= max_id:
+                return 0
+            rows = db.execute(SELECT_BATCH, (last_id, max_id, batch_size)).fetchall()
+            if rows:
+                fold_rows(db, rows)
+            # Rows deleted before they were folded leave gaps; jump to max_id when done
+            new_last = rows[-1][0] if len(rows) == batch_size else max_id
+            cursor = db.execute('UPDATE analytics_backfill SET last_id = ? WHERE last_id = ?',
+                                (new_last, last_id))
+            if cursor.rowcount == 0:
+                raise BatchTaken()  # rolls back our fold; the rows are counted once
+            return len(rows)
+    except BatchTaken:
+        return 0
+
+
+def backfill(connect, batch_size=1000, pause=0.05):
+    """Fold every pre-buffer row, one short transaction per batch"""
+    folded = 0
+    while True:
+        db = connect()
+        try:
+            count = backfill_batch(db, batch_size)
+            last_id, max_id = watermark(db)
+        finally:
+            db.close()
+        folded += count
+        if last_id >= max_id:
+            return folded
+        time.sleep(pause)
+
+
+def start_backfill(connects, batch_size=1000, pause=0.05):
+    """Run backfill() for every database on a daemon thread"""
+    def run():
+        for connect in connects:
+            try:
+                folded = backfill(connect, batch_size, pause)
+                if folded:
+                    print(f"✓ Analytics backfilled {folded} brain states")
+            except Exception as e:
+                print(f"Error backfilling analytics: {e}")
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
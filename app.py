@@ -20,6 +20,30 @@ import asyncio
 from scipy import signal
 from scipy.signal import butter, filtfilt, welch
 import time
+import uuid
+import atexit
+from config import load_settings
+from brain_state_buffer import BrainStateBuffer
+from database import ConnectionManager
+from migrations import apply_migrations
+from repository import decode_cursor, get_repository, next_cursor, request_query_count
+from sharding import ShardRouter
+import analytics_backfill
+import offline_sync
+import search
+from llm_pool import CompletionPool, PoolSaturated
+from circuit_breaker import CircuitBreaker
+from hedging import HedgedCompletion
+from http_clients import HostBusy, OutboundHTTP
+import response_cache
+from conversation_memory import ConversationMemory
+from context_builder import ContextBuilder
+from intent_matcher import INTENT_RULES, IntentMatcher
+from triage import TriageRouter
+from mock_llm import MockLLM, MockOpenAI, create_blueprint as mock_llm_blueprint
+from async_repository import AsyncRepository
+import rollups
+from retention import RetentionJob, ensure_incremental_auto_vacuum
 
 
 import sys
@@ -28,16 +52,17 @@ from io import StringIO
 
 load_dotenv()
 app = Flask(__name__)
+load_settings(app)
 # app.secret_key = os.urandom(24)
 app.secret_key = os.environ.get('SECRET_KEY', 'dev-secret-key-change-in-production')
 # CORS(app)
 CORS(app,
      cors_allowed_origins="*",  # ← Change to specific origin in production
-     supports_credentials=True)
+     supports_credentials=True,
+     expose_headers=['X-Next-Cursor', 'X-DB-Query-Count'])
 socketio = SocketIO(app, cors_allowed_origins="*")
 
 # Configuration
-DATABASE = 'neuroshield.db'
 MODEL_PATH = 'models/eeg_classifier.pkl'
 UPLOAD_FOLDER = 'uploads'
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
@@ -45,86 +70,100 @@ os.makedirs('models', exist_ok=True)
 
 # ==================== Database Setup ====================
 
+# Pooled WAL connections for Config.DATABASE_PATH, released on app-context teardown
+db_manager = ConnectionManager()
+db_manager.init_app(app)
+
+# Optional per-user shards; db_manager then only holds the users catalog
+shard_router = None
+if app.config['DATABASE_SHARDS'] > 0:
+    shard_router = ShardRouter(app.config['DATABASE_PATH'], app.config['DATABASE_SHARDS'])
+    shard_router.init_app(app)
+
+def user_data_connects():
+    """Connect callables for every database holding user-scoped rows"""
+    if shard_router is None:
+        return [db_manager.connect]
+    return [manager.connect for manager in shard_router.managers]
+
 def get_db():
-    """Get database connection"""
-    db = sqlite3.connect(DATABASE)
-    db.row_factory = sqlite3.Row
-    return db
+    """Get the database connection for the current app context"""
+    return db_manager.get()
+
+def get_repo():
+    """Get the data-access repository for the current app context"""
+    return get_repository(get_db, shard_router)
+
+# Awaitable repository for async handlers; SQLite runs on a bounded thread pool
+async_repo = AsyncRepository(db_manager.connect, max_workers=app.config['DATABASE_ASYNC_WORKERS'],
+                             shards=shard_router)
+atexit.register(async_repo.shutdown, wait=False)
+
+def page_args(default_limit, max_limit=100):
+    """(limit, before) from ?limit= and ?cursor=; raises ValueError when invalid"""
+    limit = min(max(int(request.args.get('limit', default_limit)), 1), max_limit)
+    cursor = request.args.get('cursor')
+    return limit, decode_cursor(cursor) if cursor else None
+
+def paged_response(items, cursor):
+    """JSON list body with the next page's cursor in X-Next-Cursor"""
+    response = jsonify(items)
+    if cursor:
+        response.headers['X-Next-Cursor'] = cursor
+    return response
+
+@app.after_request
+def add_query_count_header(response):
+    """Expose per-request database cost"""
+    response.headers['X-DB-Query-Count'] = str(request_query_count())
+    return response
 
 def init_db():
-    """Initialize database schema"""
-    db = get_db()
-    db.executescript('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE NOT NULL,
-            password_hash TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            anonymous_id TEXT UNIQUE,
-            consent_research BOOLEAN DEFAULT 0
-        );
-        
-        CREATE TABLE IF NOT EXISTS streaks (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            current_streak INTEGER DEFAULT 0,
-            longest_streak INTEGER DEFAULT 0,
-            last_check_in DATE,
-            total_clean_days INTEGER DEFAULT 0,
-            FOREIGN KEY (user_id) REFERENCES users (id)
-        );
-        
-        CREATE TABLE IF NOT EXISTS journal_entries (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            entry_date DATE NOT NULL,
-            mood TEXT,
-            triggers TEXT,
-            note TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (id)
-        );
-        
-        CREATE TABLE IF NOT EXISTS eeg_sessions (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            session_start TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            session_end TIMESTAMP,
-            avg_risk_score REAL,
-            triggered_count INTEGER DEFAULT 0,
-            focused_count INTEGER DEFAULT 0,
-            FOREIGN KEY (user_id) REFERENCES users (id)
-        );
-        
-        CREATE TABLE IF NOT EXISTS brain_states (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            session_id INTEGER NOT NULL,
-            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            state TEXT NOT NULL,
-            confidence REAL NOT NULL,
-            risk_score REAL,
-            FOREIGN KEY (session_id) REFERENCES eeg_sessions (id)
-        );
-        
-        CREATE TABLE IF NOT EXISTS chat_history (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            message TEXT NOT NULL,
-            sender TEXT NOT NULL,
-            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (id)
-        );
-        
-        CREATE TABLE IF NOT EXISTS emergency_events (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            action_taken TEXT,
-            FOREIGN KEY (user_id) REFERENCES users (id)
-        );
-    ''')
-    db.commit()
-    db.close()
+    """Initialize or upgrade the database schema (catalog and every shard)"""
+    for connect in {db_manager.connect, *user_data_connects()}:
+        db = connect()
+        apply_migrations(db)
+        # Retention's incremental_vacuum needs it; files created before it need one VACUUM
+        ensure_incremental_auto_vacuum(db)
+        db.close()
+
+# Brain states are written behind the request path in batched transactions
+brain_state_buffer = BrainStateBuffer(
+    db_manager.connect,
+    max_rows=app.config['BRAIN_STATE_FLUSH_SIZE'],
+    flush_interval=app.config['BRAIN_STATE_FLUSH_INTERVAL'],
+    route=shard_router.connect_for if shard_router else None,
+    max_pending=app.config['BRAIN_STATE_MAX_PENDING']
+)
+atexit.register(brain_state_buffer.stop)
+
+# Expired raw analytics are compacted in the background
+retention_job = RetentionJob(
+    user_data_connects(),
+    retention_days=app.config['ANALYTICS_RETENTION_DAYS'],
+    interval=app.config['RETENTION_JOB_INTERVAL'],
+    batch_size=app.config['RETENTION_BATCH_SIZE'],
+    archive_folder=app.config['ARCHIVE_FOLDER']
+)
+atexit.register(retention_job.stop)
+background_jobs_started = threading.Event()
+background_jobs_lock = threading.Lock()
+
+@app.before_request
+def start_background_jobs():
+    """Start the brain state flusher and retention job once, at app start or first request"""
+    if background_jobs_started.is_set():
+        return
+    with background_jobs_lock:
+        if background_jobs_started.is_set():
+            return
+        brain_state_buffer.start()
+        if not app.testing:
+            # Pre-upgrade brain states are folded into the session aggregates once
+            analytics_backfill.start_backfill(user_data_connects(),
+                                              batch_size=app.config['ANALYTICS_BACKFILL_BATCH'])
+            retention_job.start()
+        background_jobs_started.set()
 
 # ==================== EEG Signal Processing ====================
 
@@ -252,31 +291,81 @@ classifier = BrainStateClassifier()
 
 # ==================== NLP Support Coach ====================
 
+# Default coach provider; COACH_LLM_PROVIDERS replaces it with an ordered list (hedging/failover)
+OPENROUTER_PROVIDER = {
+    'name': 'openrouter',
+    'base_url': 'https://openrouter.ai/api/v1',
+    'api_key_env': 'OPENROUTER_API_KEY',
+    'model': 'anthropic/claude-3.5-sonnet'
+}
+
+
 class SupportCoach:
     """AI-powered support coach with rule-based responses"""
 
-    def __init__(self, use_ai=False):
+    def __init__(self, use_ai=False, llm_deadline=8.0, llm_timeout=10.0, llm_max_retries=1,
+                 llm_workers=8, llm_max_in_flight=16, cache_enabled=True, cache_max_entries=1024,
+                 cache_ttl=3600, memory_turns=20, memory_max_users=10000,
+                 memory_budget=64 * 1024 * 1024, history_loader=None, context_tokens=1500,
+                 summary_tokens=200, intent_rules=INTENT_RULES, triage_enabled=True,
+                 triage_threshold=0.8, triage_max_words=6, llm_provider='openrouter', mock_llm=None,
+                 breaker_enabled=True, breaker_window=60.0, breaker_min_calls=10, breaker_error_rate=0.5,
+                 breaker_latency_slo=6.0, breaker_open_seconds=30.0, llm_providers=None, hedge_delay=None,
+                 hedge_percentile=0.9, hedge_initial_delay=2.0, hedge_max_ratio=0.1, http_client=None):
         self.use_ai = use_ai
-        self.conversation_history = {}  # {user_id: [(role, content), ...]}
+        self.intent_matcher = IntentMatcher(intent_rules)
 
-        # Initialize OpenRouter client if AI mode is enabled
-        if self.use_ai:
-            try:
-                from openai import OpenAI
-                openrouter_api_key = os.environ.get('OPENROUTER_API_KEY')
-                if not openrouter_api_key:
-                    print("Warning: OPENROUTER_API_KEY not set. Falling back to rule-based mode.")
-                    self.use_ai = False
-                else:
-                    self.client = OpenAI(
-                        api_key=openrouter_api_key,
-                        base_url="https://openrouter.ai/api/v1"
-                    )
-                    print("✓ OpenRouter AI client initialized")
-            except Exception as e:
-                print(f"Warning: Failed to initialize OpenRouter client: {e}")
+        # Local first: small talk and clear single-intent messages skip the LLM (None = off)
+        self.triage = (
+            TriageRouter(self.intent_matcher, triage_threshold, triage_max_words) if triage_enabled else None
+        )
+        # Recent (role, content) turns per user, bounded and reloaded from chat_history
+        # Turns leaving memory are folded into the summary; evicted users are rebuilt from history
+        self.memory = ConversationMemory(max_users=memory_max_users, max_bytes=memory_budget,
+                                         max_turns=memory_turns, loader=history_loader,
+                                         on_trim=lambda user_id, turns: self.context.fold(user_id, turns),
+                                         on_evict=lambda user_id: self.context.clear(user_id))
+        # Prompt history is fitted to a token budget; older turns become a rolling summary
+        self.context = ContextBuilder(budget=context_tokens, summary_budget=summary_tokens,
+                                      max_users=memory_max_users)
+
+        # Replies to the same message in the same context are reused (None = opt-out)
+        self.response_cache = (
+            response_cache.ResponseCache(cache_max_entries, cache_ttl) if cache_enabled else None
+        )
+
+        # Provider calls never run on the request thread without a bound
+        self.llm_pool = CompletionPool(max_workers=llm_workers, max_in_flight=llm_max_in_flight,
+                                       deadline=llm_deadline)
+
+        # During a provider outage or slowdown, skip the provider instead of waiting on it (None = off)
+        self.breaker = CircuitBreaker(
+            window=breaker_window, min_calls=breaker_min_calls, error_rate=breaker_error_rate,
+            latency_slo=breaker_latency_slo, open_seconds=breaker_open_seconds
+        ) if breaker_enabled else None
+
+        # Initialize provider clients (OpenRouter by default) if AI mode is enabled
+        self.providers = []
+        if self.use_ai and llm_provider == 'mock':
+            self.providers = [{'name': 'mock', 'model': 'mock', 'client': MockOpenAI(mock_llm)}]
+            print("✓ Mock LLM client initialized")
+        elif self.use_ai:
+            self.providers = self.connect_providers(llm_providers or [OPENROUTER_PROVIDER],
+                                                    llm_timeout, llm_max_retries, http_client)
+            if not self.providers:
+                print("Warning: no LLM provider available. Falling back to rule-based mode.")
                 self.use_ai = False
 
+        self.client = self.providers[0]['client'] if self.providers else None
+        self.model = self.providers[0]['model'] if self.providers else OPENROUTER_PROVIDER['model']
+
+        # With fallback providers, slow calls are hedged and errors fail over (None = one provider)
+        self.hedger = HedgedCompletion(
+            self.providers, hedge_delay=hedge_delay, percentile=hedge_percentile,
+            initial_delay=hedge_initial_delay, max_hedge_ratio=hedge_max_ratio,
+            max_workers=llm_workers * len(self.providers)
+        ) if len(self.providers) > 1 else None
+
         self.responses = {
             'urge': [
                 "Take a deep breath. This feeling is temporary. Let's do a breathing exercise together.",
@@ -302,28 +391,21 @@ class SupportCoach:
                 "I'm here to support you 24/7. How are you feeling right now?",
                 "Remember: recovery is a journey, not a destination. Every day counts.",
                 "What's on your mind? Let's talk through it together.",
+            ],
+            'acknowledgement': [
+                "Anytime. I'm here whenever you need me.",
+                "Glad to help. Keep going - you're doing the work.",
+                "You're welcome. Check in whenever you like.",
             ]
         }
+        # Custom intents without templates answer with 'general' (see get_rule_based_response)
+        for intent in self.intent_matcher.priorities:
+            if intent not in self.responses:
+                print(f"Warning: no responses for intent '{intent}'; using 'general'")
 
     def detect_intent(self, message):
-        """Detect user intent from message"""
-        message_lower = message.lower()
-
-        urge_keywords = ['urge', 'triggered', 'tempted', 'want to', 'craving']
-        anxiety_keywords = ['anxious', 'stressed', 'worried', 'nervous', 'panic']
-        success_keywords = ['good', 'great', 'clean', 'proud', 'strong']
-        relapse_keywords = ['relapsed', 'failed', 'gave in', 'broke']
-
-        if any(word in message_lower for word in urge_keywords):
-            return 'urge'
-        elif any(word in message_lower for word in anxiety_keywords):
-            return 'anxiety'
-        elif any(word in message_lower for word in success_keywords):
-            return 'success'
-        elif any(word in message_lower for word in relapse_keywords):
-            return 'relapse'
-        else:
-            return 'general'
+        """Detect user intent from message (highest-priority matching rule)"""
+        return self.intent_matcher.best(message)
 
     def get_system_prompt(self, user_data=None):
         """Generate system prompt for AI coach"""
@@ -352,59 +434,219 @@ Guidelines:
 
 Remember: You're a support tool, NOT a replacement for professional therapy. If someone needs urgent help, encourage them to contact a mental health professional."""
 
-    def get_ai_response(self, user_id, message, user_data=None):
-        """Get response from OpenRouter AI"""
-        try:
-            # Initialize conversation history for new users
-            if user_id not in self.conversation_history:
-                self.conversation_history[user_id] = []
-
-            # Add user message to history
-            self.conversation_history[user_id].append(("user", message))
-
-            # Prepare messages for LLM (including system prompt + history)
-            messages = [
-                {
-                    "role": "system",
-                    "content": self.get_system_prompt(user_data)
-                }
-            ]
-
-            # Add conversation history
-            for role, content in self.conversation_history[user_id]:
-                messages.append({
-                    "role": role,
-                    "content": content
-                })
-
-            # Call OpenRouter API
-            completion = self.client.chat.completions.create(
-                model="anthropic/claude-3.5-sonnet",  # Change this line  # Using Grok model
-                messages=messages,
-                temperature=0.7,
-                max_tokens=500
-            )
+    def build_messages(self, user_id, message, user_data=None):
+        """Record the user message and return the LLM prompt (system prompt + history)"""
+        # Add user message to history
+        self.memory.append(user_id, "user", message)
 
-            response_text = completion.choices[0].message.content
+        return self.context.build(user_id, self.get_system_prompt(user_data), self.memory.get_numbered(user_id))
 
-            # Add assistant response to history
-            self.conversation_history[user_id].append(("assistant", response_text))
+    def remember_reply(self, user_id, response_text):
+        """Add the assistant reply to the user's history (trimmed to the last turns)"""
+        self.memory.append(user_id, "assistant", response_text)
 
-            # Keep only last 20 messages (10 exchanges) to manage context length
-            if len(self.conversation_history[user_id]) > 20:
-                self.conversation_history[user_id] = self.conversation_history[user_id][-20:]
+    def cache_key(self, user_id, message, user_data=None, intent=None):
+        """Normalized message, intent, streak band and recent-history fingerprint"""
+        streak = user_data.get('streak', 0) if user_data else 0
+        return (
+            response_cache.normalize_message(message),
+            intent or self.detect_intent(message),
+            response_cache.streak_bucket(streak),
+            response_cache.history_fingerprint(self.memory.get(user_id))
+        )
 
+    def cached_reply(self, user_id, message, user_data=None, intent=None):
+        """(key, cached reply or None); key is None when caching is off"""
+        if self.response_cache is None:
+            return None, None
+        key = self.cache_key(user_id, message, user_data, intent)
+        return key, self.response_cache.get(key)
+
+    def local_reply(self, user_id, message, user_data=None, intent=None):
+        """Rule-based reply that still becomes part of the conversation context"""
+        response_text = self.get_rule_based_response(message, user_data, intent)
+        self.memory.append(user_id, "user", message)
+        self.remember_reply(user_id, response_text)
+        return response_text
+
+    def triaged_reply(self, user_id, message, user_data=None):
+        """Template reply when local triage says the LLM is not needed, else None"""
+        if self.triage is None:
+            return None
+        route, intent = self.triage.decide(message)
+        if route != 'rules':
+            return None
+        return self.local_reply(user_id, message, user_data, intent)
+
+    def provider_available(self):
+        """False while the circuit breaker is open"""
+        return self.breaker is None or self.breaker.allow()
+
+    def observe_provider(self, ok, started):
+        if self.breaker is not None:
+            self.breaker.record(ok, time.perf_counter() - started)
+
+    def call_provider(self, messages):
+        """Provider call on the LLM pool, reporting outcome and latency to the breaker"""
+        started = time.perf_counter()
+        try:
+            response_text = self.llm_pool.run(self.complete, messages)
+        except PoolSaturated:
+            raise  # our own capacity limit, not the provider's health
+        except Exception:
+            self.observe_provider(False, started)
+            raise
+        self.observe_provider(True, started)
+        return response_text
+
+    def record_route(self, route):
+        if self.triage is not None:
+            self.triage.record(route)
+
+    def get_ai_response(self, user_id, message, user_data=None, intent=None):
+        """Get response from OpenRouter AI (after local triage and the cache)"""
+        try:
+            response_text = self.triaged_reply(user_id, message, user_data)
+            if response_text is not None:
+                return response_text
+
+            key, response_text = self.cached_reply(user_id, message, user_data, intent)
+            if response_text is None and not self.provider_available():
+                return self.local_reply(user_id, message, user_data, intent)
+            messages = self.build_messages(user_id, message, user_data)
+
+            if response_text is None:
+                # Call OpenRouter API on the bounded pool; past the deadline we use rules
+                self.record_route('llm')
+                response_text = self.call_provider(messages)
+                if key is not None:
+                    self.response_cache.put(key, response_text)
+            else:
+                self.record_route('cache')
+
+            self.remember_reply(user_id, response_text)
             return response_text
 
         except Exception as e:
             print(f"Error getting AI response: {e}")
             # Fallback to rule-based response
-            return self.get_rule_based_response(message, user_data)
+            return self.get_rule_based_response(message, user_data, intent)
+
+    def stream_response(self, user_id, message, user_data=None, on_delta=None, intent=None):
+        """
+        Stream a reply, calling on_delta(text) for every token delta.
+
+        Runs on the caller's thread (use llm_pool.submit); returns the full
+        reply. Without AI, or when the provider fails before the first
+        token, the rule-based reply is sent as a single delta.
+        """
+        on_delta = on_delta or (lambda text: None)
+        if not self.use_ai:
+            response_text = self.get_rule_based_response(message, user_data, intent)
+            on_delta(response_text)
+            return response_text
 
-    def get_rule_based_response(self, message, user_data=None):
+        response_text = self.triaged_reply(user_id, message, user_data)
+        if response_text is not None:
+            on_delta(response_text)
+            return response_text
+
+        key, cached = self.cached_reply(user_id, message, user_data, intent)
+        if cached is None and not self.provider_available():
+            response_text = self.local_reply(user_id, message, user_data, intent)
+            on_delta(response_text)
+            return response_text
+        messages = self.build_messages(user_id, message, user_data)
+        if cached is not None:
+            self.record_route('cache')
+            on_delta(cached)
+            self.remember_reply(user_id, cached)
+            return cached
+
+        self.record_route('llm')
+        parts = []
+        started = time.perf_counter()
+        try:
+            for delta in self.complete_stream(messages):
+                if not parts:
+                    # For streams the breaker watches time to first token
+                    self.observe_provider(True, started)
+                parts.append(delta)
+                on_delta(delta)
+        except Exception as e:
+            print(f"Error streaming AI response: {e}")
+            if not parts:
+                self.observe_provider(False, started)
+                response_text = self.get_rule_based_response(message, user_data, intent)
+                on_delta(response_text)
+                return response_text
+            key = None  # never cache a partial reply
+
+        response_text = ''.join(parts)
+        if key is not None:
+            self.response_cache.put(key, response_text)
+        self.remember_reply(user_id, response_text)
+        return response_text
+
+    @staticmethod
+    def connect_providers(configs, timeout, max_retries, http_client=None):
+        """OpenAI-compatible clients for provider configs whose API key is set (sharing http_client)"""
+        providers = []
+        for config in configs:
+            if 'client' in config:
+                providers.append(config)
+                continue
+            api_key = os.environ.get(config.get('api_key_env', 'OPENROUTER_API_KEY'))
+            if not api_key:
+                print(f"Warning: {config.get('api_key_env', 'OPENROUTER_API_KEY')} not set. "
+                      f"Skipping provider {config['name']}.")
+                continue
+            try:
+                from openai import OpenAI
+                client = OpenAI(api_key=api_key, base_url=config['base_url'],
+                                timeout=timeout, max_retries=max_retries, http_client=http_client)
+            except Exception as e:
+                print(f"Warning: Failed to initialize {config['name']} client: {e}")
+                continue
+            providers.append(dict(config, client=client))
+            print(f"✓ {config['name']} AI client initialized ({config['model']})")
+        return providers
+
+    def complete(self, messages):
+        """Blocking provider call (runs on the LLM pool), hedged across providers if configured"""
+        if self.hedger is not None:
+            return self.hedger.complete(
+                lambda provider: self.create_completion(provider['client'], provider['model'], messages)
+            )
+        return self.create_completion(self.client, self.model, messages)
+
+    @staticmethod
+    def create_completion(client, model, messages):
+        completion = client.chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=0.7,
+            max_tokens=500
+        )
+        return completion.choices[0].message.content
+
+    def complete_stream(self, messages):
+        """Provider streaming call; yields content deltas as they arrive"""
+        stream = self.client.chat.completions.create(
+            model=self.model,
+            messages=messages,
+            temperature=0.7,
+            max_tokens=500,
+            stream=True
+        )
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+    def get_rule_based_response(self, message, user_data=None, intent=None):
         """Get rule-based response (fallback)"""
-        intent = self.detect_intent(message)
-        response = np.random.choice(self.responses[intent])
+        intent = intent or self.detect_intent(message)
+        response = np.random.choice(self.responses.get(intent) or self.responses['general'])
 
         # Personalize with user data
         if user_data and '{streak}' in response:
@@ -412,22 +654,92 @@ Remember: You're a support tool, NOT a replacement for professional therapy. If
 
         return response
 
-    def get_response(self, user_id, message, user_data=None):
-        """Main method to get response (AI or rule-based)"""
+    def get_response(self, user_id, message, user_data=None, intent=None):
+        """Main method to get response (AI or rule-based); intent may be precomputed"""
         if self.use_ai:
-            return self.get_ai_response(user_id, message, user_data)
+            return self.get_ai_response(user_id, message, user_data, intent)
         else:
-            return self.get_rule_based_response(message, user_data)
+            return self.get_rule_based_response(message, user_data, intent)
 
     def clear_history(self, user_id):
         """Clear conversation history for a user"""
-        if user_id in self.conversation_history:
-            del self.conversation_history[user_id]
+        self.memory.clear(user_id)
+        self.context.clear(user_id)
 
 # Initialize coach with AI mode (set to True to enable OpenRouter)
 # Set environment variable: export OPENROUTER_API_KEY=your_key_here
 USE_AI_COACH = os.environ.get('USE_AI_COACH', 'false').lower() == 'true'
-coach = SupportCoach(use_ai=USE_AI_COACH)
+
+def load_conversation(user_id, limit):
+    """Rebuild a user's recent coach context from chat_history (oldest first)"""
+    with app.app_context():
+        rows = get_repo().list_chat_history(user_id, limit=limit)
+    return [('assistant' if row.sender == 'coach' else 'user', row.message) for row in reversed(rows)]
+
+# One keep-alive, limited, time-bounded HTTP layer for all outbound calls
+outbound = OutboundHTTP(
+    pool_size=app.config['HTTP_POOL_SIZE'],
+    per_host_limit=app.config['HTTP_PER_HOST_LIMIT'],
+    connect_timeout=app.config['HTTP_CONNECT_TIMEOUT'],
+    read_timeout=app.config['HTTP_READ_TIMEOUT'],
+    max_retries=app.config['HTTP_MAX_RETRIES'],
+    retry_budget=app.config['HTTP_RETRY_BUDGET'],
+    local_port=app.config['PORT']
+)
+atexit.register(outbound.close)
+
+# Offline fake provider, also served over HTTP for clients that need a base_url (AutoGen)
+mock_llm = None
+if app.config['LLM_PROVIDER'] == 'mock':
+    mock_llm = MockLLM(
+        latency=app.config['MOCK_LLM_LATENCY'],
+        spread=app.config['MOCK_LLM_LATENCY_SPREAD'],
+        distribution=app.config['MOCK_LLM_DISTRIBUTION'],
+        tokens_per_second=app.config['MOCK_LLM_TOKENS_PER_SECOND'],
+        reply_tokens=app.config['MOCK_LLM_REPLY_TOKENS'],
+        error_rate=app.config['MOCK_LLM_ERROR_RATE'],
+        error_status=app.config['MOCK_LLM_ERROR_STATUS']
+    )
+    app.register_blueprint(mock_llm_blueprint(mock_llm), url_prefix='/mock-llm/v1')
+    print("✓ Mock LLM provider enabled at /mock-llm/v1")
+
+coach = SupportCoach(
+    use_ai=USE_AI_COACH or mock_llm is not None,
+    llm_deadline=app.config['COACH_LLM_DEADLINE'],
+    llm_timeout=app.config['COACH_LLM_TIMEOUT'],
+    llm_max_retries=app.config['COACH_LLM_MAX_RETRIES'],
+    llm_workers=app.config['COACH_LLM_WORKERS'],
+    llm_max_in_flight=app.config['COACH_LLM_MAX_IN_FLIGHT'],
+    cache_enabled=app.config['COACH_CACHE_ENABLED'],
+    cache_max_entries=app.config['COACH_CACHE_MAX_ENTRIES'],
+    cache_ttl=app.config['COACH_CACHE_TTL'],
+    memory_turns=app.config['COACH_MEMORY_TURNS'],
+    memory_max_users=app.config['COACH_MEMORY_MAX_USERS'],
+    memory_budget=app.config['COACH_MEMORY_BUDGET_MB'] * 1024 * 1024,
+    history_loader=load_conversation,
+    context_tokens=app.config['COACH_CONTEXT_TOKENS'],
+    summary_tokens=app.config['COACH_SUMMARY_TOKENS'],
+    triage_enabled=app.config['COACH_TRIAGE_ENABLED'],
+    triage_threshold=app.config['COACH_TRIAGE_RULE_THRESHOLD'],
+    triage_max_words=app.config['COACH_TRIAGE_MAX_RULE_WORDS'],
+    llm_provider=app.config['LLM_PROVIDER'],
+    mock_llm=mock_llm,
+    breaker_enabled=app.config['COACH_BREAKER_ENABLED'],
+    breaker_window=app.config['COACH_BREAKER_WINDOW'],
+    breaker_min_calls=app.config['COACH_BREAKER_MIN_CALLS'],
+    breaker_error_rate=app.config['COACH_BREAKER_ERROR_RATE'],
+    breaker_latency_slo=app.config['COACH_BREAKER_P95_SLO'],
+    breaker_open_seconds=app.config['COACH_BREAKER_OPEN_SECONDS'],
+    llm_providers=app.config['COACH_LLM_PROVIDERS'],
+    hedge_delay=app.config['COACH_HEDGE_DELAY'],
+    hedge_percentile=app.config['COACH_HEDGE_PERCENTILE'],
+    hedge_initial_delay=app.config['COACH_HEDGE_INITIAL_DELAY'],
+    hedge_max_ratio=app.config['COACH_HEDGE_MAX_RATIO'],
+    http_client=outbound.openai_http_client(max_connections=app.config['COACH_LLM_MAX_IN_FLIGHT'])
+)
+atexit.register(coach.llm_pool.shutdown)
+if coach.hedger is not None:
+    atexit.register(coach.hedger.shutdown)
 
 # ==================== Routes ====================
 
@@ -461,32 +773,21 @@ def register():
     if not username or not password:
         return jsonify({'error': 'Username and password required'}), 400
 
-    db = get_db()
+    repo = get_repo()
     try:
         # Generate anonymous ID
         anonymous_id = f"anon_{os.urandom(8).hex()}"
         password_hash = generate_password_hash(password)
 
-        cursor = db.execute(
-            'INSERT INTO users (username, password_hash, anonymous_id, consent_research) VALUES (?, ?, ?, ?)',
-            (username, password_hash, anonymous_id, consent_research)
-        )
-        user_id = cursor.lastrowid
-
-        # Initialize streak
-        db.execute(
-            'INSERT INTO streaks (user_id, current_streak, longest_streak) VALUES (?, 0, 0)',
-            (user_id,)
-        )
-        db.commit()
+        # Creates the user and their initial streak
+        user_id = repo.create_user(username, password_hash, anonymous_id, consent_research)
+        repo.commit()
 
         session['user_id'] = user_id
         return jsonify({'success': True, 'user_id': user_id, 'anonymous_id': anonymous_id})
 
     except sqlite3.IntegrityError:
         return jsonify({'error': 'Username already exists'}), 400
-    finally:
-        db.close()
 
 
 @app.route('/api/login', methods=['POST'])
@@ -496,21 +797,23 @@ def login():
     username = data.get('username')
     password = data.get('password')
 
-    db = get_db()
-    user = db.execute('SELECT * FROM users WHERE username = ?', (username,)).fetchone()
-    db.close()
+    user = get_repo().get_user_by_username(username)
 
-    if user and check_password_hash(user['password_hash'], password):
+    if user and check_password_hash(user.password_hash, password):
         session.permanent = True  # ← Add this
-        session['user_id'] = user['id']
-        return jsonify({'success': True, 'user_id': user['id']})
+        session['user_id'] = user.id
+        return jsonify({'success': True, 'user_id': user.id})
 
     return jsonify({'error': 'Invalid credentials'}), 401
 
 @app.route('/api/logout', methods=['POST'])
 def logout():
     """User logout"""
-    session.pop('user_id', None)
+    user_id = session.pop('user_id', None)
+    session_id = session.pop('current_session_id', None)
+    if user_id and session_id:
+        stop_brain_state_stream(user_id)
+        finish_stream_session(user_id, session_id)
     return jsonify({'success': True})
 
 @app.route('/api/upload_eeg', methods=['POST'])
@@ -536,14 +839,9 @@ def upload_eeg():
         eeg_data = np.load(filepath)
 
         # Create session
-        db = get_db()
-        cursor = db.execute(
-            'INSERT INTO eeg_sessions (user_id) VALUES (?)',
-            (session['user_id'],)
-        )
-        session_id = cursor.lastrowid
-        db.commit()
-        db.close()
+        repo = get_repo()
+        session_id = repo.create_eeg_session(session['user_id'])
+        repo.commit()
 
         # Analyze data (simplified for demo)
         result = classifier.predict(eeg_data[:500])  # Use first 2 seconds
@@ -563,20 +861,26 @@ def start_stream():
     if 'user_id' not in session:
         return jsonify({'error': 'Not authenticated'}), 401
 
-    db = get_db()
-    cursor = db.execute(
-        'INSERT INTO eeg_sessions (user_id) VALUES (?)',
-        (session['user_id'],)
-    )
-    session_id = cursor.lastrowid
-    db.commit()
-    db.close()
+    repo = get_repo()
+    session_id = repo.create_eeg_session(session['user_id'])
+    repo.commit()
 
     session['current_session_id'] = session_id
+    ended_streams.pop(session['user_id'], None)
+
+    # Push mode (socket clients): the server classifies and writes; pollers write via /api/state
+    data = request.get_json(silent=True) or request.form
+    push = str(data.get('push', '')).lower() in ('true', '1')
+    if push:
+        start_brain_state_stream(session['user_id'], session_id)
+    else:
+        stop_brain_state_stream(session['user_id'])
 
     return jsonify({
         'success': True,
         'session_id': session_id,
+        'push': push,
+        'room': user_room(session['user_id']),
         'message': 'Streaming session started'
     })
 
@@ -590,13 +894,10 @@ def stop_stream():
     if not session_id:
         return jsonify({'error': 'No active session'}), 400
 
-    db = get_db()
-    db.execute(
-        'UPDATE eeg_sessions SET session_end = CURRENT_TIMESTAMP WHERE id = ?',
-        (session_id,)
-    )
-    db.commit()
-    db.close()
+    stop_brain_state_stream(session['user_id'])
+    # Already finished if the server stopped the stream on its own
+    if current_stream_session() is not None:
+        finish_stream_session(session['user_id'], session_id)
 
     session.pop('current_session_id', None)
 
@@ -608,24 +909,98 @@ def get_state():
     if 'user_id' not in session:
         return jsonify({'error': 'Not authenticated'}), 401
 
-    # Generate simulated EEG data for demo
-    simulated_eeg = np.random.randn(500, 19) * 50  # 2 seconds of data
+    result = simulate_brain_state()
 
-    result = classifier.predict(simulated_eeg)
-
-    # Save state to database
-    session_id = session.get('current_session_id')
-    if session_id:
-        db = get_db()
-        db.execute(
-            'INSERT INTO brain_states (session_id, state, confidence, risk_score) VALUES (?, ?, ?, ?)',
-            (session_id, result['state'], result['confidence'], result['risk_score'])
-        )
-        db.commit()
-        db.close()
+    # Queue state for the next batched write, unless a server stream is already writing it
+    session_id = current_stream_session()
+    stream = active_streams.get(session['user_id'])
+    if session_id and not (stream and stream['session_id'] == session_id):
+        brain_state_buffer.add(session_id, result, session['user_id'])
 
     return jsonify(result)
 
+def simulate_brain_state():
+    """Classify a simulated 2 second EEG window for demo streaming"""
+    simulated_eeg = np.random.randn(500, 19) * 50
+    return classifier.predict(simulated_eeg)
+
+# ==================== Brain State Streaming ====================
+
+# Server-side streams keyed by user_id:
+# {'session_id', 'is_active', 'sids' (subscribed sockets), 'started', 'idle_since'}
+active_streams = {}
+# user_id -> EEG session id of the last stream the server stopped on its own
+# (the Flask session cookie cannot be updated from the stream task)
+ended_streams = {}
+
+
+def current_stream_session():
+    """The request's open EEG session id; forgets one whose stream the server already ended"""
+    session_id = session.get('current_session_id')
+    if session_id is not None and ended_streams.get(session['user_id']) == session_id:
+        session.pop('current_session_id', None)
+        return None
+    return session_id
+
+
+def user_room(user_id):
+    """Socket.IO room that receives a user's brain state updates"""
+    return f"user_{user_id}"
+
+
+def finish_stream_session(user_id, session_id):
+    """Write out buffered states and close the EEG session"""
+    # Make sure every buffered state of this session is on disk
+    brain_state_buffer.flush()
+
+    repo = get_repo()
+    repo.end_eeg_session(user_id, session_id)
+    repo.commit()
+
+
+def run_brain_state_stream(user_id, stream):
+    """Classify on a fixed schedule and push each state to the user's room"""
+    interval = app.config['BRAIN_STATE_STREAM_INTERVAL']
+    idle_timeout = app.config['BRAIN_STATE_STREAM_IDLE_TIMEOUT']
+    max_seconds = app.config['BRAIN_STATE_STREAM_MAX_SECONDS']
+    while stream['is_active']:
+        now = time.monotonic()
+        idle = not stream['sids'] and now - stream['idle_since'] > idle_timeout
+        if idle or now - stream['started'] > max_seconds:
+            # Abandoned (no subscriber) or running too long: end it like /api/stop_stream would
+            if active_streams.get(user_id) is stream:
+                stream['is_active'] = False
+                with app.app_context():
+                    finish_stream_session(user_id, stream['session_id'])
+                ended_streams[user_id] = stream['session_id']
+                if active_streams.get(user_id) is stream:
+                    active_streams.pop(user_id, None)
+                socketio.emit('stream_stopped', {'reason': 'idle' if idle else 'max_duration'},
+                              room=user_room(user_id), namespace='/')
+            break
+        result = simulate_brain_state()
+        if not stream['is_active']:
+            break
+        brain_state_buffer.add(stream['session_id'], result, user_id)
+        socketio.emit('brain_state', result, room=user_room(user_id), namespace='/')
+        socketio.sleep(interval)
+
+
+def start_brain_state_stream(user_id, session_id):
+    """Start (or restart) the background stream for a user"""
+    stop_brain_state_stream(user_id)
+    now = time.monotonic()
+    stream = {'session_id': session_id, 'is_active': True, 'sids': set(), 'started': now, 'idle_since': now}
+    active_streams[user_id] = stream
+    socketio.start_background_task(run_brain_state_stream, user_id, stream)
+
+
+def stop_brain_state_stream(user_id):
+    """Stop the user's background stream if one is running"""
+    stream = active_streams.pop(user_id, None)
+    if stream:
+        stream['is_active'] = False
+
 @app.route('/api/emergency', methods=['POST'])
 def emergency():
     """Handle emergency support request"""
@@ -636,13 +1011,9 @@ def emergency():
     action = data.get('action', 'breathing')
 
     # Log emergency event
-    db = get_db()
-    db.execute(
-        'INSERT INTO emergency_events (user_id, action_taken) VALUES (?, ?)',
-        (session['user_id'], action)
-    )
-    db.commit()
-    db.close()
+    repo = get_repo()
+    repo.log_emergency(session['user_id'], action)
+    repo.commit()
 
     breathing_exercises = {
         'box': {
@@ -682,20 +1053,10 @@ def get_streak():
     if 'user_id' not in session:
         return jsonify({'error': 'Not authenticated'}), 401
 
-    db = get_db()
-    streak = db.execute(
-        'SELECT * FROM streaks WHERE user_id = ?',
-        (session['user_id'],)
-    ).fetchone()
-    db.close()
+    streak = get_repo().get_streak(session['user_id'])
 
     if streak:
-        return jsonify({
-            'current_streak': streak['current_streak'],
-            'longest_streak': streak['longest_streak'],
-            'total_clean_days': streak['total_clean_days'],
-            'last_check_in': streak['last_check_in']
-        })
+        return jsonify(streak._asdict())
 
     return jsonify({'current_streak': 0, 'longest_streak': 0, 'total_clean_days': 0})
 
@@ -708,50 +1069,36 @@ def update_streak():
     data = request.get_json()
     is_clean = data.get('is_clean', True)
 
-    db = get_db()
-    streak = db.execute(
-        'SELECT * FROM streaks WHERE user_id = ?',
-        (session['user_id'],)
-    ).fetchone()
+    repo = get_repo()
+    streak = repo.get_streak(session['user_id'])
 
     today = datetime.now().date()
 
     if streak:
-        current = streak['current_streak']
-        longest = streak['longest_streak']
-        total = streak['total_clean_days']
-
-        if is_clean:
-            current += 1
-            total += 1
-            longest = max(longest, current)
-        else:
-            current = 0
-
-        db.execute(
-            'UPDATE streaks SET current_streak = ?, longest_streak = ?, total_clean_days = ?, last_check_in = ? WHERE user_id = ?',
-            (current, longest, total, today, session['user_id'])
+        current, longest, total = offline_sync.fold_checkins(
+            streak.current_streak, streak.longest_streak, streak.total_clean_days, [is_clean]
         )
+        repo.update_streak(session['user_id'], current, longest, total, today)
 
-    db.commit()
-    db.close()
+    repo.commit()
 
     return jsonify({'success': True, 'current_streak': current, 'longest_streak': longest})
 
 @app.route('/api/journal', methods=['GET'])
 def get_journal():
-    """Get journal entries"""
+    """Get journal entries, newest first (keyset-paginated)"""
     if 'user_id' not in session:
         return jsonify({'error': 'Not authenticated'}), 401
 
-    db = get_db()
-    entries = db.execute(
-        'SELECT * FROM journal_entries WHERE user_id = ? ORDER BY entry_date DESC LIMIT 30',
-        (session['user_id'],)
-    ).fetchall()
-    db.close()
+    try:
+        limit, before = page_args(default_limit=30)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
-    return jsonify([dict(entry) for entry in entries])
+    entries = get_repo().list_journal(session['user_id'], limit=limit, before=before)
+
+    return paged_response([entry._asdict() for entry in entries],
+                          next_cursor(entries, limit, 'entry_date'))
 
 @app.route('/api/journal', methods=['POST'])
 def create_journal():
@@ -765,17 +1112,81 @@ def create_journal():
     note = data.get('note')
     entry_date = data.get('date', datetime.now().date())
 
-    db = get_db()
-    cursor = db.execute(
-        'INSERT INTO journal_entries (user_id, entry_date, mood, triggers, note) VALUES (?, ?, ?, ?, ?)',
-        (session['user_id'], entry_date, mood, triggers, note)
-    )
-    entry_id = cursor.lastrowid
-    db.commit()
-    db.close()
+    repo = get_repo()
+    entry_id = repo.add_journal_entry(session['user_id'], entry_date, mood, triggers, note)
+    repo.commit()
 
     return jsonify({'success': True, 'entry_id': entry_id})
 
+@app.route('/api/sync', methods=['POST'])
+def bulk_sync():
+    """Apply an ordered backlog of journal entries and check-ins in one transaction"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+
+    items = (request.get_json(silent=True) or {}).get('items')
+    if not isinstance(items, list):
+        return jsonify({'error': 'items must be a list'}), 400
+    if len(items) > app.config['SYNC_MAX_ITEMS']:
+        return jsonify({'error': f"At most {app.config['SYNC_MAX_ITEMS']} items per request"}), 413
+
+    user_id = session['user_id']
+    today = datetime.now().date()
+    results, journal_rows, checkins = [], [], []
+    seen_ids = set()
+
+    repo = get_repo()
+    streak = repo.get_streak(user_id)
+    streak = streak._asdict() if streak else None
+
+    for index, item in enumerate(items):
+        client_id = item.get('client_id', index) if isinstance(item, dict) else index
+        if isinstance(item, dict) and isinstance(item.get('client_id'), (str, int)):
+            # A client retrying a half-sent batch may repeat items; apply each id once
+            if client_id in seen_ids:
+                results.append({'client_id': client_id, 'status': 'skipped', 'error': 'duplicate client_id'})
+                continue
+            seen_ids.add(client_id)
+        try:
+            kind, values = offline_sync.validate_item(item, today)
+        except ValueError as e:
+            results.append({'client_id': client_id, 'status': 'rejected', 'error': str(e)})
+            continue
+        if kind == 'journal':
+            journal_rows.append(values)
+        elif streak is None:
+            results.append({'client_id': client_id, 'status': 'skipped', 'error': 'no streak record'})
+            continue
+        else:
+            checkins.append(values)
+        results.append({'client_id': client_id, 'status': 'applied', 'type': kind})
+
+    try:
+        if journal_rows:
+            repo.add_journal_entries(user_id, journal_rows)
+        if checkins:
+            # Streak is recomputed once for the whole batch
+            current, longest, total = offline_sync.fold_checkins(
+                streak['current_streak'], streak['longest_streak'], streak['total_clean_days'],
+                [is_clean for _, is_clean in checkins]
+            )
+            last_check_in = max(str(streak['last_check_in'] or ''), max(d for d, _ in checkins).isoformat())
+            repo.update_streak(user_id, current, longest, total, last_check_in)
+            streak.update(current_streak=current, longest_streak=longest,
+                          total_clean_days=total, last_check_in=last_check_in)
+        repo.commit()
+    except Exception as e:
+        repo.rollback()
+        return jsonify({'error': f'Sync failed: {e}'}), 500
+
+    return jsonify({
+        'applied': sum(result['status'] == 'applied' for result in results),
+        'rejected': sum(result['status'] == 'rejected' for result in results),
+        'skipped': sum(result['status'] == 'skipped' for result in results),
+        'results': results,
+        'streak': streak
+    })
+
 @app.route('/api/nlp/message', methods=['POST'])
 def chat_message():
     """Send message to AI coach"""
@@ -791,53 +1202,105 @@ def chat_message():
     user_id = session['user_id']
 
     # Get user data for personalization
-    db = get_db()
-    streak = db.execute(
-        'SELECT current_streak FROM streaks WHERE user_id = ?',
-        (user_id,)
-    ).fetchone()
+    repo = get_repo()
+    user_data = {'streak': repo.get_current_streak(user_id)}
 
-    user_data = {'streak': streak['current_streak'] if streak else 0}
+    # Load the coach's context before this message is stored, so it is not replayed twice
+    if coach.use_ai:
+        coach.memory.get(user_id)
 
     # Save user message
-    db.execute(
-        'INSERT INTO chat_history (user_id, message, sender) VALUES (?, ?, ?)',
-        (user_id, message, 'user')
-    )
+    repo.add_chat_message(user_id, message, 'user')
+
+    # Detected once and reused by the coach and the response
+    intent = coach.detect_intent(message)
+
+    if data.get('stream'):
+        repo.commit()
+        message_id = start_coach_stream(user_id, message, user_data, intent)
+        return jsonify({
+            'success': True,
+            'streaming': True,
+            'message_id': message_id,
+            'room': coach_room(user_id),
+            'intent': intent,
+            'ai_mode': coach.use_ai
+        })
 
     # Generate AI response (using OpenRouter if enabled, otherwise rule-based)
-    response = coach.get_response(user_id, message, user_data)
+    response = coach.get_response(user_id, message, user_data, intent=intent)
 
     # Save AI response
-    db.execute(
-        'INSERT INTO chat_history (user_id, message, sender) VALUES (?, ?, ?)',
-        (user_id, response, 'coach')
-    )
-
-    db.commit()
-    db.close()
+    repo.add_chat_message(user_id, response, 'coach')
+    repo.commit()
 
     return jsonify({
         'success': True,
         'response': response,
-        'intent': coach.detect_intent(message),
+        'intent': intent,
         'ai_mode': coach.use_ai
     })
 
+def coach_room(user_id):
+    """Socket.IO room that receives a user's streamed coach replies"""
+    return f"coach_{user_id}"
+
+
+def run_coach_stream(user_id, message, user_data, message_id, intent=None, rules_only=False):
+    """Forward coach deltas to the user's room and persist the full reply at the end"""
+    room = coach_room(user_id)
+
+    def forward(delta):
+        socketio.emit('coach_delta', {'message_id': message_id, 'delta': delta}, room=room, namespace='/')
+
+    try:
+        if rules_only:
+            response = coach.get_rule_based_response(message, user_data, intent)
+            forward(response)
+        else:
+            response = coach.stream_response(user_id, message, user_data, on_delta=forward, intent=intent)
+    except Exception as e:
+        # Pool tasks swallow exceptions; fall back so the client never waits forever
+        print(f"Error in coach stream: {e}")
+        response = coach.get_rule_based_response(message, user_data, intent)
+
+    try:
+        with app.app_context():
+            repo = get_repo()
+            repo.add_chat_message(user_id, response, 'coach')
+            repo.commit()
+    except Exception as e:
+        print(f"Error saving coach reply: {e}")
+
+    # coach_done carries the full reply, replacing any partial deltas on the client
+    socketio.emit('coach_done', {'message_id': message_id, 'response': response}, room=room, namespace='/')
+
+
+def start_coach_stream(user_id, message, user_data, intent=None):
+    """Stream a coach reply on the LLM pool; returns the id used in socket events"""
+    message_id = uuid.uuid4().hex
+    try:
+        coach.llm_pool.submit(run_coach_stream, user_id, message, user_data, message_id, intent)
+    except PoolSaturated:
+        # Provider capacity is exhausted; answer from the rules right away
+        run_coach_stream(user_id, message, user_data, message_id, intent, rules_only=True)
+    return message_id
+
 @app.route('/api/chat/history', methods=['GET'])
 def chat_history():
-    """Get chat history"""
+    """Get the latest chat messages in display order; the cursor pages back in time"""
     if 'user_id' not in session:
         return jsonify({'error': 'Not authenticated'}), 401
 
-    db = get_db()
-    messages = db.execute(
-        'SELECT * FROM chat_history WHERE user_id = ? ORDER BY timestamp ASC LIMIT 100',
-        (session['user_id'],)
-    ).fetchall()
-    db.close()
+    try:
+        limit, before = page_args(default_limit=100)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    messages = get_repo().list_chat_history(session['user_id'], limit=limit, before=before)
 
-    return jsonify([dict(msg) for msg in messages])
+    return paged_response([msg._asdict() for msg in reversed(messages)],
+                          next_cursor(messages, limit, 'timestamp'))
 
 @app.route('/api/chat/clear', methods=['POST'])
 def clear_chat():
@@ -848,10 +1311,9 @@ def clear_chat():
     user_id = session['user_id']
 
     # Clear database history
-    db = get_db()
-    db.execute('DELETE FROM chat_history WHERE user_id = ?', (user_id,))
-    db.commit()
-    db.close()
+    repo = get_repo()
+    repo.clear_chat_history(user_id)
+    repo.commit()
 
     # Clear in-memory conversation history
     coach.clear_history(user_id)
@@ -861,89 +1323,126 @@ def clear_chat():
         'message': 'Chat history cleared'
     })
 
+@app.route('/api/search', methods=['GET'])
+def search_history():
+    """Ranked full-text search over the user's journal and chat history"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+
+    text = request.args.get('q', '').strip()
+    scope = request.args.get('scope', 'all')
+    if not text:
+        return jsonify({'error': 'Query required'}), 400
+    if scope not in ('all', *search.SEARCH_INDEXES):
+        return jsonify({'error': f'Invalid scope: {scope}'}), 400
+
+    try:
+        limit = min(max(int(request.args.get('limit', 20)), 1), 100)
+        offset = max(int(request.args.get('offset', 0)), 0)
+    except ValueError:
+        return jsonify({'error': 'limit and offset must be integers'}), 400
+
+    results = get_repo().search(session['user_id'], text, scope, limit=limit, offset=offset)
+
+    return jsonify({
+        'results': [result._asdict() for result in results],
+        'next_offset': offset + limit if len(results) == limit else None
+    })
+
 @app.route('/api/coach/status', methods=['GET'])
 def coach_status():
     """Get AI coach status and configuration"""
     return jsonify({
         'ai_mode': coach.use_ai,
         'model': 'x-ai/grok-2-1212' if coach.use_ai else 'rule-based',
-        'description': 'OpenRouter AI-powered responses' if coach.use_ai else 'Rule-based pattern matching'
+        'description': 'OpenRouter AI-powered responses' if coach.use_ai else 'Rule-based pattern matching',
+        'llm_pool': dict(coach.llm_pool.stats),
+        'response_cache': coach.response_cache.stats() if coach.response_cache else None,
+        'memory': coach.memory.stats(),
+        'context': dict(coach.context.stats),
+        'triage': dict(coach.triage.stats) if coach.triage else None,
+        'mock_llm': dict(mock_llm.stats) if mock_llm else None,
+        'breaker': coach.breaker.snapshot() if coach.breaker else None,
+        'hedging': coach.hedger.snapshot() if coach.hedger else None
     })
 
 @app.route('/admin', methods=['GET'])
 def admin_dashboard():
     """Admin dashboard with anonymized analytics"""
-    db = get_db()
-
-    # Aggregate statistics
-    total_users = db.execute('SELECT COUNT(*) as count FROM users').fetchone()['count']
-    active_sessions = db.execute('SELECT COUNT(*) as count FROM eeg_sessions WHERE session_end IS NULL').fetchone()['count']
-    total_clean_days = db.execute('SELECT SUM(total_clean_days) as total FROM streaks').fetchone()['total'] or 0
-    avg_streak = db.execute('SELECT AVG(current_streak) as avg FROM streaks').fetchone()['avg'] or 0
-
-    # Emergency events
-    emergency_count = db.execute('SELECT COUNT(*) as count FROM emergency_events WHERE timestamp > datetime("now", "-7 days")').fetchone()['count']
-
-    # State distribution
-    states = db.execute('''
-        SELECT state, COUNT(*) as count 
-        FROM brain_states 
-        WHERE timestamp > datetime("now", "-7 days")
-        GROUP BY state
-    ''').fetchall()
-
-    db.close()
+    totals = get_repo().admin_stats()
 
     stats = {
-        'total_users': total_users,
-        'active_sessions': active_sessions,
-        'total_clean_days': total_clean_days,
-        'avg_current_streak': round(avg_streak, 1),
-        'emergency_events_week': emergency_count,
-        'state_distribution': {row['state']: row['count'] for row in states}
+        'total_users': totals['total_users'],
+        'active_sessions': totals['active_sessions'],
+        'total_clean_days': totals['total_clean_days'],
+        'avg_current_streak': round(totals['avg_current_streak'], 1),
+        'emergency_events_week': totals['emergency_events_week'],
+        # State distribution from the per-session aggregates
+        'state_distribution': {
+            state: totals[f'{state}_week']
+            for state in ('focused', 'triggered') if totals[f'{state}_week']
+        }
     }
 
     return jsonify(stats)
 
 @app.route('/api/analytics/user', methods=['GET'])
 def user_analytics():
-    """Get user-specific analytics"""
+    """Get user-specific analytics (brain states keyset-paginated via ?cursor=)"""
     if 'user_id' not in session:
         return jsonify({'error': 'Not authenticated'}), 401
 
-    db = get_db()
+    try:
+        limit, before = page_args(default_limit=100, max_limit=1000)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    repo = get_repo()
 
     # Get user sessions
-    sessions = db.execute('''
-        SELECT id, session_start, session_end, avg_risk_score, triggered_count, focused_count
-        FROM eeg_sessions
-        WHERE user_id = ?
-        ORDER BY session_start DESC
-        LIMIT 10
-    ''', (session['user_id'],)).fetchall()
+    sessions = repo.list_eeg_sessions(session['user_id'], limit=10)
 
     # Get brain states over time
-    states_timeline = db.execute('''
-        SELECT bs.timestamp, bs.state, bs.risk_score
-        FROM brain_states bs
-        JOIN eeg_sessions es ON bs.session_id = es.id
-        WHERE es.user_id = ?
-        ORDER BY bs.timestamp DESC
-        LIMIT 100
-    ''', (session['user_id'],)).fetchall()
+    states_timeline = repo.list_recent_states(session['user_id'], limit=limit, before=before)
+
+    return jsonify({
+        'sessions': [s._asdict() for s in sessions],
+        'states_timeline': [s._asdict() for s in states_timeline],
+        'next_cursor': next_cursor(states_timeline, limit, 'timestamp')
+    })
 
-    db.close()
+
+@app.route('/api/analytics/timeline', methods=['GET'])
+def user_timeline():
+    """Get rolled-up brain states at a resolution that fits the time range"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+
+    try:
+        start, end = rollups.parse_range(request.args.get('start'), request.args.get('end'))
+    except ValueError as e:
+        return jsonify({'error': f'Invalid time range: {e}'}), 400
+
+    resolution = request.args.get('resolution') or rollups.choose_resolution(
+        start, end, app.config['TIMELINE_MAX_POINTS']
+    )
+    if resolution not in rollups.RESOLUTIONS:
+        return jsonify({'error': f'Invalid resolution: {resolution}'}), 400
+
+    buckets = get_repo().state_timeline(session['user_id'], start, end, resolution)
 
     return jsonify({
-        'sessions': [dict(s) for s in sessions],
-        'states_timeline': [dict(s) for s in states_timeline]
+        'resolution': resolution,
+        'start': rollups.format_timestamp(start),
+        'end': rollups.format_timestamp(end),
+        'buckets': buckets
     })
 
 
 
 
-# Agent server URL
-AGENTS_SERVER = 'http://localhost:5000'
+# Agent server URL (this server by default, in which case the proxy dispatches in-process)
+AGENTS_SERVER = app.config['AGENTS_SERVER']
 
 
 @app.route('/api/debate/start', methods=['POST'])
@@ -955,13 +1454,28 @@ def start_agent_debate():
     data = request.get_json()
     topic = data.get('topic')
 
+    debate_session_id = f"user_{session['user_id']}_{topic}"
+    if outbound.is_local(AGENTS_SERVER):
+        # Same process: no HTTP hop back into ourselves
+        result, status = begin_debate(topic, debate_session_id)
+        return jsonify(result), status
+
     # Forward to agents server
-    response = requests.post(f'{AGENTS_SERVER}/api/agents/start_debate', json={
-        'topic': topic,
-        'session_id': f"user_{session['user_id']}_{topic}"
-    })
+    try:
+        response = outbound.post(f'{AGENTS_SERVER}/api/agents/start_debate', json={
+            'topic': topic,
+            'session_id': debate_session_id
+        })
+    except (requests.RequestException, HostBusy) as e:
+        return jsonify({'error': f'Agents server unavailable: {e}'}), 502
+
+    try:
+        body = response.json()
+    except ValueError:
+        # An HTML error page or truncated body from a proxy in between
+        return jsonify({'error': f'Agents server sent an invalid response ({response.status_code})'}), 502
 
-    return jsonify(response.json())
+    return jsonify(body), response.status_code
 
 
 
@@ -1069,10 +1583,14 @@ OPENAI_API_KEY='replace the key here '
 import autogen
 from autogen import AssistantAgent, UserProxyAgent, GroupChat, GroupChatManager
 
-# Configure OpenAI
-config_list = [{'model': 'gpt-4o-mini', 'api_key': OPENAI_API_KEY}]
+# Configure OpenAI (or the local mock provider for offline load tests)
+if app.config['LLM_PROVIDER'] == 'mock':
+    config_list = [{'model': 'mock', 'api_key': 'mock', 'base_url': app.config['MOCK_LLM_BASE_URL']}]
+else:
+    config_list = [{'model': 'gpt-4o-mini', 'api_key': OPENAI_API_KEY}]
 llm_config = {
-    "cache_seed": 42,
+    # Cached debates would hide the provider under load tests
+    "cache_seed": None if app.config['LLM_PROVIDER'] == 'mock' else 42,
     "temperature": 0.7,
     "config_list": config_list,
     "timeout": 120,
@@ -1280,6 +1798,9 @@ def run_debate_async(session_id, initial_prompt, selected_agents):
 
 
 
+DEFAULT_DEBATE_AGENTS = ['sarah', 'james', 'maria', 'david', 'lisa', 'michael']
+
+
 @app.route('/api/agents/start_debate', methods=['POST'])
 def start_agent_debate_local():
     """Start agent debate with selected agents"""
@@ -1287,22 +1808,28 @@ def start_agent_debate_local():
         return jsonify({'error': 'Not authenticated'}), 401
 
     data = request.get_json()
-    topic = data.get('topic')
-    debate_session_id = data.get('session_id', f"debate_{datetime.now().timestamp()}")
-    selected_agents = data.get('selected_agents', ['sarah', 'james', 'maria', 'david', 'lisa', 'michael'])
+    result, status = begin_debate(
+        data.get('topic'),
+        data.get('session_id', f"debate_{datetime.now().timestamp()}"),
+        data.get('selected_agents', DEFAULT_DEBATE_AGENTS)
+    )
+    return jsonify(result), status
+
 
+def begin_debate(topic, debate_session_id, selected_agents=DEFAULT_DEBATE_AGENTS):
+    """Validate and start a debate on a background thread; returns (body, status)"""
     print(f"🔍 DEBUG - Received topic: '{topic}'")
     print(f"🔍 DEBUG - Selected agents: {selected_agents}")
     print(f"🔍 DEBUG - Topic in prompts? {topic in topic_prompts}")
 
     if topic not in topic_prompts:
-        return jsonify({'error': f'Invalid topic: {topic}'}), 400
+        return {'error': f'Invalid topic: {topic}'}, 400
 
     if len(selected_agents) < 2:
-        return jsonify({'error': 'At least 2 agents required'}), 400
+        return {'error': 'At least 2 agents required'}, 400
 
     if len(selected_agents) > 6:
-        return jsonify({'error': 'Maximum 6 agents allowed'}), 400
+        return {'error': 'Maximum 6 agents allowed'}, 400
 
     active_debates[debate_session_id] = {
         'topic': topic,
@@ -1320,12 +1847,12 @@ def start_agent_debate_local():
     thread.daemon = True
     thread.start()
 
-    return jsonify({
+    return {
         'success': True,
         'session_id': debate_session_id,
         'topic': topic,
         'agent_count': len(selected_agents)
-    })
+    }, 200
 
 
 
@@ -1410,6 +1937,57 @@ def handle_join(data):
                 emit('debate_message', msg)
 
 
+@socketio.on('join_stream')
+def handle_join_stream(data=None):
+    """Subscribe the connected client to its user's brain state room"""
+    if 'user_id' not in session:
+        emit('stream_error', {'error': 'Not authenticated'})
+        return
+    join_room(user_room(session['user_id']))
+    stream = active_streams.get(session['user_id'])
+    if stream:
+        stream['sids'].add(request.sid)
+    else:
+        # Rejoining after the stream ended (e.g. reconnect past the idle timeout)
+        emit('stream_stopped', {'reason': 'not_running'})
+    emit('stream_joined', {'room': user_room(session['user_id'])})
+
+
+@socketio.on('join_coach')
+def handle_join_coach(data=None):
+    """Subscribe the connected client to its user's streamed coach replies"""
+    if 'user_id' not in session:
+        emit('coach_error', {'error': 'Not authenticated'})
+        return
+    join_room(coach_room(session['user_id']))
+    emit('coach_joined', {'room': coach_room(session['user_id'])})
+
+
+def unsubscribe_stream(user_id, sid):
+    stream = active_streams.get(user_id)
+    if stream and sid in stream['sids']:
+        stream['sids'].discard(sid)
+        if not stream['sids']:
+            stream['idle_since'] = time.monotonic()
+        return stream
+    return None
+
+
+@socketio.on('leave_stream')
+def handle_leave_stream(data=None):
+    if 'user_id' in session:
+        leave_room(user_room(session['user_id']))
+        unsubscribe_stream(session['user_id'], request.sid)
+
+
+@socketio.on('disconnect')
+def handle_disconnect():
+    """Unsubscribe the socket; a stream nobody rejoins stops after the idle timeout"""
+    user_id = session.get('user_id')
+    if user_id is not None:
+        unsubscribe_stream(user_id, request.sid)
+
+
 @socketio.on('leave_debate')
 def handle_leave(data):
     debate_session_id = data.get('session_id')
@@ -1498,8 +2076,10 @@ def debug_session():
 # ==================== Initialize ====================
 if __name__ == '__main__':
     init_db()
+    start_background_jobs()
+    search.start_backfill(user_data_connects(), batch_size=app.config['SEARCH_BACKFILL_BATCH'])
     print("NeuroShield Flask Backend Starting...")
     print("Database initialized")
     print("ML model loaded")
-    print("Server running on http://localhost:5000")
-    socketio.run(app, debug=True, host='0.0.0.0', port=5000)  # Changed from app.run to socketio.run
\ No newline at end of file
+    print(f"Server running on http://localhost:{app.config['PORT']}")
+    socketio.run(app, debug=True, host='0.0.0.0', port=app.config['PORT'])  # Changed from app.run to socketio.run
\ No newline at end of file
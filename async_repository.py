@@ -0,0 +1,61 @@
+"""
+Async Data Access for NeuroShield
+Awaitable Repository API backed by a bounded database thread pool
+"""
+
+import asyncio
+import inspect
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from repository import Repository
+
+
+class AsyncRepository:
+    """
+    Awaitable mirror of Repository for an async server mode.
+
+    Every public Repository method is available as a coroutine with the
+    same arguments. Each call checks a pooled connection out on one of
+    max_workers database threads and commits before returning it, so the
+    event loop never blocks on SQLite. Use transaction() when several
+    statements must commit together.
+    """
+
+    def __init__(self, connect, max_workers=4, shards=None):
+        self.connect = connect
+        self.shards = shards
+        self.max_workers = max_workers
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='neuroshield-db')
+
+    def _run_unit(self, work):
+        db = self.connect()
+        repo = Repository(db, self.shards)
+        try:
+            result = work(repo)
+            repo.commit()
+            return result
+        finally:
+            repo.close()
+            db.close()
+
+    async def transaction(self, work):
+        """Run work(repo) on a database thread and commit once it returns"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, partial(self._run_unit, work))
+
+    def __getattr__(self, name):
+        method = getattr(Repository, name, None)
+        if name.startswith('_') or not inspect.isfunction(method):
+            raise AttributeError(name)
+
+        async def call(*args, **kwargs):
+            return await self.transaction(lambda repo: method(repo, *args, **kwargs))
+
+        call.__name__ = name
+        call.__doc__ = method.__doc__
+        return call
+
+    def shutdown(self, wait=True):
+        """Stop the database threads"""
+        self.executor.shutdown(wait=wait)
@@ -4,11 +4,13 @@ Provides utilities for user management, session handling, and security
 """
 
 from functools import wraps
-from flask import session, jsonify, redirect, url_for
+from flask import session, jsonify, redirect, url_for, current_app, has_app_context
 from werkzeug.security import generate_password_hash, check_password_hash
 import secrets
 import re
 
+from repository import as_repository
+
 
 # ==================== Decorators ====================
 
@@ -187,31 +189,25 @@ rate_limiter = RateLimiter()
 
 # ==================== User Info Utilities ====================
 
+def user_repository(db, shards=None):
+    """Repository for db, routed to the app's shards (if any) unless given explicitly"""
+    if shards is None and has_app_context():
+        shards = current_app.extensions.get('shard_router')
+    return as_repository(db, shards)
+
+
 def get_user_info(db, user_id):
     """Get user information by ID"""
-    user = db.execute(
-        'SELECT id, username, anonymous_id, consent_research, created_at FROM users WHERE id = ?',
-        (user_id,)
-    ).fetchone()
+    user = as_repository(db).get_user_info(user_id)
 
     if user:
-        return {
-            'id': user['id'],
-            'username': user['username'],
-            'anonymous_id': user['anonymous_id'],
-            'consent_research': user['consent_research'],
-            'created_at': user['created_at']
-        }
+        return user._asdict()
     return None
 
 
 def get_user_by_username(db, username):
     """Get user by username"""
-    user = db.execute(
-        'SELECT * FROM users WHERE username = ?',
-        (username,)
-    ).fetchone()
-    return user
+    return as_repository(db).get_user_by_username(username)
 
 
 # ==================== Security Utilities ====================
@@ -243,18 +239,17 @@ def is_safe_redirect_url(url):
 
 # ==================== Account Management ====================
 
-def change_password(db, user_id, old_password, new_password):
+def change_password(db, user_id, old_password, new_password, shards=None):
     """Change user password"""
+    repo = user_repository(db, shards)
+
     # Verify old password
-    user = db.execute(
-        'SELECT password_hash FROM users WHERE id = ?',
-        (user_id,)
-    ).fetchone()
+    password_hash = repo.get_password_hash(user_id)
 
-    if not user:
+    if not password_hash:
         return False, "User not found"
 
-    if not verify_password(user['password_hash'], old_password):
+    if not verify_password(password_hash, old_password):
         return False, "Incorrect current password"
 
     # Validate new password
@@ -264,33 +259,27 @@ def change_password(db, user_id, old_password, new_password):
 
     # Update password
     new_hash = hash_password(new_password)
-    db.execute(
-        'UPDATE users SET password_hash = ? WHERE id = ?',
-        (new_hash, user_id)
-    )
-    db.commit()
+    repo.update_password_hash(user_id, new_hash)
+    repo.commit()
 
     return True, "Password changed successfully"
 
 
-def delete_user_account(db, user_id):
-    """Delete user account and all associated data"""
+def delete_user_account(db, user_id, shards=None):
+    """Delete user account and all associated data (on the user's shard too)"""
+    repo = user_repository(db, shards)
     try:
-        # Delete in order of foreign key dependencies
-        db.execute('DELETE FROM brain_states WHERE session_id IN (SELECT id FROM eeg_sessions WHERE user_id = ?)',
-                   (user_id,))
-        db.execute('DELETE FROM eeg_sessions WHERE user_id = ?', (user_id,))
-        db.execute('DELETE FROM chat_history WHERE user_id = ?', (user_id,))
-        db.execute('DELETE FROM emergency_events WHERE user_id = ?', (user_id,))
-        db.execute('DELETE FROM journal_entries WHERE user_id = ?', (user_id,))
-        db.execute('DELETE FROM streaks WHERE user_id = ?', (user_id,))
-        db.execute('DELETE FROM users WHERE id = ?', (user_id,))
-        db.commit()
+        # Deletes in order of foreign key dependencies
+        repo.delete_user(user_id)
+        repo.commit()
 
         return True, "Account deleted successfully"
     except Exception as e:
-        db.rollback()
+        repo.rollback()
         return False, f"Error deleting account: {str(e)}"
+    finally:
+        if repo is not db:
+            repo.close()
 
 
 # ==================== Usage Example ====================
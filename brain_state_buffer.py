@@ -0,0 +1,176 @@
+"""
+Write-behind buffer for NeuroShield brain state samples
+Collects classified states in memory and writes them in batched transactions
+"""
+
+import threading
+from datetime import datetime, timezone
+
+from rollups import apply_rollups
+
+
+INSERT_BRAIN_STATE = '''
+    INSERT INTO brain_states (session_id, timestamp, state, confidence, risk_score)
+    VALUES (?, ?, ?, ?, ?)
+'''
+
+# Running mean over triggered_count + focused_count samples. SQLite evaluates
+# every SET expression against the old row, so the counters read here are the
+# values from before this batch.
+UPDATE_SESSION_AGGREGATES = '''
+    UPDATE eeg_sessions
+    SET avg_risk_score = (COALESCE(avg_risk_score, 0) * (triggered_count + focused_count) + ?)
+                         / (triggered_count + focused_count + ?),
+        triggered_count = triggered_count + ?,
+        focused_count = focused_count + ?
+    WHERE id = ?
+'''
+
+
+def utc_timestamp():
+    """Timestamp in the same format SQLite uses for CURRENT_TIMESTAMP"""
+    return datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def session_deltas(rows):
+    """Per-session (risk_sum, samples, triggered, focused, session_id) for a batch"""
+    totals = {}
+    for session_id, _, state, _, risk_score in rows:
+        if state not in ('triggered', 'focused') or risk_score is None:
+            continue
+        risk_sum, samples, triggered, focused = totals.get(session_id, (0.0, 0, 0, 0))
+        totals[session_id] = (
+            risk_sum + risk_score,
+            samples + 1,
+            triggered + (state == 'triggered'),
+            focused + (state == 'focused')
+        )
+    return [delta + (session_id,) for session_id, delta in totals.items()]
+
+
+class BrainStateBuffer:
+    """
+    Buffer brain_states rows and flush them with executemany.
+
+    A flush happens when the buffer reaches max_rows, when flush_interval
+    seconds have passed (background thread), or when flush() is called
+    explicitly (stream stop, shutdown). With route(user_id) -> connect,
+    rows are grouped and written per database (sharded storage). Rows from
+    a failed flush are retried, keeping at most max_pending (oldest are
+    dropped and counted in rows_dropped).
+    """
+
+    def __init__(self, connect, max_rows=200, flush_interval=2.0, route=None, max_pending=10000):
+        self.connect = connect
+        self.route = route
+        self.max_rows = max_rows
+        self.max_pending = max_pending
+        self.flush_interval = flush_interval
+        self.pending = []
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.rows_written = 0
+        self.rows_dropped = 0
+        self.flush_count = 0
+
+    def add(self, session_id, result, user_id=None):
+        """Queue one classifier result for the given EEG session"""
+        row = (
+            session_id,
+            utc_timestamp(),
+            result['state'],
+            result['confidence'],
+            result['risk_score']
+        )
+        with self.lock:
+            self.pending.append((user_id, row))
+            should_flush = len(self.pending) >= self.max_rows
+
+        if should_flush:
+            self.flush()
+
+    def flush(self):
+        """Write all pending rows in a single transaction per database"""
+        with self.flush_lock:
+            with self.lock:
+                rows, self.pending = self.pending, []
+
+            if not rows:
+                return 0
+
+            groups = {}
+            for entry in rows:
+                connect = self.connect if self.route is None or entry[0] is None else self.route(entry[0])
+                groups.setdefault(connect, []).append(entry)
+
+            batches = list(groups.items())
+            written = 0
+            for position, (connect, entries) in enumerate(batches):
+                db = None
+                try:
+                    db = connect()
+                    with db:
+                        self.write_rows(db, entries)
+                    # Count each committed group now; a later group may still fail
+                    if not written:
+                        self.flush_count += 1
+                    written += len(entries)
+                    self.rows_written += len(entries)
+                except Exception:
+                    # Put the unwritten rows back so the next flush can retry them
+                    unwritten = [entry for _, batch in batches[position:] for entry in batch]
+                    with self.lock:
+                        self.pending = unwritten + self.pending
+                        # While the database stays down, keep the newest samples only
+                        overflow = len(self.pending) - self.max_pending
+                        if overflow > 0:
+                            del self.pending[:overflow]
+                            self.rows_dropped += overflow
+                    raise
+                finally:
+                    if db is not None:
+                        db.close()
+
+            return written
+
+    def write_rows(self, db, entries):
+        """Insert rows and fold them into eeg_sessions and rollups inside the caller's transaction"""
+        rows = [row for _, row in entries]
+        db.executemany(INSERT_BRAIN_STATE, rows)
+        db.executemany(UPDATE_SESSION_AGGREGATES, session_deltas(rows))
+        rollup_rows = [
+            (user_id, timestamp, state, risk_score)
+            for user_id, (_, timestamp, state, _, risk_score) in entries
+            if user_id is not None
+        ]
+        if rollup_rows:
+            apply_rollups(db, rollup_rows)
+
+    def start(self):
+        """Start the background thread for time-based flushes"""
+        if self.thread and self.thread.is_alive():
+            return
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stop the background thread and flush what is left"""
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join(timeout=self.flush_interval + 1)
+            self.thread = None
+        self.flush()
+
+    def _run(self):
+        while not self.stop_event.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Error flushing brain states: {e}")
+
+    def __len__(self):
+        with self.lock:
+            return len(self.pending)
@@ -0,0 +1,109 @@
+"""
+Provider Circuit Breaker for NeuroShield
+Stops calling a failing or slow LLM provider and probes until it recovers
+"""
+
+import math
+import threading
+import time
+from collections import deque
+
+
+CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a non-empty list"""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+class CircuitBreaker:
+    """
+    Track provider outcomes over a sliding `window` of seconds.
+
+    Closed: calls go through. Once the window has at least `min_calls`
+    outcomes and the error rate reaches `error_rate` or the p95 latency
+    exceeds `latency_slo` seconds, the breaker opens and allow() returns
+    False for `open_seconds`. Then one trial call at a time is let through
+    (half-open); a success closes the breaker with a fresh window, a failure
+    opens it again. A probe that never reports is replaced after
+    `open_seconds`.
+    """
+
+    def __init__(self, window=60.0, min_calls=10, error_rate=0.5, latency_slo=6.0, open_seconds=30.0,
+                 max_samples=1000, clock=time.monotonic):
+        self.window = window
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.latency_slo = latency_slo
+        self.open_seconds = open_seconds
+        self.clock = clock
+        self.samples = deque(maxlen=max_samples)  # (time, ok, latency)
+        self.state = CLOSED
+        self.opened_at = None
+        self.probe_started = None
+        self.lock = threading.Lock()
+        self.stats = {'trips': 0, 'short_circuited': 0, 'probes': 0}
+
+    def _trim(self, now):
+        while self.samples and now - self.samples[0][0] > self.window:
+            self.samples.popleft()
+
+    def _open(self, now):
+        self.state = OPEN
+        self.opened_at = now
+        self.probe_started = None
+        self.stats['trips'] += 1
+
+    def allow(self):
+        """True if a provider call may be made now"""
+        with self.lock:
+            now = self.clock()
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and now - self.opened_at >= self.open_seconds:
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN and (self.probe_started is None
+                                            or now - self.probe_started >= self.open_seconds):
+                self.probe_started = now
+                self.stats['probes'] += 1
+                return True
+            self.stats['short_circuited'] += 1
+            return False
+
+    def record(self, ok, latency):
+        """Report the outcome and latency (seconds) of a provider call"""
+        with self.lock:
+            now = self.clock()
+            if self.state == HALF_OPEN:
+                if ok and latency <= self.latency_slo:
+                    self.state = CLOSED
+                    self.samples.clear()
+                    self.samples.append((now, ok, latency))
+                else:
+                    self._open(now)
+                return
+            if self.state == OPEN:
+                return  # a straggler from before the trip
+
+            self.samples.append((now, ok, latency))
+            self._trim(now)
+            if len(self.samples) >= self.min_calls and self._unhealthy():
+                self._open(now)
+
+    def _unhealthy(self):
+        errors = sum(1 for _, ok, _ in self.samples if not ok)
+        if errors / len(self.samples) >= self.error_rate:
+            return True
+        return percentile([latency for _, _, latency in self.samples], 0.95) > self.latency_slo
+
+    def snapshot(self):
+        """State plus window error rate and p95 latency"""
+        with self.lock:
+            self._trim(self.clock())
+            samples = list(self.samples)
+            stats = dict(self.stats, state=self.state, calls=len(samples))
+        stats['error_rate'] = sum(1 for _, ok, _ in samples if not ok) / len(samples) if samples else 0.0
+        stats['p95_latency'] = percentile([s[2] for s in samples], 0.95) if samples else None
+        return stats
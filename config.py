@@ -2,6 +2,7 @@
 Configuration settings for NeuroShield
 """
 
+import json
 import os
 from datetime import timedelta
 
@@ -17,6 +18,19 @@ class Config:
     # Database
     DATABASE_PATH = os.environ.get('DATABASE_PATH') or 'neuroshield.db'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    DATABASE_POOL_SIZE = 8  # idle pooled connections kept open
+    DATABASE_BUSY_TIMEOUT = 5.0  # seconds to wait on a locked database
+    DATABASE_MMAP_SIZE = 256 * 1024 * 1024  # bytes of the DB file memory-mapped
+    DATABASE_CACHE_SIZE_KB = 16 * 1024  # page cache per connection
+    DATABASE_STATEMENT_CACHE = 256  # prepared statements kept per connection
+    DATABASE_ASYNC_WORKERS = 4  # threads serving the async repository
+    DATABASE_SHARDS = int(os.environ.get('DATABASE_SHARDS', 0))  # >0 splits user data into N shard files
+    BRAIN_STATE_FLUSH_SIZE = 200  # buffered brain_states rows per batch insert
+    BRAIN_STATE_FLUSH_INTERVAL = 2.0  # seconds between background flushes
+    BRAIN_STATE_MAX_PENDING = 10000  # buffered rows kept while flushes fail (oldest dropped)
+    BRAIN_STATE_STREAM_INTERVAL = 1.0  # seconds between pushed brain_state events
+    BRAIN_STATE_STREAM_IDLE_TIMEOUT = 30.0  # seconds a pushed stream may run with no subscriber
+    BRAIN_STATE_STREAM_MAX_SECONDS = 4 * 3600  # hard cap on one pushed stream
 
     # File uploads
     UPLOAD_FOLDER = 'uploads'
@@ -51,9 +65,67 @@ class Config:
     # NLP Coach settings
     COACH_MAX_HISTORY = 100  # Maximum chat history to load
     COACH_RESPONSE_DELAY = 0.5  # seconds
+    COACH_LLM_DEADLINE = 8.0  # seconds a request waits for the provider before using rules
+    COACH_LLM_TIMEOUT = 10.0  # HTTP timeout of the provider client
+    COACH_LLM_MAX_RETRIES = 1  # provider client retries (within the timeout budget)
+    COACH_LLM_WORKERS = 8  # threads making provider calls
+    COACH_LLM_MAX_IN_FLIGHT = 16  # provider calls running or queued before new ones fall back
+    COACH_CACHE_ENABLED = os.environ.get('COACH_CACHE_ENABLED', 'true').lower() == 'true'
+    COACH_CACHE_MAX_ENTRIES = 1024  # cached coach replies
+    COACH_CACHE_TTL = 3600  # seconds a cached reply stays valid
+    COACH_MEMORY_TURNS = 20  # recent messages kept (and rehydrated) per user
+    COACH_MEMORY_MAX_USERS = 10000  # conversations kept in memory
+    COACH_MEMORY_BUDGET_MB = 64  # memory budget for kept conversations
+    COACH_CONTEXT_TOKENS = 1500  # prompt budget: system prompt + summary + recent turns
+    COACH_SUMMARY_TOKENS = 200  # rolling summary of turns that no longer fit
+    COACH_TRIAGE_ENABLED = os.environ.get('COACH_TRIAGE_ENABLED', 'true').lower() == 'true'
+    COACH_TRIAGE_RULE_THRESHOLD = 0.8  # local score needed to answer from templates
+    COACH_TRIAGE_MAX_RULE_WORDS = 6  # longer messages lean towards the LLM
+    COACH_BREAKER_ENABLED = os.environ.get('COACH_BREAKER_ENABLED', 'true').lower() == 'true'
+    COACH_BREAKER_WINDOW = 60.0  # seconds of provider outcomes the breaker looks at
+    COACH_BREAKER_MIN_CALLS = 10  # outcomes needed in the window before it can trip
+    COACH_BREAKER_ERROR_RATE = 0.5  # error fraction that trips it
+    COACH_BREAKER_P95_SLO = 6.0  # p95 latency (seconds) that trips it
+    COACH_BREAKER_OPEN_SECONDS = 30.0  # rules-only time before a trial call
+    # Ordered coach providers as JSON, e.g. [{"name": "openrouter", "base_url": "...",
+    # "api_key_env": "OPENROUTER_API_KEY", "model": "..."}, ...]; unset = OpenRouter only
+    COACH_LLM_PROVIDERS = (json.loads(os.environ['COACH_LLM_PROVIDERS'])
+                           if os.environ.get('COACH_LLM_PROVIDERS') else None)
+    COACH_HEDGE_DELAY = None  # seconds before hedging; None = the provider's observed p90
+    COACH_HEDGE_PERCENTILE = 0.9  # latency percentile used as the adaptive hedge delay
+    COACH_HEDGE_INITIAL_DELAY = 2.0  # hedge delay until enough latencies are observed
+    COACH_HEDGE_MAX_RATIO = 0.1  # hedged (duplicate) calls allowed per request
+
+    # Outbound HTTP (agents server proxy, LLM providers)
+    PORT = int(os.environ.get('PORT', 5000))
+    AGENTS_SERVER = os.environ.get('AGENTS_SERVER') or f'http://localhost:{PORT}'  # this server = in-process
+    HTTP_POOL_SIZE = 10  # hosts with kept-alive connection pools
+    HTTP_PER_HOST_LIMIT = 8  # pooled connections and concurrent requests per host
+    HTTP_CONNECT_TIMEOUT = 3.05  # seconds
+    HTTP_READ_TIMEOUT = 30.0  # seconds
+    HTTP_MAX_RETRIES = 2  # retries per request (idempotent or never sent)
+    HTTP_RETRY_BUDGET = 0.1  # retries allowed per request across the process
+
+    # LLM provider ('openrouter', or 'mock' for offline load tests of coach and debates)
+    LLM_PROVIDER = os.environ.get('LLM_PROVIDER', 'openrouter')
+    MOCK_LLM_BASE_URL = os.environ.get('MOCK_LLM_BASE_URL') or f'http://localhost:{PORT}/mock-llm/v1'
+    MOCK_LLM_DISTRIBUTION = os.environ.get('MOCK_LLM_DISTRIBUTION', 'lognormal')  # fixed/uniform/lognormal
+    MOCK_LLM_LATENCY = float(os.environ.get('MOCK_LLM_LATENCY', 0.8))  # median seconds to first token
+    MOCK_LLM_LATENCY_SPREAD = float(os.environ.get('MOCK_LLM_LATENCY_SPREAD', 0.5))  # sigma / +- fraction
+    MOCK_LLM_TOKENS_PER_SECOND = float(os.environ.get('MOCK_LLM_TOKENS_PER_SECOND', 50))
+    MOCK_LLM_REPLY_TOKENS = int(os.environ.get('MOCK_LLM_REPLY_TOKENS', 60))
+    MOCK_LLM_ERROR_RATE = float(os.environ.get('MOCK_LLM_ERROR_RATE', 0.0))  # fraction of calls that fail
+    MOCK_LLM_ERROR_STATUS = int(os.environ.get('MOCK_LLM_ERROR_STATUS', 500))  # e.g. 429 or 503
 
     # Analytics
     ANALYTICS_RETENTION_DAYS = 90  # days to keep detailed analytics
+    RETENTION_JOB_INTERVAL = 6 * 3600  # seconds between compaction runs
+    RETENTION_BATCH_SIZE = 1000  # rows deleted/archived per transaction
+    ARCHIVE_FOLDER = 'archive'  # gzipped JSON-lines archives of expired chat history
+    TIMELINE_MAX_POINTS = 500  # max buckets returned by /api/analytics/timeline
+    SYNC_MAX_ITEMS = 500  # max journal entries/check-ins per /api/sync request
+    SEARCH_BACKFILL_BATCH = 1000  # rows indexed per transaction when backfilling search
+    ANALYTICS_BACKFILL_BATCH = 1000  # pre-upgrade brain states folded per transaction
 
     # Feature flags
     ENABLE_REAL_EEG = False  # Enable real EEG device integration
@@ -98,4 +170,17 @@ def get_config(env=None):
     """Get configuration based on environment"""
     if env is None:
         env = os.environ.get('FLASK_ENV', 'development')
-    return config.get(env, config['default'])
\ No newline at end of file
+    return config.get(env, config['default'])
+
+
+def load_settings(app, env=None):
+    """
+    Copy NeuroShield's own settings (database, buffer, coach, ...) into app.config
+
+    Flask's built-in keys (DEBUG, MAX_CONTENT_LENGTH, SESSION_COOKIE_*, ...)
+    keep the app's defaults; enabling those is a separate deployment choice.
+    """
+    settings = get_config(env)
+    for key in dir(settings):
+        if key.isupper() and key not in app.config:
+            app.config[key] = getattr(settings, key)
@@ -0,0 +1,127 @@
+"""
+Coach Context Builder for NeuroShield
+Fits conversation history into a token budget, folding older turns into a rolling summary
+"""
+
+import math
+import re
+import threading
+from collections import OrderedDict
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding('cl100k_base')
+except Exception:  # optional dependency (or no cached encoding offline)
+    _encoding = None
+
+
+MESSAGE_OVERHEAD = 4  # role and separators per chat message
+_sentence_end = re.compile(r'(?<=[.!?])\s+')
+
+
+def count_tokens(text):
+    """Token count (tiktoken when available, otherwise ~4 characters per token)"""
+    if not text:
+        return 0
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    return math.ceil(len(text) / 4)
+
+
+def turn_tokens(content):
+    return count_tokens(content) + MESSAGE_OVERHEAD
+
+
+def summarize_turn(role, content, max_words=20):
+    """First sentence of a turn, clipped, as one summary line"""
+    sentence = _sentence_end.split(content.strip(), 1)[0]
+    words = sentence.split()
+    if len(words) > max_words:
+        sentence = ' '.join(words[:max_words]) + '…'
+    return f"{'User' if role == 'user' else 'Coach'}: {sentence}"
+
+
+class ContextBuilder:
+    """
+    Build LLM prompts within `budget` tokens from (seq, role, content) turns.
+
+    The newest turns that fit are sent verbatim. Turns that fall out of the
+    window, or out of conversation memory (fold()), are folded once each,
+    by sequence number, into a per-user rolling summary kept under
+    summary_budget tokens (oldest lines are dropped first) and sent with
+    every prompt. `summarizer` can replace the local extractive summary,
+    e.g. with a cheap model.
+    """
+
+    def __init__(self, budget=1500, summary_budget=200, max_users=10000, summarizer=None):
+        self.budget = budget
+        self.summary_budget = summary_budget
+        self.max_users = max_users
+        self.summarizer = summarizer or self.extractive_summary
+        self.summaries = OrderedDict()  # user_id -> (summary lines, seq of last folded turn)
+        self.lock = threading.Lock()
+        self.stats = {'prompts': 0, 'prompt_tokens': 0, 'turns_folded': 0}
+
+    def extractive_summary(self, lines, turns):
+        """Append one line per folded turn and keep the newest lines within budget"""
+        lines = lines + [summarize_turn(role, content) for role, content in turns]
+        while lines and count_tokens('\n'.join(lines)) > self.summary_budget:
+            lines = lines[1:]
+        return lines
+
+    def _summary(self, user_id):
+        with self.lock:
+            return self.summaries.get(user_id, ([], 0))
+
+    def fold(self, user_id, turns):
+        """Fold (seq, role, content) turns not folded yet into the user's summary"""
+        lines, last_folded = self._summary(user_id)
+        new_turns = [turn for turn in turns if turn[0] > last_folded]
+        if new_turns:
+            lines = self.summarizer(lines, [(role, content) for _, role, content in new_turns])
+            last_folded = max(seq for seq, _, _ in new_turns)
+        with self.lock:
+            self.summaries[user_id] = (lines, last_folded)
+            self.summaries.move_to_end(user_id)
+            while len(self.summaries) > self.max_users:
+                self.summaries.popitem(last=False)
+            self.stats['turns_folded'] += len(new_turns)
+        return lines
+
+    def build(self, user_id, system_prompt, turns):
+        """Chat messages: system prompt, summary of older turns, newest turns that fit"""
+        lines, last_folded = self._summary(user_id)
+        # Folded turns live in the summary only, even if they would fit again
+        turns = [turn for turn in turns if turn[0] > last_folded]
+
+        used = turn_tokens(system_prompt)
+        summary_room = self.summary_budget + MESSAGE_OVERHEAD
+        kept = []
+        for _, role, content in reversed(turns):
+            cost = turn_tokens(content)
+            # The latest turn is always sent, even when it alone exceeds the budget
+            if kept and used + cost + summary_room > self.budget:
+                break
+            kept.append((role, content))
+            used += cost
+        kept.reverse()
+
+        dropped = turns[:len(turns) - len(kept)]
+        if dropped:
+            lines = self.fold(user_id, dropped)
+
+        messages = [{'role': 'system', 'content': system_prompt}]
+        if lines:
+            summary = 'Summary of earlier conversation:\n' + '\n'.join(lines)
+            messages.append({'role': 'system', 'content': summary})
+            used += turn_tokens(summary)
+        messages += [{'role': role, 'content': content} for role, content in kept]
+
+        with self.lock:
+            self.stats['prompts'] += 1
+            self.stats['prompt_tokens'] += used
+        return messages
+
+    def clear(self, user_id):
+        with self.lock:
+            self.summaries.pop(user_id, None)
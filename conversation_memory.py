@@ -0,0 +1,125 @@
+"""
+Conversation Memory for NeuroShield
+Bounded LRU store of recent coach turns, rehydrated from chat_history on a miss
+"""
+
+import itertools
+import sys
+import threading
+from collections import OrderedDict
+
+
+TURN_OVERHEAD = 120  # approximate bytes for the tuple and its role string
+
+
+def turn_size(role, content):
+    return TURN_OVERHEAD + sys.getsizeof(content)
+
+
+class ConversationMemory:
+    """
+    Recent (role, content) turns per user.
+
+    Holds at most max_turns per user and evicts least recently used users
+    once either max_users or max_bytes is exceeded. On a miss, loader(user_id,
+    max_turns) rebuilds the context from persisted history, so eviction and
+    restarts only cost a query. Every turn gets a sequence number that only
+    grows; on_trim(user_id, numbered_turns) sees turns pushed out by
+    max_turns and on_evict(user_id) sees users dropped from memory.
+    """
+
+    def __init__(self, max_users=10000, max_bytes=64 * 1024 * 1024, max_turns=20, loader=None,
+                 on_trim=None, on_evict=None):
+        self.max_users = max_users
+        self.max_bytes = max_bytes
+        self.max_turns = max_turns
+        self.loader = loader
+        self.on_trim = on_trim
+        self.on_evict = on_evict
+        self.users = OrderedDict()  # user_id -> ([(seq, role, content)], bytes)
+        self.total_bytes = 0
+        self.sequence = itertools.count(1)
+        self.lock = threading.RLock()
+        self.hits = self.loads = self.evictions = 0
+
+    def get(self, user_id):
+        """The user's recent (role, content) turns (a copy), loading them if not in memory"""
+        return [(role, content) for _, role, content in self.get_numbered(user_id)]
+
+    def get_numbered(self, user_id):
+        """Like get(), as (seq, role, content) turns"""
+        with self.lock:
+            entry = self.users.get(user_id)
+            if entry is not None:
+                self.users.move_to_end(user_id)
+                self.hits += 1
+                return list(entry[0])
+
+        turns = list(self.loader(user_id, self.max_turns))[-self.max_turns:] if self.loader else []
+        with self.lock:
+            # Another thread may have filled the entry while we were loading
+            if user_id not in self.users:
+                self.loads += 1
+                evicted = self._store(user_id, [(next(self.sequence), role, content) for role, content in turns])
+            else:
+                evicted = []
+            numbered = list(self.users[user_id][0])
+        self._evicted(evicted)
+        return numbered
+
+    def append(self, user_id, role, content):
+        """Add one turn, trimming to max_turns"""
+        self.get_numbered(user_id)
+        with self.lock:
+            turns, _ = self.users.get(user_id, ([], 0))
+            turns = turns + [(next(self.sequence), role, content)]
+            trimmed = turns[:-self.max_turns]
+            evicted = self._store(user_id, turns[-self.max_turns:])
+        if trimmed and self.on_trim:
+            self.on_trim(user_id, trimmed)
+        self._evicted(evicted)
+
+    def _evicted(self, user_ids):
+        if self.on_evict:
+            for user_id in user_ids:
+                self.on_evict(user_id)
+
+    def clear(self, user_id):
+        """Forget a user's turns (chat cleared)"""
+        with self.lock:
+            entry = self.users.pop(user_id, None)
+            if entry is not None:
+                self.total_bytes -= entry[1]
+            # An empty entry stops the next get() from reloading cleared history
+            evicted = self._store(user_id, [])
+        self._evicted(evicted)
+
+    def _store(self, user_id, turns):
+        """Save a user's turns and evict LRU users over the limits; returns evicted ids"""
+        size = sum(turn_size(role, content) for _, role, content in turns)
+        old = self.users.pop(user_id, None)
+        if old is not None:
+            self.total_bytes -= old[1]
+        self.users[user_id] = (turns, size)
+        self.total_bytes += size
+        evicted = []
+        while len(self.users) > 1 and (len(self.users) > self.max_users or self.total_bytes > self.max_bytes):
+            evicted_id, (_, evicted_size) = self.users.popitem(last=False)
+            self.total_bytes -= evicted_size
+            self.evictions += 1
+            evicted.append(evicted_id)
+        return evicted
+
+    def __contains__(self, user_id):
+        with self.lock:
+            return user_id in self.users
+
+    def stats(self):
+        with self.lock:
+            return {
+                'users': len(self.users),
+                'bytes': self.total_bytes,
+                'hits': self.hits,
+                'loads': self.loads,
+                'evictions': self.evictions,
+            }
@@ -0,0 +1,154 @@
+"""
+SQLite Connection Manager for NeuroShield
+Pooled, WAL-mode connections shared by request handlers and background jobs
+"""
+
+import queue
+import sqlite3
+import threading
+
+from flask import g, has_app_context
+
+
+class PooledConnection(sqlite3.Connection):
+    """sqlite3 connection whose close() hands it back to the pool"""
+
+    manager = None
+    generation = 0
+    checked_out = False
+
+    def close(self):
+        if self.manager is None:
+            super().close()
+        else:
+            self.manager.release(self)
+
+    def close_for_real(self):
+        sqlite3.Connection.close(self)
+
+
+class ConnectionManager:
+    """
+    Keep a small pool of tuned SQLite connections.
+
+    Inside a Flask app context get() returns one connection per context,
+    returned to the pool on teardown. Outside a context (background threads)
+    connect() checks a connection out until the caller closes it.
+    """
+
+    def __init__(self, path=None, pool_size=8, busy_timeout=5.0,
+                 mmap_size=256 * 1024 * 1024, cache_size_kb=16 * 1024, statement_cache_size=256,
+                 context_key='_database'):
+        self.path = path
+        self.context_key = context_key
+        self.pool_size = pool_size
+        self.busy_timeout = busy_timeout
+        self.mmap_size = mmap_size
+        self.cache_size_kb = cache_size_kb
+        self.statement_cache_size = statement_cache_size
+        self.idle = queue.LifoQueue()
+        self.lock = threading.Lock()
+        self.generation = 0
+        self.memory_anchor = None
+
+    def init_app(self, app, path=None):
+        """Read settings from app.config and register teardown"""
+        self.pool_size = app.config.get('DATABASE_POOL_SIZE', self.pool_size)
+        self.busy_timeout = app.config.get('DATABASE_BUSY_TIMEOUT', self.busy_timeout)
+        self.mmap_size = app.config.get('DATABASE_MMAP_SIZE', self.mmap_size)
+        self.cache_size_kb = app.config.get('DATABASE_CACHE_SIZE_KB', self.cache_size_kb)
+        self.statement_cache_size = app.config.get('DATABASE_STATEMENT_CACHE', self.statement_cache_size)
+        self.configure(path or app.config['DATABASE_PATH'])
+        app.teardown_appcontext(self.teardown)
+
+    def configure(self, path):
+        """Point the pool at a (possibly new) database file"""
+        with self.lock:
+            self.path = path
+            self.generation += 1
+            self._drain()
+            if self.memory_anchor is not None:
+                self.memory_anchor.close_for_real()
+                self.memory_anchor = None
+            if path == ':memory:':
+                # A shared-cache in-memory DB lives as long as one connection is open
+                self.memory_anchor = self._open()
+                self.memory_anchor.manager = None
+
+    def _drain(self):
+        while True:
+            try:
+                self.idle.get_nowait().close_for_real()
+            except queue.Empty:
+                return
+
+    def _target(self):
+        if self.path == ':memory:':
+            return f'file:neuroshield_{id(self)}?mode=memory&cache=shared', True
+        return self.path, False
+
+    def _open(self):
+        target, uri = self._target()
+        conn = sqlite3.connect(
+            target,
+            uri=uri,
+            timeout=self.busy_timeout,
+            check_same_thread=False,
+            cached_statements=self.statement_cache_size,
+            factory=PooledConnection
+        )
+        conn.row_factory = sqlite3.Row
+
+        # auto_vacuum can only be chosen before the first table and before WAL
+        if conn.execute('PRAGMA page_count').fetchone()[0] == 0:
+            conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.execute('PRAGMA synchronous = NORMAL')
+        conn.execute(f'PRAGMA mmap_size = {int(self.mmap_size)}')
+        conn.execute(f'PRAGMA cache_size = -{int(self.cache_size_kb)}')
+        conn.execute('PRAGMA temp_store = MEMORY')
+
+        conn.manager = self
+        conn.generation = self.generation
+        return conn
+
+    def connect(self):
+        """Check out a connection; close() returns it to the pool"""
+        try:
+            conn = self.idle.get_nowait()
+        except queue.Empty:
+            conn = self._open()
+        conn.checked_out = True
+        return conn
+
+    def release(self, conn):
+        """Return a connection to the pool, rolling back anything left open"""
+        if not conn.checked_out:
+            return
+        conn.checked_out = False
+        if conn.in_transaction:
+            conn.rollback()
+        if conn.generation != self.generation or self.idle.qsize() >= self.pool_size:
+            conn.close_for_real()
+        else:
+            self.idle.put(conn)
+
+    def get(self):
+        """Connection bound to the current app context (or a checked-out one)"""
+        if not has_app_context():
+            return self.connect()
+        conn = g.get(self.context_key)
+        if conn is None:
+            conn = self.connect()
+            setattr(g, self.context_key, conn)
+        return conn
+
+    def teardown(self, exception=None):
+        conn = g.pop(self.context_key, None)
+        if conn is not None:
+            self.release(conn)
+
+    def close_all(self):
+        """Close idle connections (shutdown)"""
+        with self.lock:
+            self._drain()
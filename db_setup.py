@@ -3,272 +3,35 @@ Database Setup Script for NeuroShield
 Creates and initializes SQLite database with sample data
 """
 
+import re
 import sqlite3
-from datetime import datetime, timedelta
+import time
+from datetime import datetime, timedelta, timezone
 from werkzeug.security import generate_password_hash
 import random
 
+import rollups
+import search
+from migrations import INDEXES, apply_migrations
+
 DATABASE = 'neuroshield.db'
 
 
+def utc_now():
+    """Naive UTC datetime, matching SQLite CURRENT_TIMESTAMP"""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
 def create_database():
     """Create database and all tables"""
     conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
 
-    # Users table
-    cursor.execute('''
-                   CREATE TABLE IF NOT EXISTS users
-                   (
-                       id
-                       INTEGER
-                       PRIMARY
-                       KEY
-                       AUTOINCREMENT,
-                       username
-                       TEXT
-                       UNIQUE
-                       NOT
-                       NULL,
-                       password_hash
-                       TEXT
-                       NOT
-                       NULL,
-                       created_at
-                       TIMESTAMP
-                       DEFAULT
-                       CURRENT_TIMESTAMP,
-                       anonymous_id
-                       TEXT
-                       UNIQUE,
-                       consent_research
-                       BOOLEAN
-                       DEFAULT
-                       0
-                   )
-                   ''')
-
-    # Streaks table
-    cursor.execute('''
-                   CREATE TABLE IF NOT EXISTS streaks
-                   (
-                       id
-                       INTEGER
-                       PRIMARY
-                       KEY
-                       AUTOINCREMENT,
-                       user_id
-                       INTEGER
-                       NOT
-                       NULL,
-                       current_streak
-                       INTEGER
-                       DEFAULT
-                       0,
-                       longest_streak
-                       INTEGER
-                       DEFAULT
-                       0,
-                       last_check_in
-                       DATE,
-                       total_clean_days
-                       INTEGER
-                       DEFAULT
-                       0,
-                       FOREIGN
-                       KEY
-                   (
-                       user_id
-                   ) REFERENCES users
-                   (
-                       id
-                   )
-                       )
-                   ''')
-
-    # Journal entries table
-    cursor.execute('''
-                   CREATE TABLE IF NOT EXISTS journal_entries
-                   (
-                       id
-                       INTEGER
-                       PRIMARY
-                       KEY
-                       AUTOINCREMENT,
-                       user_id
-                       INTEGER
-                       NOT
-                       NULL,
-                       entry_date
-                       DATE
-                       NOT
-                       NULL,
-                       mood
-                       TEXT,
-                       triggers
-                       TEXT,
-                       note
-                       TEXT,
-                       created_at
-                       TIMESTAMP
-                       DEFAULT
-                       CURRENT_TIMESTAMP,
-                       FOREIGN
-                       KEY
-                   (
-                       user_id
-                   ) REFERENCES users
-                   (
-                       id
-                   )
-                       )
-                   ''')
-
-    # EEG sessions table
-    cursor.execute('''
-                   CREATE TABLE IF NOT EXISTS eeg_sessions
-                   (
-                       id
-                       INTEGER
-                       PRIMARY
-                       KEY
-                       AUTOINCREMENT,
-                       user_id
-                       INTEGER
-                       NOT
-                       NULL,
-                       session_start
-                       TIMESTAMP
-                       DEFAULT
-                       CURRENT_TIMESTAMP,
-                       session_end
-                       TIMESTAMP,
-                       avg_risk_score
-                       REAL,
-                       triggered_count
-                       INTEGER
-                       DEFAULT
-                       0,
-                       focused_count
-                       INTEGER
-                       DEFAULT
-                       0,
-                       FOREIGN
-                       KEY
-                   (
-                       user_id
-                   ) REFERENCES users
-                   (
-                       id
-                   )
-                       )
-                   ''')
-
-    # Brain states table
-    cursor.execute('''
-                   CREATE TABLE IF NOT EXISTS brain_states
-                   (
-                       id
-                       INTEGER
-                       PRIMARY
-                       KEY
-                       AUTOINCREMENT,
-                       session_id
-                       INTEGER
-                       NOT
-                       NULL,
-                       timestamp
-                       TIMESTAMP
-                       DEFAULT
-                       CURRENT_TIMESTAMP,
-                       state
-                       TEXT
-                       NOT
-                       NULL,
-                       confidence
-                       REAL
-                       NOT
-                       NULL,
-                       risk_score
-                       REAL,
-                       FOREIGN
-                       KEY
-                   (
-                       session_id
-                   ) REFERENCES eeg_sessions
-                   (
-                       id
-                   )
-                       )
-                   ''')
-
-    # Chat history table
-    cursor.execute('''
-                   CREATE TABLE IF NOT EXISTS chat_history
-                   (
-                       id
-                       INTEGER
-                       PRIMARY
-                       KEY
-                       AUTOINCREMENT,
-                       user_id
-                       INTEGER
-                       NOT
-                       NULL,
-                       message
-                       TEXT
-                       NOT
-                       NULL,
-                       sender
-                       TEXT
-                       NOT
-                       NULL,
-                       timestamp
-                       TIMESTAMP
-                       DEFAULT
-                       CURRENT_TIMESTAMP,
-                       FOREIGN
-                       KEY
-                   (
-                       user_id
-                   ) REFERENCES users
-                   (
-                       id
-                   )
-                       )
-                   ''')
-
-    # Emergency events table
-    cursor.execute('''
-                   CREATE TABLE IF NOT EXISTS emergency_events
-                   (
-                       id
-                       INTEGER
-                       PRIMARY
-                       KEY
-                       AUTOINCREMENT,
-                       user_id
-                       INTEGER
-                       NOT
-                       NULL,
-                       timestamp
-                       TIMESTAMP
-                       DEFAULT
-                       CURRENT_TIMESTAMP,
-                       action_taken
-                       TEXT,
-                       FOREIGN
-                       KEY
-                   (
-                       user_id
-                   ) REFERENCES users
-                   (
-                       id
-                   )
-                       )
-                   ''')
+    # Must run before the first table exists; used by retention compaction
+    conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+
+    # Tables, rollups and indexes, at the latest schema version
+    apply_migrations(conn)
 
-    conn.commit()
     conn.close()
     print("✓ Database tables created successfully")
 
@@ -313,18 +76,19 @@ def populate_sample_data():
                        ))
 
     # Add sample EEG sessions
+    rollup_rows = []
     for i in range(3):
-        session_start = datetime.now() - timedelta(hours=i * 24)
+        # UTC, like CURRENT_TIMESTAMP and the brain state buffer, so rollup buckets line up
+        session_start = utc_now() - timedelta(hours=i * 24)
         session_end = session_start + timedelta(minutes=30)
 
         cursor.execute('''
-                       INSERT INTO eeg_sessions (user_id, session_start, session_end, avg_risk_score, triggered_count,
-                                                 focused_count)
-                       VALUES (?, ?, ?, ?, ?, ?)
-                       ''', (user_id, session_start, session_end, random.uniform(0.2, 0.4), random.randint(2, 5),
-                             random.randint(15, 25)))
+                       INSERT INTO eeg_sessions (user_id, session_start, session_end)
+                       VALUES (?, ?, ?)
+                       ''', (user_id, session_start, session_end))
 
         session_id = cursor.lastrowid
+        risk_scores = []
 
         # Add brain states for this session
         for j in range(20):
@@ -337,6 +101,20 @@ def populate_sample_data():
                            INSERT INTO brain_states (session_id, timestamp, state, confidence, risk_score)
                            VALUES (?, ?, ?, ?, ?)
                            ''', (session_id, timestamp, state, confidence, risk_score))
+            risk_scores.append((state, risk_score))
+            rollup_rows.append((user_id, rollups.format_timestamp(timestamp), state, risk_score))
+
+        # Session aggregates match the states recorded above
+        cursor.execute('''
+                       UPDATE eeg_sessions
+                       SET avg_risk_score = ?, triggered_count = ?, focused_count = ?
+                       WHERE id = ?
+                       ''', (sum(r for _, r in risk_scores) / len(risk_scores),
+                             sum(1 for st, _ in risk_scores if st == 'triggered'),
+                             sum(1 for st, _ in risk_scores if st == 'focused'),
+                             session_id))
+
+    rollups.apply_rollups(conn, rollup_rows)
 
     # Add sample chat history
     sample_conversations = [
@@ -371,9 +149,12 @@ def reset_database():
 
     tables = ['users', 'streaks', 'journal_entries', 'eeg_sessions',
               'brain_states', 'chat_history', 'emergency_events']
+    tables += [table for table, _, _, _ in rollups.RESOLUTIONS.values()]
+    tables += [fts for fts, _, _ in search.SEARCH_INDEXES.values()] + ['search_backfill']
 
     for table in tables:
         cursor.execute(f'DROP TABLE IF EXISTS {table}')
+    cursor.execute('PRAGMA user_version = 0')
 
     conn.commit()
     conn.close()
@@ -408,9 +189,148 @@ def show_stats():
     conn.close()
 
 
+# ==================== Load Generator ====================
+
+MOODS = ['great', 'good', 'neutral', 'struggling']
+TRIGGERS = ['None', 'Stress', 'Boredom', 'Social Media', 'Loneliness']
+
+
+def secondary_indexes():
+    """Names of the indexes created by the indexes migration"""
+    return re.findall(r'CREATE INDEX IF NOT EXISTS (\w+)', INDEXES)
+
+
+def next_id(conn, table):
+    return (conn.execute(f'SELECT MAX(id) FROM {table}').fetchone()[0] or 0) + 1
+
+
+def generate_load_data(users=1000, days=30, sessions_per_day=2, session_minutes=30,
+                       samples_per_minute=6, database=None, batch_size=100000, seed=None):
+    """
+    Bulk-generate synthetic users and history for load and scale tests.
+
+    Streaming density is sessions_per_day x session_minutes x
+    samples_per_minute brain states per user per day. Ids are assigned
+    up front so every table is written with executemany; secondary indexes
+    are dropped for the load and rebuilt once at the end.
+    """
+    rng = random.Random(seed)
+    conn = sqlite3.connect(database or DATABASE)
+    apply_migrations(conn)
+    conn.execute('PRAGMA synchronous = OFF')
+    conn.execute('PRAGMA cache_size = -262144')
+    conn.execute('PRAGMA temp_store = MEMORY')
+
+    for index in secondary_indexes():
+        conn.execute(f'DROP INDEX IF EXISTS {index}')
+
+    started = time.perf_counter()
+    counts = dict.fromkeys(['users', 'streaks', 'journal_entries', 'eeg_sessions',
+                            'brain_states', 'chat_history', 'rollups'], 0)
+    pending = {table: [] for table in counts}
+    statements = {
+        'users': 'INSERT INTO users (id, username, password_hash, anonymous_id, consent_research, created_at) '
+                 'VALUES (?, ?, ?, ?, ?, ?)',
+        'streaks': 'INSERT INTO streaks (user_id, current_streak, longest_streak, total_clean_days, last_check_in) '
+                   'VALUES (?, ?, ?, ?, ?)',
+        'journal_entries': 'INSERT INTO journal_entries (user_id, entry_date, mood, triggers, note) '
+                           'VALUES (?, ?, ?, ?, ?)',
+        'eeg_sessions': 'INSERT INTO eeg_sessions (id, user_id, session_start, session_end, avg_risk_score, '
+                        'triggered_count, focused_count) VALUES (?, ?, ?, ?, ?, ?, ?)',
+        'brain_states': 'INSERT INTO brain_states (session_id, timestamp, state, confidence, risk_score) '
+                        'VALUES (?, ?, ?, ?, ?)',
+        'chat_history': 'INSERT INTO chat_history (user_id, message, sender, timestamp) VALUES (?, ?, ?, ?)',
+    }
+
+    def flush(force=False):
+        queued = sum(len(rows) for rows in pending.values())
+        if not queued or (not force and queued < batch_size):
+            return
+        with conn:
+            for table, rows in pending.items():
+                if table == 'rollups':
+                    # Flushes happen between users, so each bucket is written once
+                    for resolution, (rollup_table, _, _, _) in rollups.RESOLUTIONS.items():
+                        buckets = rollups.rollup_deltas(rows, resolution)
+                        conn.executemany(rollups.UPSERT_ROLLUP_SQL.format(table=rollup_table), buckets)
+                        counts[table] += len(buckets)
+                else:
+                    conn.executemany(statements[table], rows)
+                    counts[table] += len(rows)
+                rows.clear()
+        elapsed = time.perf_counter() - started
+        total = sum(counts.values())
+        print(f"  {total:,} rows in {elapsed:.1f}s ({total / elapsed:,.0f} rows/s)")
+
+    password_hash = generate_password_hash('loadtest')
+    user_id = next_id(conn, 'users')
+    session_id = next_id(conn, 'eeg_sessions')
+    now = utc_now().replace(microsecond=0)
+    first_day = now - timedelta(days=days)
+    step = 60.0 / samples_per_minute
+
+    for _ in range(users):
+        pending['users'].append((user_id, f'load_{user_id}', password_hash, f'anon_load{user_id}',
+                                 rng.random() < 0.5, first_day))
+        streak = rng.randint(0, days)
+        pending['streaks'].append((user_id, streak, max(streak, rng.randint(0, days)), streak,
+                                   now.date()))
+
+        for day in range(days):
+            day_start = first_day + timedelta(days=day)
+            pending['journal_entries'].append((user_id, day_start.date(), rng.choice(MOODS),
+                                               rng.choice(TRIGGERS), f'Load test day {day + 1}'))
+            pending['chat_history'].append((user_id, 'How am I doing?', 'user', day_start))
+            pending['chat_history'].append((user_id, 'You are making progress.', 'coach', day_start))
+
+            for _ in range(sessions_per_day):
+                session_start = day_start + timedelta(seconds=rng.randrange(86400 - session_minutes * 60))
+                risk_sum, triggered, focused = 0.0, 0, 0
+                for sample in range(session_minutes * samples_per_minute):
+                    timestamp = (session_start + timedelta(seconds=sample * step)).strftime('%Y-%m-%d %H:%M:%S')
+                    state = 'triggered' if rng.random() < 0.25 else 'focused'
+                    risk = rng.uniform(0.6, 0.9) if state == 'triggered' else rng.uniform(0.1, 0.5)
+                    pending['brain_states'].append((session_id, timestamp, state, rng.uniform(0.7, 0.95), risk))
+                    pending['rollups'].append((user_id, timestamp, state, risk))
+                    risk_sum += risk
+                    triggered += state == 'triggered'
+                    focused += state == 'focused'
+
+                samples = triggered + focused
+                pending['eeg_sessions'].append((
+                    session_id, user_id, session_start, session_start + timedelta(minutes=session_minutes),
+                    risk_sum / samples if samples else None, triggered, focused
+                ))
+                session_id += 1
+
+        user_id += 1
+        flush()
+
+    flush(force=True)
+
+    print("  Rebuilding indexes...")
+    conn.executescript(INDEXES)
+    conn.execute('ANALYZE')
+    conn.execute('PRAGMA synchronous = NORMAL')
+    conn.close()
+
+    elapsed = time.perf_counter() - started
+    total = sum(counts.values())
+    print(f"✓ Generated {total:,} rows in {elapsed:.1f}s ({total / elapsed:,.0f} rows/s)")
+    return {'elapsed': elapsed, 'rows_per_second': total / elapsed if elapsed else 0, **counts}
+
+
 if __name__ == '__main__':
     import sys
 
+    if len(sys.argv) > 1 and sys.argv[1] == '--generate':
+        # python db_setup.py --generate [users] [days] [samples_per_minute]
+        args = [int(value) for value in sys.argv[2:5]]
+        print("Generating load-test data...")
+        generate_load_data(*args[:2], samples_per_minute=args[2] if len(args) > 2 else 6)
+        show_stats()
+        sys.exit(0)
+
     if len(sys.argv) > 1 and sys.argv[1] == '--reset':
         print("Resetting database...")
         reset_database()
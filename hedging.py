@@ -0,0 +1,132 @@
+"""
+Hedged LLM Completions for NeuroShield
+Race slow provider calls against fallback providers under a hedging budget
+"""
+
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from circuit_breaker import percentile
+
+
+class HedgedCompletion:
+    """
+    Run a completion against an ordered list of providers.
+
+    The first provider is called right away. If it has not answered within
+    the hedge delay (`hedge_delay` seconds, or by default the `percentile`
+    of its observed latency, `initial_delay` until `min_samples` are seen),
+    the same request goes to the next provider, and so on; the first answer
+    wins and attempts still queued are cancelled. Hedges are capped at
+    `max_hedge_ratio` of requests. A provider error fails over to the next
+    provider at once, outside the cap.
+    """
+
+    def __init__(self, providers, hedge_delay=None, percentile=0.9, initial_delay=2.0, min_samples=20,
+                 max_hedge_ratio=0.1, max_workers=16, history=200):
+        self.providers = providers
+        self.hedge_delay = hedge_delay
+        self.percentile = percentile
+        self.initial_delay = initial_delay
+        self.min_samples = min_samples
+        self.max_hedge_ratio = max_hedge_ratio
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='neuroshield-hedge')
+        self.latencies = {p['name']: deque(maxlen=history) for p in providers}
+        self.lock = threading.Lock()
+        self.stats = {'requests': 0, 'hedges': 0, 'hedges_denied': 0, 'hedge_wins': 0, 'failovers': 0,
+                      'wins': {p['name']: 0 for p in providers}}
+
+    def delay_for(self, provider):
+        """Seconds to wait on `provider` before hedging"""
+        if self.hedge_delay is not None:
+            return self.hedge_delay
+        with self.lock:
+            samples = list(self.latencies[provider['name']])
+        if len(samples) < self.min_samples:
+            return self.initial_delay
+        return percentile(samples, self.percentile)
+
+    def _take_hedge(self):
+        with self.lock:
+            if self.stats['hedges'] < self.max_hedge_ratio * self.stats['requests']:
+                self.stats['hedges'] += 1
+                return True
+            self.stats['hedges_denied'] += 1
+            return False
+
+    def _count(self, key):
+        with self.lock:
+            self.stats[key] += 1
+
+    def _observe(self, name, started):
+        def done(future):
+            # Losers report too, so slow providers are not judged only by their wins
+            if not future.cancelled() and future.exception() is None:
+                with self.lock:
+                    self.latencies[name].append(time.perf_counter() - started)
+        return done
+
+    def complete(self, call):
+        """Return call(provider) from whichever provider answers first"""
+        self._count('requests')
+        pending = {}
+        launched = []
+        hedged = set()
+        errors = []
+        may_hedge = True
+
+        def launch(hedge=False):
+            if hedge:
+                hedged.add(len(launched))
+            provider = self.providers[len(launched)]
+            future = self.executor.submit(call, provider)
+            future.add_done_callback(self._observe(provider['name'], time.perf_counter()))
+            pending[future] = len(launched)
+            launched.append(provider)
+
+        launch()
+        while pending:
+            can_launch = len(launched) < len(self.providers)
+            timeout = self.delay_for(launched[-1]) if can_launch and may_hedge else None
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+
+            if not done:
+                if self._take_hedge():
+                    launch(hedge=True)
+                else:
+                    may_hedge = False
+                continue
+
+            for future in done:
+                index = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    errors.append(e)
+                    continue
+                for loser in pending:
+                    loser.cancel()
+                with self.lock:
+                    self.stats['wins'][self.providers[index]['name']] += 1
+                    if index in hedged:
+                        self.stats['hedge_wins'] += 1
+                return result
+
+            if not pending and len(launched) < len(self.providers):
+                self._count('failovers')
+                launch()
+
+        raise errors[-1]
+
+    def snapshot(self):
+        """Counters plus hedge win rate and current hedge delays"""
+        with self.lock:
+            stats = dict(self.stats, wins=dict(self.stats['wins']))
+        stats['hedge_win_rate'] = stats['hedge_wins'] / stats['hedges'] if stats['hedges'] else 0.0
+        stats['hedge_delays'] = {p['name']: self.delay_for(p) for p in self.providers[:-1]}
+        return stats
+
+    def shutdown(self, wait=False):
+        self.executor.shutdown(wait=wait, cancel_futures=True)
@@ -0,0 +1,143 @@
+"""
+Outbound HTTP for NeuroShield
+Shared keep-alive clients with per-host limits, timeouts and a retry budget
+"""
+
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+
+
+LOCAL_HOSTS = {'localhost', '127.0.0.1', '::1', '0.0.0.0'}
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'}
+RETRY_STATUSES = {502, 503, 504}
+
+
+class HostBusy(Exception):
+    """Too many requests to one host already in flight"""
+
+
+def never_sent(error):
+    """True if the request failed before reaching the server (safe to retry any method)"""
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], 'reason', None) if error.args else None
+    return isinstance(reason, (NewConnectionError, ConnectTimeoutError))
+
+
+class OutboundHTTP:
+    """
+    One requests.Session for all outbound calls.
+
+    Connections are kept alive in per-host pools of `per_host_limit`, which
+    is also the number of concurrent requests allowed to a host (callers
+    wait up to `acquire_timeout` seconds for a slot, then get HostBusy).
+    Every request gets (connect_timeout, read_timeout) unless it passes its
+    own. Failed idempotent requests, and requests that never reached the
+    server, are retried up to `max_retries` times with backoff, as long as
+    retries stay within `retry_budget` of requests (plus `retry_reserve`).
+    """
+
+    def __init__(self, pool_size=10, per_host_limit=8, connect_timeout=3.05, read_timeout=30.0,
+                 max_retries=2, retry_budget=0.1, retry_reserve=10, backoff=0.2, acquire_timeout=5.0,
+                 local_port=5000):
+        self.per_host_limit = per_host_limit
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.retry_budget = retry_budget
+        self.retry_reserve = retry_reserve
+        self.backoff = backoff
+        self.acquire_timeout = acquire_timeout
+        self.local_port = local_port
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=per_host_limit, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self.host_slots = {}
+        self.lock = threading.Lock()
+        self.stats = {'requests': 0, 'retries': 0, 'retries_denied': 0, 'rejected': 0, 'errors': 0}
+        self._httpx_client = None
+
+    def _count(self, key):
+        with self.lock:
+            self.stats[key] += 1
+
+    def _slot(self, host):
+        with self.lock:
+            slot = self.host_slots.get(host)
+            if slot is None:
+                slot = self.host_slots[host] = threading.BoundedSemaphore(self.per_host_limit)
+            return slot
+
+    def _take_retry(self):
+        with self.lock:
+            if self.stats['retries'] < self.retry_budget * self.stats['requests'] + self.retry_reserve:
+                self.stats['retries'] += 1
+                return True
+            self.stats['retries_denied'] += 1
+            return False
+
+    def is_local(self, url):
+        """True if url points at this server (dispatch in-process instead)"""
+        parts = urlsplit(url)
+        port = parts.port or (443 if parts.scheme == 'https' else 80)
+        return parts.hostname in LOCAL_HOSTS and port == self.local_port
+
+    def request(self, method, url, **kwargs):
+        """session.request with the host limit, default timeouts and budgeted retries"""
+        method = method.upper()
+        kwargs.setdefault('timeout', self.timeout)
+        slot = self._slot(urlsplit(url).netloc)
+        if not slot.acquire(timeout=self.acquire_timeout):
+            self._count('rejected')
+            raise HostBusy(f'{self.per_host_limit} requests to {urlsplit(url).netloc} already in flight')
+
+        self._count('requests')
+        try:
+            for attempt in range(self.max_retries + 1):
+                last = attempt == self.max_retries
+                try:
+                    response = self.session.request(method, url, **kwargs)
+                except requests.RequestException as e:
+                    retryable = never_sent(e) or (method in IDEMPOTENT_METHODS
+                                                  and isinstance(e, (requests.ConnectionError, requests.Timeout)))
+                    if last or not retryable or not self._take_retry():
+                        self._count('errors')
+                        raise
+                else:
+                    if (response.status_code not in RETRY_STATUSES or method not in IDEMPOTENT_METHODS
+                            or last or not self._take_retry()):
+                        return response
+                    response.close()
+                time.sleep(self.backoff * (2 ** attempt))
+        finally:
+            slot.release()
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def openai_http_client(self, max_connections=None):
+        """Shared httpx client for OpenAI-compatible SDK clients (keep-alive, limits, timeouts)"""
+        with self.lock:
+            if self._httpx_client is None:
+                import httpx
+                limit = max_connections or self.per_host_limit
+                self._httpx_client = httpx.Client(
+                    limits=httpx.Limits(max_connections=limit, max_keepalive_connections=limit),
+                    timeout=httpx.Timeout(self.timeout[1], connect=self.timeout[0])
+                )
+            return self._httpx_client
+
+    def close(self):
+        self.session.close()
+        if self._httpx_client is not None:
+            self._httpx_client.close()
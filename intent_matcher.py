@@ -0,0 +1,52 @@
+"""
+Intent Matcher for NeuroShield
+Single-pass, word-boundary keyword matching compiled from a pluggable rule table
+"""
+
+import re
+
+
+# (intent, priority, phrases) - higher priority wins when several intents match.
+# Phrases match whole words; a trailing '*' also matches longer word forms
+# ('panic*' matches 'panicking'), and spaces match any whitespace. List word
+# forms explicitly when a prefix would catch unrelated words ('urge*' would
+# match 'urgent').
+INTENT_RULES = [
+    ('urge', 40, ['urge', 'urges', 'urged', 'urging', 'triggered', 'tempted', 'want to', 'craving*']),
+    ('anxiety', 30, ['anxious', 'stressed', 'worried', 'nervous', 'panic*']),
+    ('success', 20, ['good', 'great', 'clean', 'proud', 'strong']),
+    ('relapse', 10, ['relapsed', 'failed', 'gave in', 'broke']),
+]
+
+DEFAULT_INTENT = 'general'
+
+
+def phrase_pattern(phrase):
+    """Regex for one table phrase"""
+    prefix = phrase.endswith('*')
+    words = phrase.rstrip('*').split()
+    pattern = r'\s+'.join(re.escape(word) for word in words)
+    return pattern + (r'\w*' if prefix else '')
+
+
+class IntentMatcher:
+    """Compile all rules into one regex; each intent is a named group"""
+
+    def __init__(self, rules=INTENT_RULES, default=DEFAULT_INTENT):
+        self.default = default
+        self.priorities = {intent: priority for intent, priority, _ in rules}
+        alternatives = [
+            f"(?P<{intent}>{'|'.join(phrase_pattern(p) for p in sorted(phrases, key=len, reverse=True))})"
+            for intent, _, phrases in rules
+        ]
+        self.pattern = re.compile(r'\b(?:' + '|'.join(alternatives) + r')\b', re.IGNORECASE)
+
+    def match(self, message):
+        """Every matched intent, highest priority first"""
+        found = {match.lastgroup for match in self.pattern.finditer(message)}
+        return sorted(found, key=self.priorities.get, reverse=True)
+
+    def best(self, message):
+        """Highest-priority intent, or the default when nothing matches"""
+        matches = self.match(message)
+        return matches[0] if matches else self.default
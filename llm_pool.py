@@ -0,0 +1,75 @@
+"""
+Bounded LLM Call Pool for NeuroShield
+Runs provider calls on worker threads with a deadline and an in-flight cap
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+
+class PoolSaturated(Exception):
+    """Too many provider calls already in flight"""
+
+
+class DeadlineExceeded(Exception):
+    """The provider did not answer before the request deadline"""
+
+
+class CompletionPool:
+    """
+    Run blocking provider calls off the request thread.
+
+    At most max_in_flight calls may be running or queued; further calls are
+    rejected immediately instead of queueing behind a slow provider. The
+    caller waits at most `deadline` seconds. A call that misses its deadline
+    keeps its slot until the provider (bounded by the client timeout)
+    returns, so a hung provider cannot pile up unbounded work.
+    """
+
+    def __init__(self, max_workers=8, max_in_flight=16, deadline=8.0):
+        self.deadline = deadline
+        self.max_in_flight = max_in_flight
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='neuroshield-llm')
+        self.slots = threading.BoundedSemaphore(max_in_flight)
+        self.lock = threading.Lock()
+        self.stats = {'in_flight': 0, 'completed': 0, 'failed': 0, 'timed_out': 0, 'rejected': 0}
+
+    def _count(self, key, delta=1):
+        with self.lock:
+            self.stats[key] += delta
+
+    def _finished(self, _future):
+        self._count('in_flight', -1)
+        self.slots.release()
+
+    def submit(self, fn, *args, **kwargs):
+        """Start fn on the pool without waiting; raises PoolSaturated"""
+        if not self.slots.acquire(blocking=False):
+            self._count('rejected')
+            raise PoolSaturated(f'{self.max_in_flight} provider calls already in flight')
+        try:
+            future = self.executor.submit(fn, *args, **kwargs)
+        except Exception:
+            self.slots.release()
+            raise
+        self._count('in_flight')
+        future.add_done_callback(self._finished)
+        return future
+
+    def run(self, fn, *args, deadline=None, **kwargs):
+        """Call fn on the pool and wait at most `deadline` seconds for it"""
+        future = self.submit(fn, *args, **kwargs)
+        try:
+            result = future.result(timeout=self.deadline if deadline is None else deadline)
+        except FutureTimeout:
+            future.cancel()
+            self._count('timed_out')
+            raise DeadlineExceeded(f'no provider response within {deadline or self.deadline}s')
+        except Exception:
+            self._count('failed')
+            raise
+        self._count('completed')
+        return result
+
+    def shutdown(self, wait=False):
+        self.executor.shutdown(wait=wait, cancel_futures=True)
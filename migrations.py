@@ -0,0 +1,138 @@
+"""
+Schema Migrations for NeuroShield
+Versioned, idempotent schema changes applied at startup
+"""
+
+import analytics_backfill
+import rollups
+import search
+
+
+# Version 1: the original tables plus brain state rollups
+BASE_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT UNIQUE NOT NULL,
+        password_hash TEXT NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        anonymous_id TEXT UNIQUE,
+        consent_research BOOLEAN DEFAULT 0
+    );
+
+    CREATE TABLE IF NOT EXISTS streaks (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        current_streak INTEGER DEFAULT 0,
+        longest_streak INTEGER DEFAULT 0,
+        last_check_in DATE,
+        total_clean_days INTEGER DEFAULT 0,
+        FOREIGN KEY (user_id) REFERENCES users (id)
+    );
+
+    CREATE TABLE IF NOT EXISTS journal_entries (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        entry_date DATE NOT NULL,
+        mood TEXT,
+        triggers TEXT,
+        note TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users (id)
+    );
+
+    CREATE TABLE IF NOT EXISTS eeg_sessions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        session_start TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        session_end TIMESTAMP,
+        avg_risk_score REAL,
+        triggered_count INTEGER DEFAULT 0,
+        focused_count INTEGER DEFAULT 0,
+        FOREIGN KEY (user_id) REFERENCES users (id)
+    );
+
+    CREATE TABLE IF NOT EXISTS brain_states (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        session_id INTEGER NOT NULL,
+        timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        state TEXT NOT NULL,
+        confidence REAL NOT NULL,
+        risk_score REAL,
+        FOREIGN KEY (session_id) REFERENCES eeg_sessions (id)
+    );
+
+    CREATE TABLE IF NOT EXISTS chat_history (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        message TEXT NOT NULL,
+        sender TEXT NOT NULL,
+        timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users (id)
+    );
+
+    CREATE TABLE IF NOT EXISTS emergency_events (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        action_taken TEXT,
+        FOREIGN KEY (user_id) REFERENCES users (id)
+    );
+''' + rollups.SCHEMA
+
+# Version 2: secondary indexes for the per-user and time-window queries
+INDEXES = '''
+    CREATE INDEX IF NOT EXISTS idx_streaks_user ON streaks (user_id);
+    CREATE INDEX IF NOT EXISTS idx_journal_user_date ON journal_entries (user_id, entry_date);
+    CREATE INDEX IF NOT EXISTS idx_eeg_sessions_user_start ON eeg_sessions (user_id, session_start);
+    CREATE INDEX IF NOT EXISTS idx_eeg_sessions_start ON eeg_sessions (session_start);
+    CREATE INDEX IF NOT EXISTS idx_eeg_sessions_open ON eeg_sessions (id) WHERE session_end IS NULL;
+    CREATE INDEX IF NOT EXISTS idx_brain_states_session ON brain_states (session_id, timestamp);
+    CREATE INDEX IF NOT EXISTS idx_brain_states_timestamp ON brain_states (timestamp);
+    CREATE INDEX IF NOT EXISTS idx_chat_history_user_ts ON chat_history (user_id, timestamp);
+    CREATE INDEX IF NOT EXISTS idx_chat_history_timestamp ON chat_history (timestamp);
+    CREATE INDEX IF NOT EXISTS idx_emergency_events_timestamp ON emergency_events (timestamp);
+'''
+
+# Version 7: retention prunes minute rollups by bucket_start across all users
+RETENTION_INDEXES = f'''
+    CREATE INDEX IF NOT EXISTS idx_rollup_minute_bucket ON {rollups.RESOLUTIONS['minute'][0]} (bucket_start);
+'''
+
+# (version, description, sql) - append new entries, never edit applied ones
+MIGRATIONS = [
+    (1, 'base schema', BASE_SCHEMA),
+    (2, 'secondary indexes', INDEXES),
+    (3, 'full-text search', search.fts_schema(scoped=False)),
+    (4, 'user-scoped full-text search', search.rebuild_schema()),
+    (5, 'analytics backfill watermark', analytics_backfill.SCHEMA),
+    (6, 'rollup risk sample counts', rollups.RISK_COUNT_SQL),
+    (7, 'minute rollup retention index', RETENTION_INDEXES),
+]
+
+
+def schema_version(db):
+    """Schema version recorded in the database header"""
+    return db.execute('PRAGMA user_version').fetchone()[0]
+
+
+def apply_migrations(db, migrations=MIGRATIONS):
+    """
+    Apply every migration newer than the recorded schema version.
+
+    Each migration runs in its own transaction together with the
+    user_version bump, so a failed migration leaves the previous version.
+    Returns the list of versions applied.
+    """
+    applied = []
+    for version, description, sql in sorted(migrations):
+        if version <= schema_version(db):
+            continue
+        try:
+            db.executescript(f'BEGIN;\n{sql}\nPRAGMA user_version = {int(version)};\nCOMMIT;')
+        except Exception:
+            if db.in_transaction:
+                db.rollback()
+            raise
+        print(f"✓ Applied migration {version}: {description}")
+        applied.append(version)
+    return applied
@@ -0,0 +1,200 @@
+"""
+Mock LLM Provider for NeuroShield
+OpenAI-compatible fake chat completions with tunable latency, token rate and errors
+"""
+
+import itertools
+import json
+import math
+import random
+import threading
+import time
+import uuid
+from types import SimpleNamespace
+
+from flask import Blueprint, Response, jsonify, request
+
+
+LATENCY_DISTRIBUTIONS = ('fixed', 'uniform', 'lognormal')
+
+_WORDS = (
+    "take a slow breath and notice what you feel right now . urges rise and fall like waves , "
+    "and this one will pass too . you have already done the hard part by reaching out . "
+    "try naming five things you can see , then drink some water and step outside for a moment ."
+).split()
+
+
+class MockProviderError(RuntimeError):
+    """Injected provider failure (status_code mirrors the HTTP error)"""
+
+    def __init__(self, message, status_code=500):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class MockLLM:
+    """
+    Fake chat-completions backend for offline load tests.
+
+    Each call waits a time-to-first-token drawn from `distribution`
+    ('fixed', 'uniform' or 'lognormal' around `latency` seconds with
+    `spread`), then produces `reply_tokens` words at `tokens_per_second`.
+    A fraction `error_rate` of calls fail with `error_status` after the
+    first-token wait. Use it in-process via MockOpenAI or over HTTP via
+    create_blueprint().
+    """
+
+    def __init__(self, latency=0.8, spread=0.5, distribution='lognormal', tokens_per_second=50.0,
+                 reply_tokens=60, error_rate=0.0, error_status=500, seed=None):
+        if distribution not in LATENCY_DISTRIBUTIONS:
+            raise ValueError(f"distribution must be one of {LATENCY_DISTRIBUTIONS}")
+        self.latency = latency
+        self.spread = spread
+        self.distribution = distribution
+        self.tokens_per_second = tokens_per_second
+        self.reply_tokens = reply_tokens
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = {'requests': 0, 'streams': 0, 'errors': 0, 'tokens': 0}
+
+    def first_token_delay(self):
+        with self.lock:
+            if self.distribution == 'fixed':
+                return self.latency
+            if self.distribution == 'uniform':
+                return max(0.0, self.random.uniform(self.latency * (1 - self.spread),
+                                                    self.latency * (1 + self.spread)))
+            # lognormal with median `latency`: a long right tail like real providers
+            return self.random.lognormvariate(math.log(max(self.latency, 1e-6)), self.spread)
+
+    def _should_fail(self):
+        with self.lock:
+            return self.random.random() < self.error_rate
+
+    def _count(self, key, n=1):
+        with self.lock:
+            self.stats[key] += n
+
+    def reply_words(self, messages):
+        """Deterministic reply text for a conversation"""
+        last = messages[-1]['content'] if messages else ''
+        start = sum(map(ord, last)) % len(_WORDS)
+        return [_WORDS[(start + i) % len(_WORDS)] for i in range(self.reply_tokens)]
+
+    def _begin(self, stream):
+        self._count('streams' if stream else 'requests')
+        time.sleep(self.first_token_delay())
+        if self._should_fail():
+            self._count('errors')
+            raise MockProviderError(f"mock provider error {self.error_status}", self.error_status)
+
+    def stream_tokens(self, messages):
+        """Yield reply tokens at the configured rate (after the first-token wait)"""
+        self._begin(stream=True)
+        interval = 1.0 / self.tokens_per_second if self.tokens_per_second else 0
+        for i, word in enumerate(self.reply_words(messages)):
+            if i and interval:
+                time.sleep(interval)
+            self._count('tokens')
+            yield word if i == 0 else ' ' + word
+
+    def complete(self, messages):
+        """Whole reply text, taking as long as streaming it would"""
+        self._begin(stream=False)
+        words = self.reply_words(messages)
+        if self.tokens_per_second:
+            time.sleep(len(words) / self.tokens_per_second)
+        self._count('tokens', len(words))
+        return ' '.join(words)
+
+    def completion_dict(self, model, messages):
+        """Chat completion in the OpenAI wire format"""
+        text = self.complete(messages)
+        prompt_tokens = sum(len(m.get('content') or '') for m in messages) // 4
+        return {
+            'id': f'chatcmpl-mock-{uuid.uuid4().hex[:12]}',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': model,
+            'choices': [{'index': 0, 'finish_reason': 'stop',
+                         'message': {'role': 'assistant', 'content': text}}],
+            'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': self.reply_tokens,
+                      'total_tokens': prompt_tokens + self.reply_tokens}
+        }
+
+    def chunk_dicts(self, model, messages):
+        """Streamed chat completion chunks in the OpenAI wire format"""
+        chunk_id = f'chatcmpl-mock-{uuid.uuid4().hex[:12]}'
+        created = int(time.time())
+
+        def chunk(delta, finish_reason=None):
+            return {'id': chunk_id, 'object': 'chat.completion.chunk', 'created': created, 'model': model,
+                    'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}]}
+
+        first = True
+        for token in self.stream_tokens(messages):
+            yield chunk({'role': 'assistant', 'content': token} if first else {'content': token})
+            first = False
+        yield chunk({'content': None}, 'stop')
+
+
+class MockOpenAI:
+    """In-process stand-in for openai.OpenAI: client.chat.completions.create(...)"""
+
+    def __init__(self, provider=None):
+        self.provider = provider or MockLLM()
+        self.chat = SimpleNamespace(completions=self)
+
+    def create(self, model='mock', messages=(), stream=False, **kwargs):
+        messages = list(messages)
+        if stream:
+            # Like the SDK, errors surface from create(), not mid-iteration
+            chunks = self.provider.chunk_dicts(model, messages)
+            first = next(chunks)
+            return (_namespace(chunk) for chunk in itertools.chain([first], chunks))
+        return _namespace(self.provider.completion_dict(model, messages))
+
+
+def _namespace(value):
+    """Attribute access over a decoded JSON response, like the SDK's models"""
+    if isinstance(value, dict):
+        return SimpleNamespace(**{k: _namespace(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return [_namespace(v) for v in value]
+    return value
+
+
+def create_blueprint(provider):
+    """HTTP endpoint (POST {prefix}/chat/completions) for clients that need a base_url"""
+    blueprint = Blueprint('mock_llm', __name__)
+
+    @blueprint.route('/chat/completions', methods=['POST'])
+    def chat_completions():
+        data = request.get_json() or {}
+        model = data.get('model', 'mock')
+        messages = data.get('messages', [])
+
+        try:
+            if not data.get('stream'):
+                return jsonify(provider.completion_dict(model, messages))
+            chunks = provider.chunk_dicts(model, messages)
+            first = next(chunks)  # surfaces injected errors before the stream starts
+        except MockProviderError as e:
+            return jsonify({'error': {'message': str(e), 'type': 'mock_error',
+                                      'code': e.status_code}}), e.status_code
+
+        def events():
+            yield f'data: {json.dumps(first)}\n\n'
+            for chunk in chunks:
+                yield f'data: {json.dumps(chunk)}\n\n'
+            yield 'data: [DONE]\n\n'
+
+        return Response(events(), mimetype='text/event-stream')
+
+    @blueprint.route('/models', methods=['GET'])
+    def models():
+        return jsonify({'object': 'list', 'data': [{'id': 'mock', 'object': 'model', 'owned_by': 'neuroshield'}]})
+
+    return blueprint
@@ -0,0 +1,64 @@
+"""
+Offline Sync for NeuroShield
+Validates and folds batches of journal entries and check-ins replayed by clients
+"""
+
+from datetime import datetime
+
+
+ITEM_TYPES = ('journal', 'checkin')
+MAX_NOTE_LENGTH = 10000
+
+
+def parse_date(value, default):
+    """ISO date or datetime string (or None) -> date; raises ValueError"""
+    if value in (None, ''):
+        return default
+    if not isinstance(value, str):
+        raise ValueError('date must be an ISO date string')
+    # The whole value must parse: '2025-01-01junk' is rejected, not truncated
+    return datetime.fromisoformat(value).date()
+
+
+def validate_item(item, today):
+    """
+    Normalise one sync item.
+
+    Returns (kind, values) where values are ready for the database, or
+    raises ValueError with a message for the per-item result.
+    """
+    if not isinstance(item, dict):
+        raise ValueError('item must be an object')
+
+    kind = item.get('type')
+    if kind not in ITEM_TYPES:
+        raise ValueError(f"type must be one of {', '.join(ITEM_TYPES)}")
+
+    item_date = parse_date(item.get('date'), today)
+    if item_date > today:
+        raise ValueError('date is in the future')
+
+    if kind == 'journal':
+        fields = [item.get(name) for name in ('mood', 'triggers', 'note')]
+        if any(value is not None and not isinstance(value, str) for value in fields):
+            raise ValueError('mood, triggers and note must be strings')
+        if len(fields[2] or '') > MAX_NOTE_LENGTH:
+            raise ValueError(f'note is longer than {MAX_NOTE_LENGTH} characters')
+        return kind, (item_date, *fields)
+
+    is_clean = item.get('is_clean', True)
+    if not isinstance(is_clean, bool):
+        raise ValueError('is_clean must be true or false')
+    return kind, (item_date, is_clean)
+
+
+def fold_checkins(current, longest, total, checkins):
+    """Apply is_clean flags in order, exactly like repeated single check-ins"""
+    for is_clean in checkins:
+        if is_clean:
+            current += 1
+            total += 1
+            longest = max(longest, current)
+        else:
+            current = 0
+    return current, longest, total
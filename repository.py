@@ -0,0 +1,422 @@
+"""
+Data Access Layer for NeuroShield
+Owns the application's SQL, returns lightweight row tuples and counts queries
+"""
+
+import base64
+import threading
+from collections import namedtuple
+from functools import lru_cache
+
+from flask import g, has_app_context
+
+import rollups
+import search
+
+
+@lru_cache(maxsize=256)
+def row_type(columns):
+    """namedtuple class for a result column set (cached per column set)"""
+    return namedtuple('Row', columns, rename=True)
+
+
+def tuple_row_factory(cursor, row):
+    """Row factory producing namedtuples instead of sqlite3.Row"""
+    return row_type(tuple(column[0] for column in cursor.description))(*row)
+
+
+class QueryStats:
+    """Process-wide query counter"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.total = 0
+
+    def record(self):
+        with self.lock:
+            self.total += 1
+        if has_app_context():
+            g.query_count = g.get('query_count', 0) + 1
+
+
+query_stats = QueryStats()
+
+
+def request_query_count():
+    """Queries issued so far in the current app context"""
+    return g.get('query_count', 0) if has_app_context() else 0
+
+
+def encode_cursor(key, row_id):
+    """Opaque keyset cursor for a (timestamp or date, id) position"""
+    return base64.urlsafe_b64encode(f'{key}|{row_id}'.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """(key, id) from encode_cursor(); raises ValueError when malformed"""
+    try:
+        key, row_id = base64.urlsafe_b64decode(cursor.encode()).decode().rsplit('|', 1)
+        return key, int(row_id)
+    except (ValueError, UnicodeError) as e:
+        raise ValueError(f'invalid cursor: {cursor}') from e
+
+
+def next_cursor(rows, limit, key_field):
+    """Cursor after the last row of a full page, None on the last page"""
+    if len(rows) < limit:
+        return None
+    last = rows[-1]
+    return encode_cursor(getattr(last, key_field), last.id)
+
+
+class Repository:
+    """
+    Every query used by the route handlers and auth helpers.
+
+    SQL strings are constants so the connection's statement cache
+    (cached_statements) can reuse the prepared statements.
+
+    With a ShardRouter, db is the catalog (users) and user-scoped rows are
+    read and written on the user's shard; admin queries fan out.
+    """
+
+    def __init__(self, db, shards=None):
+        self.db = db
+        self.shards = shards
+        self.shard_dbs = {}
+        self.borrowed = []
+
+    # ---------- internals ----------
+
+    def _execute(self, sql, params=(), db=None):
+        query_stats.record()
+        cursor = (db or self.db).cursor()
+        cursor.row_factory = tuple_row_factory
+        return cursor.execute(sql, params)
+
+    def _one(self, sql, params=(), db=None):
+        return self._execute(sql, params, db).fetchone()
+
+    def _all(self, sql, params=(), db=None):
+        return self._execute(sql, params, db).fetchall()
+
+    def _scalar(self, sql, params=(), db=None):
+        row = self._execute(sql, params, db).fetchone()
+        return row[0] if row else None
+
+    def _shard(self, index):
+        conn = self.shard_dbs.get(index)
+        if conn is None:
+            conn = self.shards.managers[index].get()
+            if not has_app_context():
+                self.borrowed.append(conn)
+            self.shard_dbs[index] = conn
+        return conn
+
+    def _db_for(self, user_id):
+        """Connection holding a user's rows (the catalog when not sharded)"""
+        if self.shards is None:
+            return self.db
+        return self._shard(self.shards.index_for(user_id))
+
+    def _user_dbs(self):
+        """Every connection holding user-scoped rows, for fan-out queries"""
+        if self.shards is None:
+            return [self.db]
+        return [self._shard(index) for index in range(len(self.shards))]
+
+    def commit(self):
+        self.db.commit()
+        for conn in self.shard_dbs.values():
+            conn.commit()
+
+    def rollback(self):
+        self.db.rollback()
+        for conn in self.shard_dbs.values():
+            conn.rollback()
+
+    def close(self):
+        """Return shard connections checked out outside an app context"""
+        while self.borrowed:
+            self.borrowed.pop().close()
+        self.shard_dbs.clear()
+
+    # ---------- users ----------
+
+    def create_user(self, username, password_hash, anonymous_id, consent_research):
+        """Insert a user and their empty streak row; returns the user id
+
+        When sharded the streak row lives on the user's shard, so the two
+        inserts commit separately.
+        """
+        user_id = self._execute(
+            'INSERT INTO users (username, password_hash, anonymous_id, consent_research) VALUES (?, ?, ?, ?)',
+            (username, password_hash, anonymous_id, consent_research)
+        ).lastrowid
+        self._execute(
+            'INSERT INTO streaks (user_id, current_streak, longest_streak) VALUES (?, 0, 0)',
+            (user_id,), self._db_for(user_id)
+        )
+        return user_id
+
+    def get_user_by_username(self, username):
+        return self._one(
+            'SELECT id, username, password_hash, anonymous_id, consent_research, created_at '
+            'FROM users WHERE username = ?',
+            (username,)
+        )
+
+    def get_user_info(self, user_id):
+        return self._one(
+            'SELECT id, username, anonymous_id, consent_research, created_at FROM users WHERE id = ?',
+            (user_id,)
+        )
+
+    def get_password_hash(self, user_id):
+        return self._scalar('SELECT password_hash FROM users WHERE id = ?', (user_id,))
+
+    def update_password_hash(self, user_id, password_hash):
+        self._execute('UPDATE users SET password_hash = ? WHERE id = ?', (password_hash, user_id))
+
+    def delete_user(self, user_id):
+        """Delete a user and all associated data (caller commits)"""
+        db = self._db_for(user_id)
+        self._execute(
+            'DELETE FROM brain_states WHERE session_id IN (SELECT id FROM eeg_sessions WHERE user_id = ?)',
+            (user_id,), db
+        )
+        self._execute('DELETE FROM eeg_sessions WHERE user_id = ?', (user_id,), db)
+        self._execute('DELETE FROM chat_history WHERE user_id = ?', (user_id,), db)
+        self._execute('DELETE FROM emergency_events WHERE user_id = ?', (user_id,), db)
+        self._execute('DELETE FROM journal_entries WHERE user_id = ?', (user_id,), db)
+        self._execute('DELETE FROM streaks WHERE user_id = ?', (user_id,), db)
+        for table, _, _, _ in rollups.RESOLUTIONS.values():
+            self._execute(f'DELETE FROM {table} WHERE user_id = ?', (user_id,), db)
+        self._execute('DELETE FROM users WHERE id = ?', (user_id,))
+
+    # ---------- streaks ----------
+
+    def get_streak(self, user_id):
+        return self._one(
+            'SELECT current_streak, longest_streak, total_clean_days, last_check_in '
+            'FROM streaks WHERE user_id = ?',
+            (user_id,), self._db_for(user_id)
+        )
+
+    def get_current_streak(self, user_id):
+        return self._scalar(
+            'SELECT current_streak FROM streaks WHERE user_id = ?', (user_id,), self._db_for(user_id)
+        ) or 0
+
+    def update_streak(self, user_id, current, longest, total, last_check_in):
+        self._execute(
+            'UPDATE streaks SET current_streak = ?, longest_streak = ?, total_clean_days = ?, last_check_in = ? '
+            'WHERE user_id = ?',
+            (current, longest, total, last_check_in, user_id), self._db_for(user_id)
+        )
+
+    # ---------- journal ----------
+
+    def list_journal(self, user_id, limit=30, before=None):
+        """Newest entries first; before=(entry_date, id) continues a page"""
+        if before is None:
+            return self._all(
+                'SELECT * FROM journal_entries WHERE user_id = ? ORDER BY entry_date DESC, id DESC LIMIT ?',
+                (user_id, limit), self._db_for(user_id)
+            )
+        return self._all(
+            'SELECT * FROM journal_entries WHERE user_id = ? AND (entry_date, id) < (?, ?) '
+            'ORDER BY entry_date DESC, id DESC LIMIT ?',
+            (user_id, *before, limit), self._db_for(user_id)
+        )
+
+    def add_journal_entry(self, user_id, entry_date, mood, triggers, note):
+        return self._execute(
+            'INSERT INTO journal_entries (user_id, entry_date, mood, triggers, note) VALUES (?, ?, ?, ?, ?)',
+            (user_id, entry_date, mood, triggers, note), self._db_for(user_id)
+        ).lastrowid
+
+    def add_journal_entries(self, user_id, entries):
+        """Insert (entry_date, mood, triggers, note) rows with one executemany"""
+        query_stats.record()
+        self._db_for(user_id).executemany(
+            'INSERT INTO journal_entries (user_id, entry_date, mood, triggers, note) VALUES (?, ?, ?, ?, ?)',
+            [(user_id, *entry) for entry in entries]
+        )
+
+    # ---------- EEG ----------
+
+    def create_eeg_session(self, user_id):
+        return self._execute(
+            'INSERT INTO eeg_sessions (user_id) VALUES (?)', (user_id,), self._db_for(user_id)
+        ).lastrowid
+
+    def end_eeg_session(self, user_id, session_id):
+        self._execute(
+            'UPDATE eeg_sessions SET session_end = CURRENT_TIMESTAMP '
+            'WHERE id = ? AND user_id = ? AND session_end IS NULL',
+            (session_id, user_id), self._db_for(user_id)
+        )
+
+    def list_eeg_sessions(self, user_id, limit=10):
+        return self._all(
+            'SELECT id, session_start, session_end, avg_risk_score, triggered_count, focused_count '
+            'FROM eeg_sessions WHERE user_id = ? ORDER BY session_start DESC LIMIT ?',
+            (user_id, limit), self._db_for(user_id)
+        )
+
+    def list_recent_states(self, user_id, limit=100, before=None):
+        """
+        Newest brain states first; before=(timestamp, id) continues a page.
+
+        Walks the user's sessions newest first and each session's states in
+        index order, so no page sorts the whole history. Order is exact as
+        long as a user's sessions do not overlap in time.
+        """
+        db = self._db_for(user_id)
+        if before is None:
+            return self._all(
+                'SELECT bs.id, bs.timestamp, bs.state, bs.risk_score '
+                'FROM eeg_sessions es JOIN brain_states bs ON bs.session_id = es.id '
+                'WHERE es.user_id = ? '
+                'ORDER BY es.session_start DESC, es.id DESC, bs.timestamp DESC, bs.id DESC LIMIT ?',
+                (user_id, limit), db
+            )
+
+        owner = self._one(
+            'SELECT es.id, es.session_start FROM brain_states bs JOIN eeg_sessions es ON es.id = bs.session_id '
+            'WHERE bs.id = ? AND es.user_id = ?',
+            (before[1], user_id), db
+        )
+        if owner is None:
+            return []
+
+        states = self._all(
+            'SELECT id, timestamp, state, risk_score FROM brain_states '
+            'WHERE session_id = ? AND (timestamp, id) < (?, ?) ORDER BY timestamp DESC, id DESC LIMIT ?',
+            (owner.id, *before, limit), db
+        )
+        if len(states) < limit:
+            states += self._all(
+                'SELECT bs.id, bs.timestamp, bs.state, bs.risk_score '
+                'FROM eeg_sessions es JOIN brain_states bs ON bs.session_id = es.id '
+                'WHERE es.user_id = ? AND (es.session_start, es.id) < (?, ?) '
+                'ORDER BY es.session_start DESC, es.id DESC, bs.timestamp DESC, bs.id DESC LIMIT ?',
+                (user_id, owner.session_start, owner.id, limit - len(states)), db
+            )
+        return states
+
+    def state_timeline(self, user_id, start, end, resolution):
+        query_stats.record()
+        return rollups.fetch_timeline(self._db_for(user_id), user_id, start, end, resolution)
+
+    # ---------- chat ----------
+
+    def add_chat_message(self, user_id, message, sender):
+        return self._execute(
+            'INSERT INTO chat_history (user_id, message, sender) VALUES (?, ?, ?)',
+            (user_id, message, sender), self._db_for(user_id)
+        ).lastrowid
+
+    def list_chat_history(self, user_id, limit=100, before=None):
+        """Latest page, newest first; before=(timestamp, id) pages further back"""
+        if before is None:
+            return self._all(
+                'SELECT * FROM chat_history WHERE user_id = ? ORDER BY timestamp DESC, id DESC LIMIT ?',
+                (user_id, limit), self._db_for(user_id)
+            )
+        return self._all(
+            'SELECT * FROM chat_history WHERE user_id = ? AND (timestamp, id) < (?, ?) '
+            'ORDER BY timestamp DESC, id DESC LIMIT ?',
+            (user_id, *before, limit), self._db_for(user_id)
+        )
+
+    def clear_chat_history(self, user_id):
+        self._execute('DELETE FROM chat_history WHERE user_id = ?', (user_id,), self._db_for(user_id))
+
+    # ---------- search ----------
+
+    def search(self, user_id, text, scope='all', limit=20, offset=0):
+        """Best-ranked (bm25) journal and chat matches for one user"""
+        if search.match_query(text) is None:
+            return []
+        params = {'user_id': user_id, 'limit': limit, 'offset': offset}
+        parts = []
+        if scope in ('all', 'journal'):
+            params['journal_query'] = search.user_match_query(user_id, text, search.SEARCH_INDEXES['journal'][2])
+            parts.append(
+                "SELECT 'journal' AS kind, j.id, j.entry_date AS date, "
+                "snippet(journal_fts, -1, '[', ']', '…', 12) AS snippet, journal_fts.rank AS rank "
+                'FROM journal_fts JOIN journal_entries j ON j.id = journal_fts.rowid '
+                'WHERE journal_fts MATCH :journal_query AND j.user_id = :user_id'
+            )
+        if scope in ('all', 'chat'):
+            params['chat_query'] = search.user_match_query(user_id, text, search.SEARCH_INDEXES['chat'][2])
+            parts.append(
+                "SELECT 'chat' AS kind, c.id, c.timestamp AS date, "
+                "snippet(chat_fts, 0, '[', ']', '…', 12) AS snippet, chat_fts.rank AS rank "
+                'FROM chat_fts JOIN chat_history c ON c.id = chat_fts.rowid '
+                'WHERE chat_fts MATCH :chat_query AND c.user_id = :user_id'
+            )
+        return self._all(
+            ' UNION ALL '.join(parts) + ' ORDER BY rank, date DESC LIMIT :limit OFFSET :offset',
+            params, self._db_for(user_id)
+        )
+
+    # ---------- emergency ----------
+
+    def log_emergency(self, user_id, action):
+        self._execute(
+            'INSERT INTO emergency_events (user_id, action_taken) VALUES (?, ?)',
+            (user_id, action), self._db_for(user_id)
+        )
+
+    # ---------- admin ----------
+
+    def admin_stats(self):
+        """Aggregate counters for the admin dashboard (summed across shards)"""
+        active_sessions = clean_days = streak_sum = streak_rows = emergencies = triggered = focused = 0
+        for db in self._user_dbs():
+            streaks = self._one(
+                'SELECT COALESCE(SUM(total_clean_days), 0), COALESCE(SUM(current_streak), 0), COUNT(*) '
+                'FROM streaks', db=db
+            )
+            states = self._one(
+                'SELECT COALESCE(SUM(triggered_count), 0), COALESCE(SUM(focused_count), 0) '
+                'FROM eeg_sessions WHERE session_start > datetime("now", "-7 days")', db=db
+            )
+            active_sessions += self._scalar(
+                'SELECT COUNT(*) FROM eeg_sessions WHERE session_end IS NULL', db=db
+            )
+            emergencies += self._scalar(
+                'SELECT COUNT(*) FROM emergency_events WHERE timestamp > datetime("now", "-7 days")', db=db
+            )
+            clean_days += streaks[0]
+            streak_sum += streaks[1]
+            streak_rows += streaks[2]
+            triggered += states[0]
+            focused += states[1]
+
+        return {
+            'total_users': self._scalar('SELECT COUNT(*) FROM users'),
+            'active_sessions': active_sessions,
+            'total_clean_days': clean_days,
+            'avg_current_streak': streak_sum / streak_rows if streak_rows else 0,
+            'emergency_events_week': emergencies,
+            'triggered_week': triggered,
+            'focused_week': focused,
+        }
+
+
+def as_repository(db, shards=None):
+    """Accept either a Repository or a raw connection"""
+    return db if isinstance(db, Repository) else Repository(db, shards)
+
+
+def get_repository(connect, shards=None):
+    """Repository bound to the current app context's connection"""
+    if not has_app_context():
+        return Repository(connect(), shards)
+    if '_repository' not in g:
+        g._repository = Repository(connect(), shards)
+    return g._repository
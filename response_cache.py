@@ -0,0 +1,92 @@
+"""
+Coach Response Cache for NeuroShield
+Bounded LRU/TTL cache of LLM replies keyed by message and conversation context
+"""
+
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+
+
+STREAK_BUCKETS = (0, 1, 4, 8, 31, 91)  # 0, 1-3, 4-7, 8-30, 31-90, 91+ days
+
+_non_word = re.compile(r'[^\w\s]')
+_spaces = re.compile(r'\s+')
+
+
+def normalize_message(message):
+    """Lowercase, drop punctuation and collapse whitespace"""
+    return _spaces.sub(' ', _non_word.sub('', message.lower())).strip()
+
+
+def streak_bucket(streak):
+    """Coarse streak band, so similar users share cache entries"""
+    bucket = 0
+    for index, lower in enumerate(STREAK_BUCKETS):
+        if streak >= lower:
+            bucket = index
+    return bucket
+
+
+def history_fingerprint(history, turns=4):
+    """Short hash of the last few conversation turns ('' for a new conversation)"""
+    recent = history[-turns:]
+    if not recent:
+        return ''
+    digest = hashlib.blake2b(digest_size=8)
+    for role, content in recent:
+        digest.update(f'{role}\0{normalize_message(content)}\0'.encode())
+    return digest.hexdigest()
+
+
+class ResponseCache:
+    """Thread-safe LRU cache with a per-entry time to live and hit-rate counters"""
+
+    def __init__(self, max_entries=1024, ttl=3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = self.misses = self.expired = self.evictions = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self.entries[key]
+                self.expired += 1
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = (value, time.monotonic() + self.ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'expired': self.expired,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
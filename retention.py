@@ -0,0 +1,191 @@
+"""
+Retention and Compaction for NeuroShield
+Enforces ANALYTICS_RETENTION_DAYS on raw brain states and chat history
+"""
+
+import gzip
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import analytics_backfill
+from rollups import RESOLUTIONS
+
+
+def retention_cutoff(retention_days):
+    """Oldest timestamp kept, in SQLite CURRENT_TIMESTAMP format"""
+    cutoff = datetime.now(timezone.utc) - timedelta(days=retention_days)
+    return cutoff.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def delete_in_batches(connect, table, column, cutoff, batch_size, pause=0.0, key='rowid', condition=None):
+    """Delete rows older than cutoff (and matching condition), one short transaction per batch"""
+    where = f'{column} < ?' + (f' AND {condition.strip()}' if condition else '')
+    deleted = 0
+    while True:
+        db = connect()
+        try:
+            with db:
+                cursor = db.execute(
+                    f'DELETE FROM {table} WHERE ({key}) IN '
+                    f'(SELECT {key} FROM {table} WHERE {where} LIMIT ?)',
+                    (cutoff, batch_size)
+                )
+        finally:
+            db.close()
+
+        deleted += cursor.rowcount
+        if cursor.rowcount < batch_size:
+            return deleted
+        time.sleep(pause)
+
+
+def archive_chat_history(connect, cutoff, batch_size, archive_folder, pause=0.0):
+    """Move expired chat messages into gzipped JSON-lines files, batch by batch"""
+    os.makedirs(archive_folder, exist_ok=True)
+    archive_path = os.path.join(
+        archive_folder, f"chat_history_{datetime.now(timezone.utc):%Y%m%d}.jsonl.gz"
+    )
+
+    archived = 0
+    while True:
+        db = connect()
+        try:
+            rows = db.execute(
+                'SELECT id, user_id, message, sender, timestamp FROM chat_history '
+                'WHERE timestamp < ? ORDER BY timestamp, id LIMIT ?',
+                (cutoff, batch_size)
+            ).fetchall()
+            if not rows:
+                return archived
+
+            # Append a gzip member per batch; readers see one continuous stream
+            with gzip.open(archive_path, 'at', encoding='utf-8') as archive:
+                for row in rows:
+                    archive.write(json.dumps({
+                        'id': row[0],
+                        'user_id': row[1],
+                        'message': row[2],
+                        'sender': row[3],
+                        'timestamp': str(row[4])
+                    }) + '\n')
+
+            with db:
+                db.executemany('DELETE FROM chat_history WHERE id = ?', [(row[0],) for row in rows])
+        finally:
+            db.close()
+
+        archived += len(rows)
+        if len(rows) < batch_size:
+            return archived
+        time.sleep(pause)
+
+
+def incremental_vacuum(connect, pages=0):
+    """Return free pages to the OS (no-op unless auto_vacuum is INCREMENTAL)"""
+    db = connect()
+    try:
+        if pages:
+            db.execute(f'PRAGMA incremental_vacuum({int(pages)})').fetchall()
+        else:
+            db.execute('PRAGMA incremental_vacuum').fetchall()
+    finally:
+        db.close()
+
+
+def ensure_incremental_auto_vacuum(db):
+    """
+    One-time conversion of an existing database to auto_vacuum INCREMENTAL.
+
+    New files get the mode from ConnectionManager, but SQLite only applies a
+    changed auto_vacuum to an existing file on a full VACUUM, which rewrites
+    the whole database once. Returns True when a conversion ran.
+    """
+    if db.execute('PRAGMA auto_vacuum').fetchone()[0] == 2:
+        return False
+    db.commit()  # VACUUM cannot run inside a transaction
+    db.execute('PRAGMA auto_vacuum = INCREMENTAL')
+    db.execute('VACUUM')
+    print("✓ Converted database to incremental auto_vacuum")
+    return True
+
+
+def compact(connect, retention_days, batch_size=1000, archive_folder='archive', pause=0.0):
+    """
+    Apply the retention window once.
+
+    Raw brain states are summarised in eeg_sessions and the hour/day rollups:
+    by the buffer as they are written, and by the analytics backfill for rows
+    from before the upgrade. The backfill runs first and only rows it has
+    passed are deleted. Minute rollups are pruned with the same window. Chat
+    messages are archived to disk before they are deleted.
+    """
+    cutoff = retention_cutoff(retention_days)
+    minute_table = RESOLUTIONS['minute'][0]
+
+    stats = {
+        'cutoff': cutoff,
+        'brain_states_folded': analytics_backfill.backfill(connect, batch_size, pause),
+        'brain_states_deleted': delete_in_batches(
+            connect, 'brain_states', 'timestamp', cutoff, batch_size, pause,
+            condition=analytics_backfill.FOLDED_ROW
+        ),
+        'minute_rollups_deleted': delete_in_batches(
+            connect, minute_table, 'bucket_start', cutoff, batch_size, pause,
+            key='user_id, bucket_start'
+        ),
+        'chat_messages_archived': archive_chat_history(
+            connect, cutoff, batch_size, archive_folder, pause
+        ),
+    }
+    incremental_vacuum(connect)
+    return stats
+
+
+class RetentionJob:
+    """Background thread that runs compact() on a fixed interval"""
+
+    def __init__(self, connect, retention_days, interval=6 * 3600, batch_size=1000,
+                 archive_folder='archive', pause=0.05):
+        # One connect callable, or a list of them (one per shard)
+        self.connects = connect if isinstance(connect, (list, tuple)) else [connect]
+        self.retention_days = retention_days
+        self.interval = interval
+        self.batch_size = batch_size
+        self.archive_folder = archive_folder
+        self.pause = pause
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.last_run = None
+
+    def run_once(self):
+        """Compact now and remember the result: one stats dict per database (catalog or shard)"""
+        stats = [
+            compact(connect, self.retention_days, self.batch_size, self.archive_folder, self.pause)
+            for connect in self.connects
+        ]
+        self.last_run = stats
+        return stats
+
+    def start(self):
+        """Start the background thread"""
+        if self.thread and self.thread.is_alive():
+            return
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stop the background thread"""
+        self.stop_event.set()
+
+    def _run(self):
+        while not self.stop_event.is_set():
+            try:
+                stats = self.run_once()
+                print(f"✓ Retention compaction: {stats}")
+            except Exception as e:
+                print(f"Error during retention compaction: {e}")
+            self.stop_event.wait(self.interval)
@@ -0,0 +1,160 @@
+"""
+Brain State Rollups for NeuroShield
+Minute, hour and day buckets of brain_states for long-range timelines
+"""
+
+from datetime import datetime, timedelta, timezone
+
+
+# resolution -> (table, bucket width in seconds, timestamp prefix length, suffix)
+# Buckets are derived from the 'YYYY-MM-DD HH:MM:SS' timestamps stored in
+# brain_states by truncating the string, so they line up with SQLite's own
+# datetime() output.
+RESOLUTIONS = {
+    'minute': ('brain_state_rollup_minute', 60, 16, ':00'),
+    'hour': ('brain_state_rollup_hour', 3600, 13, ':00:00'),
+    'day': ('brain_state_rollup_day', 86400, 10, ' 00:00:00'),
+}
+
+# Finest first, used when picking a resolution for a time range
+RESOLUTION_ORDER = ['minute', 'hour', 'day']
+
+ROLLUP_TABLE_SQL = '''
+    CREATE TABLE IF NOT EXISTS {table} (
+        user_id INTEGER NOT NULL,
+        bucket_start TIMESTAMP NOT NULL,
+        sample_count INTEGER NOT NULL DEFAULT 0,
+        focused_count INTEGER NOT NULL DEFAULT 0,
+        triggered_count INTEGER NOT NULL DEFAULT 0,
+        risk_sum REAL NOT NULL DEFAULT 0,
+        risk_min REAL,
+        risk_max REAL,
+        PRIMARY KEY (user_id, bucket_start)
+    ) WITHOUT ROWID;
+'''
+
+# risk_count counts the samples behind risk_sum (sample_count includes NULL risks)
+RISK_COUNT_SQL = ''.join(
+    f'''
+    ALTER TABLE {table} ADD COLUMN risk_count INTEGER NOT NULL DEFAULT 0;
+    UPDATE {table} SET risk_count = CASE WHEN risk_min IS NULL THEN 0 ELSE sample_count END;
+    '''
+    for table, _, _, _ in RESOLUTIONS.values()
+)
+
+UPSERT_ROLLUP_SQL = '''
+    INSERT INTO {table} (user_id, bucket_start, sample_count, focused_count,
+                         triggered_count, risk_sum, risk_count, risk_min, risk_max)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (user_id, bucket_start) DO UPDATE SET
+        sample_count = sample_count + excluded.sample_count,
+        focused_count = focused_count + excluded.focused_count,
+        triggered_count = triggered_count + excluded.triggered_count,
+        risk_sum = risk_sum + excluded.risk_sum,
+        risk_count = risk_count + excluded.risk_count,
+        risk_min = MIN(COALESCE(risk_min, excluded.risk_min), COALESCE(excluded.risk_min, risk_min)),
+        risk_max = MAX(COALESCE(risk_max, excluded.risk_max), COALESCE(excluded.risk_max, risk_max))
+'''
+
+SELECT_ROLLUP_SQL = '''
+    SELECT bucket_start, sample_count, focused_count, triggered_count,
+           risk_sum, risk_count, risk_min, risk_max
+    FROM {table}
+    WHERE user_id = ? AND bucket_start >= ? AND bucket_start <= ?
+    ORDER BY bucket_start
+'''
+
+SCHEMA = ''.join(ROLLUP_TABLE_SQL.format(table=table) for table, _, _, _ in RESOLUTIONS.values())
+
+
+def bucket_start(timestamp, resolution):
+    """Truncate a 'YYYY-MM-DD HH:MM:SS' timestamp to the start of its bucket"""
+    _, _, prefix, suffix = RESOLUTIONS[resolution]
+    return timestamp[:prefix] + suffix
+
+
+def rollup_deltas(rows, resolution):
+    """
+    Aggregate (user_id, timestamp, state, risk_score) rows into
+    upsert parameters for one resolution
+    """
+    buckets = {}
+    for user_id, timestamp, state, risk_score in rows:
+        key = (user_id, bucket_start(timestamp, resolution))
+        count, focused, triggered, risk_sum, risk_count, risk_min, risk_max = buckets.get(
+            key, (0, 0, 0, 0.0, 0, None, None)
+        )
+        if risk_score is not None:
+            risk_sum += risk_score
+            risk_count += 1
+            risk_min = risk_score if risk_min is None else min(risk_min, risk_score)
+            risk_max = risk_score if risk_max is None else max(risk_max, risk_score)
+        buckets[key] = (
+            count + 1,
+            focused + (state == 'focused'),
+            triggered + (state == 'triggered'),
+            risk_sum,
+            risk_count,
+            risk_min,
+            risk_max
+        )
+    return [key + values for key, values in buckets.items()]
+
+
+def apply_rollups(db, rows):
+    """Fold a batch of brain state rows into every rollup table"""
+    for resolution, (table, _, _, _) in RESOLUTIONS.items():
+        db.executemany(UPSERT_ROLLUP_SQL.format(table=table), rollup_deltas(rows, resolution))
+
+
+def choose_resolution(start, end, max_points=500):
+    """Finest resolution that covers start..end in at most max_points buckets"""
+    span = (end - start).total_seconds()
+    for resolution in RESOLUTION_ORDER:
+        if span / RESOLUTIONS[resolution][1] <= max_points:
+            return resolution
+    return RESOLUTION_ORDER[-1]
+
+
+def fetch_timeline(db, user_id, start, end, resolution):
+    """Read rollup buckets for a user between two datetimes"""
+    table = RESOLUTIONS[resolution][0]
+    rows = db.execute(
+        SELECT_ROLLUP_SQL.format(table=table),
+        (user_id, format_timestamp(start, resolution), format_timestamp(end, resolution))
+    ).fetchall()
+
+    return [
+        {
+            'bucket_start': row[0],
+            'sample_count': row[1],
+            'focused_count': row[2],
+            'triggered_count': row[3],
+            'avg_risk': row[4] / row[5] if row[5] else None,
+            'min_risk': row[6],
+            'max_risk': row[7]
+        }
+        for row in rows
+    ]
+
+
+def format_timestamp(value, resolution=None):
+    """Format a datetime like SQLite timestamps, optionally bucket-aligned"""
+    timestamp = value.strftime('%Y-%m-%d %H:%M:%S')
+    return bucket_start(timestamp, resolution) if resolution else timestamp
+
+
+def parse_range(start=None, end=None, default_span=timedelta(hours=24)):
+    """Parse ISO start/end query values as UTC, defaulting to the last 24 hours"""
+    end_dt = to_utc(datetime.fromisoformat(end)) if end else to_utc(datetime.now(timezone.utc))
+    start_dt = to_utc(datetime.fromisoformat(start)) if start else end_dt - default_span
+    if start_dt >= end_dt:
+        raise ValueError('start must be before end')
+    return start_dt, end_dt
+
+
+def to_utc(value):
+    """Naive UTC datetime; naive input is assumed to already be UTC"""
+    if value.tzinfo:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
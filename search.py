@@ -0,0 +1,169 @@
+"""
+Full-Text Search for NeuroShield
+FTS5 indexes over journal entries and coach chat, kept in sync by triggers
+"""
+
+import threading
+import time
+
+
+# (fts table, content table, searchable text columns)
+SEARCH_INDEXES = {
+    'journal': ('journal_fts', 'journal_entries', ('note', 'triggers')),
+    'chat': ('chat_fts', 'chat_history', ('message',)),
+}
+
+# Indexed after the text columns so MATCH itself is scoped to one user's rows
+OWNER_COLUMN = 'user_id'
+
+# A row is in the index once the backfill has passed it (id <= last_id) or
+# when it was inserted after the migration (id > max_id). Delete/update
+# triggers must only remove rows that are actually indexed.
+INDEXED_ROW = '''
+    (SELECT {row}.id <= last_id OR {row}.id > max_id FROM search_backfill WHERE table_name = '{fts}')
+'''
+
+FTS_TABLE_SQL = '''
+    CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5(
+        {columns}, content='{content}', content_rowid='id', tokenize='porter unicode61'
+    );
+
+    INSERT OR IGNORE INTO search_backfill (table_name, last_id, max_id)
+    SELECT '{fts}', 0, COALESCE(MAX(id), 0) FROM {content};
+
+    CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {content} BEGIN
+        INSERT INTO {fts} (rowid, {columns}) VALUES (new.id, {new_values});
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {content}
+    WHEN {old_indexed} BEGIN
+        INSERT INTO {fts} ({fts}, rowid, {columns}) VALUES ('delete', old.id, {old_values});
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF {columns} ON {content}
+    WHEN {old_indexed} BEGIN
+        INSERT INTO {fts} ({fts}, rowid, {columns}) VALUES ('delete', old.id, {old_values});
+        INSERT INTO {fts} (rowid, {columns}) VALUES (new.id, {new_values});
+    END;
+'''
+
+
+def indexed_columns(columns, scoped=True):
+    """FTS table columns: the text columns, then the owner column when scoped"""
+    return (*columns, OWNER_COLUMN) if scoped else tuple(columns)
+
+
+def fts_schema(scoped=True):
+    """DDL for the FTS tables, sync triggers and backfill watermarks"""
+    sql = '''
+    CREATE TABLE IF NOT EXISTS search_backfill (
+        table_name TEXT PRIMARY KEY,
+        last_id INTEGER NOT NULL,
+        max_id INTEGER NOT NULL
+    );
+    '''
+    for fts, content, columns in SEARCH_INDEXES.values():
+        columns = indexed_columns(columns, scoped)
+        sql += FTS_TABLE_SQL.format(
+            fts=fts,
+            content=content,
+            columns=', '.join(columns),
+            new_values=', '.join(f'new.{column}' for column in columns),
+            old_values=', '.join(f'old.{column}' for column in columns),
+            old_indexed=INDEXED_ROW.format(row='old', fts=fts).strip()
+        )
+    return sql
+
+
+def rebuild_schema():
+    """Drop the FTS tables and triggers and recreate them user-scoped, to be backfilled again"""
+    sql = ''
+    for fts, _, _ in SEARCH_INDEXES.values():
+        sql += f'''
+    DROP TRIGGER IF EXISTS {fts}_ai;
+    DROP TRIGGER IF EXISTS {fts}_ad;
+    DROP TRIGGER IF EXISTS {fts}_au;
+    DROP TABLE IF EXISTS {fts};
+    DELETE FROM search_backfill WHERE table_name = '{fts}';
+    '''
+    return sql + fts_schema()
+
+
+def match_query(text):
+    """
+    Turn user input into a safe FTS5 query: every word is quoted (so FTS
+    operators are literal) and the last one is a prefix match.
+    """
+    terms = [term.replace('"', '""') for term in text.split()]
+    if not terms:
+        return None
+    return ' '.join(f'"{term}"' for term in terms[:-1]) + (' ' if len(terms) > 1 else '') + f'"{terms[-1]}"*'
+
+
+def user_match_query(user_id, text, columns):
+    """match_query() over the text columns, limited to one user's rows inside the index"""
+    query = match_query(text)
+    if query is None:
+        return None
+    return f'{OWNER_COLUMN} : "{int(user_id)}" AND {{{" ".join(columns)}}} : ({query})'
+
+
+def backfill_batch(db, fts, batch_size=1000):
+    """Index the next batch of pre-existing rows; returns rows indexed"""
+    _, content, columns = next(index for index in SEARCH_INDEXES.values() if index[0] == fts)
+    columns = indexed_columns(columns)
+    with db:
+        last_id, max_id = db.execute(
+            'SELECT last_id, max_id FROM search_backfill WHERE table_name = ?', (fts,)
+        ).fetchone()
+        if last_id >= max_id:
+            return 0
+        rows = db.execute(
+            f"SELECT id, {', '.join(columns)} FROM {content} WHERE id > ? AND id <= ? ORDER BY id LIMIT ?",
+            (last_id, max_id, batch_size)
+        ).fetchall()
+        if rows:
+            db.executemany(
+                f"INSERT INTO {fts} (rowid, {', '.join(columns)}) VALUES ({', '.join('?' * (len(columns) + 1))})",
+                [tuple(row) for row in rows]
+            )
+        # Rows deleted before they were indexed leave gaps; jump to max_id when done
+        new_last = rows[-1][0] if len(rows) == batch_size else max_id
+        db.execute('UPDATE search_backfill SET last_id = ? WHERE table_name = ?', (new_last, fts))
+        return len(rows)
+
+
+def backfill(connect, batch_size=1000, pause=0.05):
+    """Index rows that existed before the FTS migration, one short transaction per batch"""
+    indexed = 0
+    for fts, _, _ in SEARCH_INDEXES.values():
+        while True:
+            db = connect()
+            try:
+                count = backfill_batch(db, fts, batch_size)
+                done = db.execute(
+                    'SELECT last_id >= max_id FROM search_backfill WHERE table_name = ?', (fts,)
+                ).fetchone()[0]
+            finally:
+                db.close()
+            indexed += count
+            if done:
+                break
+            time.sleep(pause)
+    return indexed
+
+
+def start_backfill(connects, batch_size=1000, pause=0.05):
+    """Run backfill() for every database on a daemon thread"""
+    def run():
+        for connect in connects:
+            try:
+                indexed = backfill(connect, batch_size, pause)
+                if indexed:
+                    print(f"✓ Search index backfilled {indexed} rows")
+            except Exception as e:
+                print(f"Error backfilling search index: {e}")
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,62 @@
+"""
+Per-User Sharded Storage for NeuroShield
+Routes each user's rows to one of N SQLite files; users stay in the catalog DB
+"""
+
+import os
+import zlib
+
+from database import ConnectionManager
+
+
+def shard_path(base_path, index):
+    """neuroshield.db -> neuroshield.shard0.db (':memory:' stays in memory)"""
+    if base_path == ':memory:':
+        return base_path
+    root, ext = os.path.splitext(base_path)
+    return f'{root}.shard{index}{ext or ".db"}'
+
+
+class ShardRouter:
+    """
+    Map user ids to shard connection managers.
+
+    The catalog database (users, auth) is the regular db_manager; every
+    user-scoped table (streaks, journal, EEG sessions and states, rollups,
+    chat, emergency events) lives in the user's shard. Placement uses a
+    stable hash of the user id, so changing the shard count means
+    rebalancing existing data.
+    """
+
+    def __init__(self, base_path, shard_count, **manager_settings):
+        self.base_path = base_path
+        self.managers = [
+            ConnectionManager(shard_path(base_path, index), context_key=f'_database_shard{index}',
+                              **manager_settings)
+            for index in range(shard_count)
+        ]
+
+    def __len__(self):
+        return len(self.managers)
+
+    def init_app(self, app):
+        """Register every shard's teardown and read pool settings"""
+        app.extensions['shard_router'] = self
+        for index, manager in enumerate(self.managers):
+            manager.init_app(app, path=shard_path(app.config['DATABASE_PATH'], index))
+
+    def configure(self, base_path):
+        """Point every shard at files derived from a new base path"""
+        self.base_path = base_path
+        for index, manager in enumerate(self.managers):
+            manager.configure(shard_path(base_path, index))
+
+    def index_for(self, user_id):
+        return zlib.crc32(str(user_id).encode()) % len(self.managers)
+
+    def manager_for(self, user_id):
+        return self.managers[self.index_for(user_id)]
+
+    def connect_for(self, user_id):
+        """Connect callable for the user's shard (for background writers)"""
+        return self.manager_for(user_id).connect
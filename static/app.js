@@ -201,6 +201,31 @@ function initMultiAgentSocket() {
 
     agentSocket.on('connect', () => {
         console.log('✓ Multi-AI Socket connected, ID:', agentSocket.id);
+        // Re-subscribe after a reconnect so pushed brain states keep flowing
+        if (isStreaming) agentSocket.emit('join_stream');
+        agentSocket.emit('join_coach');
+    });
+
+    agentSocket.on('coach_delta', (data) => {
+        const bubble = coachBubble(data.message_id);
+        bubble.text(bubble.text() + data.delta);
+        $('#chatContainer').scrollTop($('#chatContainer')[0].scrollHeight);
+    });
+
+    agentSocket.on('coach_done', (data) => {
+        coachBubble(data.message_id).text(data.response);
+    });
+
+    agentSocket.on('stream_stopped', (data) => {
+        // The server ended our push stream (idle, time limit, or gone after a reconnect)
+        console.log('Stream stopped by server:', data.reason);
+        if (isStreaming) resetStreamControls();
+    });
+
+    agentSocket.on('brain_state', (data) => {
+        if (!isStreaming) return;
+        updateEEGChart();
+        renderBrainState(data);
     });
 
     agentSocket.on('debate_message', (data) => {
@@ -619,28 +644,45 @@ $('#toggleStream').click(function() {
 function startStream() {
     isStreaming = true;
     $('#toggleStream').html('<i class="fas fa-stop"></i> Stop Stream');
-    $.post('/api/start_stream', function(response) { console.log('Stream started:', response); });
-    streamInterval = setInterval(function() { updateEEGChart(); updateBrainState(); }, 1000);
+    // Only socket clients ask the server to push; pollers write through /api/state
+    const push = !!(agentSocket && agentSocket.connected);
+    $.post('/api/start_stream', { push: push }, function(response) {
+        console.log('Stream started:', response);
+        if (response.push) {
+            // Server pushes brain_state events to our room
+            agentSocket.emit('join_stream');
+        } else {
+            // No socket: fall back to polling
+            streamInterval = setInterval(function() { updateEEGChart(); updateBrainState(); }, 1000);
+        }
+    });
 }
 
-function stopStream() {
+function resetStreamControls() {
     isStreaming = false;
     $('#toggleStream').html('<i class="fas fa-play"></i> Start Stream');
     clearInterval(streamInterval);
+}
+
+function stopStream() {
+    resetStreamControls();
+    if (agentSocket) agentSocket.emit('leave_stream');
     $.post('/api/stop_stream', function(response) { console.log('Stream stopped:', response); });
 }
 
 // ==================== Brain State ====================
 
 function updateBrainState() {
-    $.get('/api/state', function(response) {
-        const { state, confidence, risk_score } = response;
-        $('#stateText').text(state.toUpperCase());
-        $('#confidence').text((confidence * 100).toFixed(0) + '%');
-        const stateCard = $('#brainState');
-        stateCard.removeClass('state-focused state-triggered state-relaxed').addClass('state-' + state);
-        if (state === 'triggered' && risk_score > 0.7) showRiskAlert(risk_score);
-    }).fail(() => console.log('Demo mode'));
+    $.get('/api/state', renderBrainState).fail(() => console.log('Demo mode'));
+}
+
+function renderBrainState(response) {
+    const { state, confidence, risk_score } = response;
+    $('#stateText').text(state.toUpperCase());
+    $('#confidence').text((confidence * 100).toFixed(0) + '%');
+    const stateCard = $('#brainState');
+    stateCard.removeClass('state-focused state-triggered state-relaxed').addClass('state-' + state);
+    if (state === 'triggered' && risk_score > 0.7) showRiskAlert(risk_score);
 }
 
 function showRiskAlert(riskScore) {
@@ -728,12 +770,18 @@ function sendMessage() {
     addMessageToChat(message, 'user');
     input.val('');
 
+    // Stream the reply token by token when the socket is up
+    const stream = Boolean(agentSocket && agentSocket.connected);
+
     $.ajax({
         url: '/api/nlp/message',
         method: 'POST',
         contentType: 'application/json',
-        data: JSON.stringify({ message }),
-        success: function(response) { addMessageToChat(response.response, 'coach'); },
+        data: JSON.stringify({ message, stream }),
+        success: function(response) {
+            if (response.streaming) coachBubble(response.message_id);
+            else addMessageToChat(response.response, 'coach');
+        },
         error: function() {
             const demoResponses = [
                 "That's completely normal. Take a deep breath and remember why you started this journey.",
@@ -747,6 +795,16 @@ function sendMessage() {
     });
 }
 
+function coachBubble(messageId) {
+    // Streamed coach reply bubble, created on the first delta or the POST response
+    let bubble = $(`#chatContainer [data-message-id="${messageId}"]`);
+    if (!bubble.length) {
+        bubble = $('<div class="message message-coach"></div>').attr('data-message-id', messageId);
+        $('#chatContainer').append(bubble);
+    }
+    return bubble;
+}
+
 function addMessageToChat(text, sender) {
     const container = $('#chatContainer');
     const messageClass = sender === 'user' ? 'message-user ms-auto' : 'message-coach';
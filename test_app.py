@@ -6,26 +6,23 @@ Run with: pytest test_app.py -v
 import pytest
 import json
 import numpy as np
-from app import app, init_db, EEGProcessor, BrainStateClassifier, SupportCoach
+from app import app, init_db, db_manager, EEGProcessor, BrainStateClassifier, SupportCoach
 import os
 import tempfile
 
 
 @pytest.fixture
 def client():
-    """Create test client"""
-    db_fd, db_path = tempfile.mkstemp()
+    """Create test client backed by a fresh in-memory database"""
     app.config['TESTING'] = True
-    app.config['DATABASE'] = db_path
+    app.config['DATABASE_PATH'] = ':memory:'
+    db_manager.configure(app.config['DATABASE_PATH'])
 
     with app.test_client() as client:
         with app.app_context():
             init_db()
         yield client
 
-    os.close(db_fd)
-    os.unlink(db_path)
-
 
 @pytest.fixture
 def auth_client(client):
@@ -132,6 +129,71 @@ def test_get_journal(auth_client):
     assert len(data) > 0
 
 
+def test_journal_keyset_pagination(auth_client):
+    """Test journal pages follow X-Next-Cursor without gaps or repeats"""
+    for day in range(1, 6):
+        auth_client.post('/api/journal', json={'mood': 'good', 'note': f'day {day}',
+                                               'date': f'2025-01-0{day}'})
+
+    pages, cursor = [], ''
+    while cursor is not None:
+        response = auth_client.get(f'/api/journal?limit=2&cursor={cursor}')
+        assert response.status_code == 200
+        pages.append([entry['note'] for entry in json.loads(response.data)])
+        cursor = response.headers.get('X-Next-Cursor')
+
+    assert [note for page in pages for note in page] == [f'day {day}' for day in range(5, 0, -1)]
+    assert auth_client.get('/api/journal?cursor=not-a-cursor').status_code == 400
+
+
+def test_bulk_sync(auth_client):
+    """Test a backlog of journal entries and check-ins applies in one request"""
+    response = auth_client.post('/api/sync', json={'items': [
+        {'client_id': 'a', 'type': 'journal', 'date': '2025-01-01', 'mood': 'good', 'note': 'offline 1'},
+        {'client_id': 'b', 'type': 'checkin', 'date': '2025-01-01', 'is_clean': True},
+        {'client_id': 'c', 'type': 'checkin', 'date': '2025-01-02', 'is_clean': True},
+        {'client_id': 'd', 'type': 'journal', 'date': 'yesterday'},
+        {'client_id': 'e', 'type': 'checkin', 'date': '2025-01-03', 'is_clean': False},
+        {'client_id': 'f', 'type': 'checkin', 'date': '2025-01-04'},
+        {'client_id': 'g', 'type': 'journal', 'date': '2025-01-04', 'note': 'offline 2'},
+    ]})
+    assert response.status_code == 200
+    data = json.loads(response.data)
+    assert data['applied'] == 6
+    assert [r['client_id'] for r in data['results'] if r['status'] == 'rejected'] == ['d']
+    assert data['streak']['current_streak'] == 1
+    assert data['streak']['longest_streak'] == 2
+    assert data['streak']['total_clean_days'] == 3
+    assert data['streak']['last_check_in'] == '2025-01-04'
+
+    notes = [entry['note'] for entry in json.loads(auth_client.get('/api/journal').data)]
+    assert notes == ['offline 2', 'offline 1']
+    assert json.loads(auth_client.get('/api/user/streak').data)['current_streak'] == 1
+
+    assert auth_client.post('/api/sync', json={'items': 'nope'}).status_code == 400
+
+    # Dates must parse in full, and a repeated client_id is applied once
+    data = json.loads(auth_client.post('/api/sync', json={'items': [
+        {'client_id': 'h', 'type': 'journal', 'date': '2025-01-05junk'},
+        {'client_id': 'i', 'type': 'checkin', 'date': '2025-01-05T08:30:00'},
+        {'client_id': 'i', 'type': 'checkin', 'date': '2025-01-05T08:30:00'},
+    ]}).data)
+    assert [r['status'] for r in data['results']] == ['rejected', 'applied', 'skipped']
+    assert data['streak']['current_streak'] == 2
+
+    # Without a streak row check-ins are skipped, not reported as applied
+    from app import get_repo
+    user_id = json.loads(auth_client.get('/api/debug/session').data)['user_id']
+    with app.app_context():
+        repo = get_repo()
+        repo.db.execute('DELETE FROM streaks WHERE user_id = ?', (user_id,))
+        repo.commit()
+    data = json.loads(auth_client.post('/api/sync', json={'items': [
+        {'client_id': 'j', 'type': 'checkin', 'date': '2025-01-06'},
+    ]}).data)
+    assert data['applied'] == 0 and data['skipped'] == 1
+
+
 # ==================== Chat Tests ====================
 
 def test_send_message(auth_client):
@@ -151,6 +213,186 @@ def test_empty_message(auth_client):
     assert response.status_code == 400
 
 
+def test_chat_history_latest_page(auth_client):
+    """Test chat history returns the latest messages and pages backwards"""
+    from app import get_repo
+
+    user_id = json.loads(auth_client.post('/api/login', json={
+        'username': 'testuser', 'password': 'testpass123'
+    }).data)['user_id']
+    with app.app_context():
+        repo = get_repo()
+        for i in range(5):
+            repo.add_chat_message(user_id, f'message {i}', 'user')
+        repo.commit()
+
+    response = auth_client.get('/api/chat/history?limit=2')
+    assert [m['message'] for m in json.loads(response.data)] == ['message 3', 'message 4']
+
+    response = auth_client.get(f"/api/chat/history?limit=2&cursor={response.headers['X-Next-Cursor']}")
+    assert [m['message'] for m in json.loads(response.data)] == ['message 1', 'message 2']
+
+
+def test_full_text_search(auth_client):
+    """Test search ranks the user's journal and chat matches and skips other users"""
+    auth_client.post('/api/journal', json={'mood': 'good', 'triggers': 'Stress', 'note': 'Work stress again'})
+    auth_client.post('/api/journal', json={'mood': 'good', 'triggers': 'None', 'note': 'Calm morning walk'})
+    auth_client.post('/api/nlp/message', json={'message': 'feeling stressed about exams'})
+
+    data = json.loads(auth_client.get('/api/search?q=stress').data)
+    assert {result['kind'] for result in data['results']} == {'chat', 'journal'}
+    assert all('[' in result['snippet'] for result in data['results'])
+
+    data = json.loads(auth_client.get('/api/search?q=walk&scope=journal').data)
+    assert [result['snippet'] for result in data['results']] == ['Calm morning [walk]']
+    assert auth_client.get('/api/search?q=stress" OR').status_code == 200
+    assert auth_client.get('/api/search?q=').status_code == 400
+
+    auth_client.post('/api/logout')
+    auth_client.post('/api/register', json={'username': 'otheruser', 'password': 'otherpass123'})
+    auth_client.post('/api/login', json={'username': 'otheruser', 'password': 'otherpass123'})
+    assert json.loads(auth_client.get('/api/search?q=stress').data)['results'] == []
+
+
+def test_search_backfill(tmp_path):
+    """Test rows written before the FTS migration are indexed incrementally"""
+    import sqlite3
+    from migrations import MIGRATIONS, apply_migrations
+    from search import backfill, user_match_query
+
+    db_path = str(tmp_path / 'search.db')
+    db = sqlite3.connect(db_path)
+    apply_migrations(db, MIGRATIONS[:2])
+    db.executemany('INSERT INTO chat_history (user_id, message, sender) VALUES (1, ?, ?)',
+                   [(f'old message {i}', 'user') for i in range(7)])
+    db.commit()
+    apply_migrations(db)
+    db.execute("DELETE FROM chat_history WHERE id = 2")
+    db.commit()
+
+    assert backfill(lambda: sqlite3.connect(db_path), batch_size=3, pause=0) == 6
+    assert db.execute("SELECT COUNT(*) FROM chat_fts WHERE chat_fts MATCH 'old'").fetchone()[0] == 6
+
+    # MATCH is scoped to the owner inside the index; ids never match text terms
+    count = 'SELECT COUNT(*) FROM chat_fts WHERE chat_fts MATCH ?'
+    assert db.execute(count, (user_match_query(1, 'old', ('message',)),)).fetchone()[0] == 6
+    assert db.execute(count, (user_match_query(2, 'old', ('message',)),)).fetchone()[0] == 0
+    assert db.execute(count, (user_match_query(1, '1', ('message',)),)).fetchone()[0] == 0
+    db.execute("INSERT INTO chat_fts (chat_fts, rank) VALUES ('integrity-check', 1)")
+    db.close()
+
+
+def test_analytics_backfill(tmp_path):
+    """Test brain states written before the buffer are folded into session aggregates and rollups"""
+    import sqlite3
+    from analytics_backfill import backfill
+    from migrations import BASE_SCHEMA, apply_migrations
+    from repository import Repository
+
+    db_path = str(tmp_path / 'legacy.db')
+    db = sqlite3.connect(db_path)
+    db.executescript(BASE_SCHEMA)  # an original database: tables, no migrations applied
+    db.execute("INSERT INTO users (username, password_hash) VALUES ('legacy', 'hash')")
+    db.execute('INSERT INTO eeg_sessions (user_id) VALUES (1)')
+    db.executemany('INSERT INTO brain_states (session_id, state, confidence, risk_score) VALUES (1, ?, 0.9, ?)',
+                   [('focused', 0.2), ('triggered', 0.8), ('focused', 0.2), ('relaxed', None)])
+    db.commit()
+    apply_migrations(db)
+
+    assert backfill(lambda: sqlite3.connect(db_path), batch_size=3, pause=0) == 4
+    assert backfill(lambda: sqlite3.connect(db_path), pause=0) == 0
+    row = db.execute('SELECT triggered_count, focused_count, avg_risk_score FROM eeg_sessions').fetchone()
+    assert row == (1, 2, pytest.approx(0.4))
+    stats = Repository(db).admin_stats()
+    assert (stats['triggered_week'], stats['focused_week']) == (1, 2)
+
+    # The rollups now cover the old rows; the NULL risk sample does not dilute avg_risk
+    import rollups
+    from datetime import datetime, timedelta
+    now = datetime.utcnow()
+    buckets = rollups.fetch_timeline(db, 1, now - timedelta(days=1), now + timedelta(days=1), 'day')
+    assert [(b['sample_count'], b['focused_count'], b['triggered_count']) for b in buckets] == [(4, 2, 1)]
+    assert buckets[0]['avg_risk'] == pytest.approx(0.4)
+    db.close()
+
+    # A database created by this version has nothing to fold
+    fresh = sqlite3.connect(str(tmp_path / 'fresh.db'))
+    apply_migrations(fresh)
+    assert fresh.execute('SELECT last_id, max_id FROM analytics_backfill').fetchone() == (0, 0)
+    fresh.close()
+
+
+def test_coach_reply_streams_to_socket(auth_client):
+    """Test streamed coach replies arrive as deltas and are persisted when done"""
+    import time
+    from types import SimpleNamespace
+    from app import socketio, coach
+
+    def chunk(text):
+        return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text))])
+
+    class StreamingCompletions:
+        chat = completions = None
+
+        def create(self, stream=False, **kwargs):
+            return iter([chunk('Breathe '), chunk(None), chunk('with me.')])
+
+    client = StreamingCompletions()
+    client.chat = client.completions = client
+    triage = coach.triage
+    coach.use_ai, coach.client, coach.triage = True, client, None
+    try:
+        socket_client = socketio.test_client(app, flask_test_client=auth_client)
+        socket_client.emit('join_coach')
+        data = json.loads(auth_client.post('/api/nlp/message',
+                                           json={'message': 'I have an urge', 'stream': True}).data)
+        assert data['streaming'] and data['intent'] == 'urge'
+
+        received = []
+        for _ in range(50):
+            received += socket_client.get_received()
+            if any(e['name'] == 'coach_done' for e in received):
+                break
+            time.sleep(0.05)
+        socket_client.disconnect()
+    finally:
+        coach.use_ai, coach.triage = False, triage
+        coach.clear_history(json.loads(auth_client.get('/api/debug/session').data)['user_id'])
+
+    deltas = [e['args'][0]['delta'] for e in received if e['name'] == 'coach_delta']
+    assert deltas == ['Breathe ', 'with me.']
+    done = [e['args'][0] for e in received if e['name'] == 'coach_done']
+    assert done[0]['message_id'] == data['message_id']
+    assert done[0]['response'] == 'Breathe with me.'
+
+    history = json.loads(auth_client.get('/api/chat/history').data)
+    assert history[-1]['message'] == 'Breathe with me.' and history[-1]['sender'] == 'coach'
+
+
+def test_coach_stream_failure_still_finishes(auth_client):
+    """Test an exception in the stream task falls back to a rule reply and emits coach_done"""
+    from app import socketio, coach, run_coach_stream
+
+    def broken(*args, **kwargs):
+        raise RuntimeError('boom')
+
+    user_id = json.loads(auth_client.get('/api/debug/session').data)['user_id']
+    socket_client = socketio.test_client(app, flask_test_client=auth_client)
+    socket_client.emit('join_coach')
+    stream_response = coach.stream_response
+    coach.stream_response = broken
+    try:
+        run_coach_stream(user_id, 'I have an urge', {}, 'm1', 'urge')
+        received = socket_client.get_received()
+    finally:
+        coach.stream_response = stream_response
+        socket_client.disconnect()
+
+    done = [e['args'][0] for e in received if e['name'] == 'coach_done']
+    assert done[0]['message_id'] == 'm1'
+    assert done[0]['response'] in coach.responses['urge']
+
+
 # ==================== Emergency Tests ====================
 
 def test_emergency_support(auth_client):
@@ -190,6 +432,314 @@ def test_get_brain_state(auth_client):
     assert 'risk_score' in data
 
 
+def test_stop_stream_flushes_brain_states(auth_client):
+    """Test buffered brain states are written when the stream stops"""
+    from app import get_db
+
+    session_id = json.loads(auth_client.post('/api/start_stream').data)['session_id']
+    for _ in range(3):
+        auth_client.get('/api/state')
+    auth_client.post('/api/stop_stream')
+
+    db = get_db()
+    count, avg_risk = db.execute('SELECT COUNT(*), AVG(risk_score) FROM brain_states WHERE session_id = ?',
+                                 (session_id,)).fetchone()
+    eeg_session = db.execute('SELECT * FROM eeg_sessions WHERE id = ?', (session_id,)).fetchone()
+    db.close()
+    # Polling without push: exactly one row per poll
+    assert count == 3
+
+    # Session aggregates are maintained as the states are written
+    assert eeg_session['triggered_count'] + eeg_session['focused_count'] == count
+    assert eeg_session['avg_risk_score'] == pytest.approx(avg_risk)
+
+
+def test_brain_state_socket_stream(auth_client):
+    """Test start_stream pushes brain_state events to the user's room"""
+    import time
+    from app import socketio, active_streams
+
+    socket_client = socketio.test_client(app, flask_test_client=auth_client)
+    session_id = json.loads(auth_client.post('/api/start_stream', json={'push': True}).data)['session_id']
+    socket_client.emit('join_stream')
+
+    events = []
+    for _ in range(50):
+        events = [e for e in socket_client.get_received() if e['name'] == 'brain_state']
+        if events:
+            break
+        time.sleep(0.05)
+
+    auth_client.post('/api/stop_stream')
+    socket_client.disconnect()
+
+    assert events
+    assert 'state' in events[0]['args'][0]
+    assert all(stream['session_id'] != session_id for stream in active_streams.values())
+
+
+def test_brain_state_stream_lifecycle(auth_client):
+    """Test pushed streams are the only writer, survive reconnects and stop on logout and idle"""
+    import time
+    from app import socketio, active_streams, get_db, brain_state_buffer
+
+    user_id = json.loads(auth_client.get('/api/debug/session').data)['user_id']
+
+    def stored(session_id):
+        brain_state_buffer.flush()
+        db = get_db()
+        count = db.execute('SELECT COUNT(*) FROM brain_states WHERE session_id = ?', (session_id,)).fetchone()[0]
+        ended = db.execute('SELECT session_end FROM eeg_sessions WHERE id = ?', (session_id,)).fetchone()[0]
+        db.close()
+        return count, ended
+
+    def wait_stopped():
+        for _ in range(40):
+            if user_id not in active_streams:
+                break
+            time.sleep(0.05)
+
+    # While the server stream writes, polls must not add rows
+    socket_client = socketio.test_client(app, flask_test_client=auth_client)
+    session_id = json.loads(auth_client.post('/api/start_stream', json={'push': True}).data)['session_id']
+    socket_client.emit('join_stream')
+    before = stored(session_id)[0]
+    for _ in range(3):
+        auth_client.get('/api/state')
+    assert stored(session_id)[0] - before <= 1
+
+    # A dropped socket only unsubscribes; rejoining resumes the same stream
+    socket_client.disconnect()
+    assert active_streams[user_id]['session_id'] == session_id
+    socket_client = socketio.test_client(app, flask_test_client=auth_client)
+    socket_client.emit('join_stream')
+    assert active_streams[user_id]['sids']
+    assert stored(session_id)[1] is None
+
+    # With nobody subscribed it ends after the idle timeout
+    socket_client.emit('leave_stream')
+    active_streams[user_id]['idle_since'] -= app.config['BRAIN_STATE_STREAM_IDLE_TIMEOUT'] + 1
+    wait_stopped()
+    assert user_id not in active_streams
+    count, ended = stored(session_id)
+    assert ended is not None
+
+    # The ended session gets no more rows, keeps its end time, and rejoining reports it stopped
+    time.sleep(1.1)
+    assert auth_client.post('/api/stop_stream').status_code == 200
+    assert stored(session_id) == (count, ended)
+    socket_client.get_received()
+    socket_client.emit('join_stream')
+    assert 'stream_stopped' in [e['name'] for e in socket_client.get_received()]
+    socket_client.disconnect()
+
+    # Polls after an automatic stop do not write into the closed session
+    session_id = json.loads(auth_client.post('/api/start_stream', json={'push': True}).data)['session_id']
+    active_streams[user_id]['idle_since'] -= app.config['BRAIN_STATE_STREAM_IDLE_TIMEOUT'] + 1
+    wait_stopped()
+    count = stored(session_id)[0]
+    auth_client.get('/api/state')
+    assert stored(session_id)[0] == count
+
+    # Logout stops it too
+    auth_client.post('/api/start_stream', json={'push': True})
+    auth_client.post('/api/logout')
+    assert user_id not in active_streams
+
+
+def test_brain_state_buffer_size_flush():
+    """Test buffer flushes with executemany once max_rows is reached"""
+    import sqlite3
+    from brain_state_buffer import BrainStateBuffer
+
+    db_fd, db_path = tempfile.mkstemp()
+    conn = sqlite3.connect(db_path)
+    conn.execute('CREATE TABLE brain_states (session_id INTEGER, timestamp TIMESTAMP, '
+                 'state TEXT, confidence REAL, risk_score REAL)')
+    conn.execute('CREATE TABLE eeg_sessions (id INTEGER PRIMARY KEY, avg_risk_score REAL, '
+                 'triggered_count INTEGER DEFAULT 0, focused_count INTEGER DEFAULT 0)')
+    conn.execute('INSERT INTO eeg_sessions (id) VALUES (1)')
+    conn.commit()
+    conn.close()
+
+    buffer = BrainStateBuffer(lambda: sqlite3.connect(db_path), max_rows=5, flush_interval=60)
+    result = {'state': 'focused', 'confidence': 0.9, 'risk_score': 0.1}
+    for _ in range(4):
+        buffer.add(1, result)
+    assert len(buffer) == 4
+
+    buffer.add(1, result)
+    assert len(buffer) == 0
+    assert buffer.flush_count == 1
+
+    conn = sqlite3.connect(db_path)
+    assert conn.execute('SELECT COUNT(*) FROM brain_states').fetchone()[0] == 5
+    assert conn.execute('SELECT focused_count, avg_risk_score FROM eeg_sessions').fetchone() == (5, pytest.approx(0.1))
+    conn.close()
+    os.close(db_fd)
+    os.unlink(db_path)
+
+    # Failed flushes keep retrying the newest rows only, up to max_pending
+    def unavailable():
+        raise sqlite3.OperationalError('database is locked')
+
+    failing = BrainStateBuffer(unavailable, max_rows=100, flush_interval=60, max_pending=3)
+    for _ in range(5):
+        failing.add(1, result)
+    with pytest.raises(sqlite3.OperationalError):
+        failing.flush()
+    assert len(failing) == 3 and failing.rows_dropped == 2
+
+    # A group committed before another database fails is still counted
+    db_fd, db_path = tempfile.mkstemp()
+    conn = sqlite3.connect(db_path)
+    conn.execute('CREATE TABLE brain_states (session_id INTEGER, timestamp TIMESTAMP, '
+                 'state TEXT, confidence REAL, risk_score REAL)')
+    conn.execute('CREATE TABLE eeg_sessions (id INTEGER PRIMARY KEY, avg_risk_score REAL, '
+                 'triggered_count INTEGER DEFAULT 0, focused_count INTEGER DEFAULT 0)')
+    conn.commit()
+    conn.close()
+
+    def healthy():
+        return sqlite3.connect(db_path)
+
+    partial = BrainStateBuffer(healthy, max_rows=100, flush_interval=60,
+                               route=lambda user_id: healthy if user_id == 1 else unavailable)
+    partial.add(1, result, user_id=None)
+    partial.add(1, result, user_id=2)
+    with pytest.raises(sqlite3.OperationalError):
+        partial.flush()
+    assert partial.rows_written == 1 and partial.flush_count == 1 and len(partial) == 1
+    os.close(db_fd)
+    os.unlink(db_path)
+
+
+def test_analytics_timeline_rollups(auth_client):
+    """Test timeline reads rollup buckets maintained by the buffer"""
+    auth_client.post('/api/start_stream')
+    for _ in range(3):
+        auth_client.get('/api/state')
+    auth_client.post('/api/stop_stream')
+
+    response = auth_client.get('/api/analytics/timeline')
+    assert response.status_code == 200
+    data = json.loads(response.data)
+    assert data['resolution'] == 'hour'
+    assert sum(b['sample_count'] for b in data['buckets']) >= 3
+    bucket = data['buckets'][-1]
+    assert bucket['min_risk'] <= bucket['avg_risk'] <= bucket['max_risk']
+
+    response = auth_client.get('/api/analytics/timeline?start=2025-01-02&end=2025-01-01')
+    assert response.status_code == 400
+
+
+def test_user_analytics_state_pagination(auth_client):
+    """Test brain state pages cover every state exactly once across sessions"""
+    for _ in range(2):
+        auth_client.post('/api/start_stream')
+        for _ in range(3):
+            auth_client.get('/api/state')
+        auth_client.post('/api/stop_stream')
+
+    full = json.loads(auth_client.get('/api/analytics/user?limit=1000').data)['states_timeline']
+    assert len(full) >= 6
+
+    seen, cursor = [], None
+    while True:
+        url = '/api/analytics/user?limit=4' + (f'&cursor={cursor}' if cursor else '')
+        data = json.loads(auth_client.get(url).data)
+        seen += [state['id'] for state in data['states_timeline']]
+        cursor = data['next_cursor']
+        if cursor is None:
+            break
+
+    assert seen == [state['id'] for state in full]
+
+
+def test_rollup_resolution_choice():
+    """Test resolution grows with the requested time range"""
+    from datetime import datetime, timedelta
+    from rollups import choose_resolution
+
+    end = datetime(2025, 6, 1)
+    assert choose_resolution(end - timedelta(hours=1), end) == 'minute'
+    assert choose_resolution(end - timedelta(days=3), end) == 'hour'
+    assert choose_resolution(end - timedelta(days=30), end) == 'day'
+
+
+def test_retention_compaction(tmp_path):
+    """Test expired rows are deleted in batches and chat history is archived"""
+    import gzip
+    import sqlite3
+    import analytics_backfill
+    import rollups
+    from retention import RetentionJob, compact
+
+    db_path = str(tmp_path / 'retention.db')
+    conn = sqlite3.connect(db_path)
+    conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+    conn.execute('CREATE TABLE brain_states (id INTEGER PRIMARY KEY, session_id INTEGER, '
+                 'timestamp TIMESTAMP, state TEXT, confidence REAL, risk_score REAL)')
+    conn.execute('CREATE TABLE chat_history (id INTEGER PRIMARY KEY, user_id INTEGER, '
+                 'message TEXT, sender TEXT, timestamp TIMESTAMP)')
+    conn.execute('CREATE TABLE eeg_sessions (id INTEGER PRIMARY KEY, user_id INTEGER, avg_risk_score REAL, '
+                 'triggered_count INTEGER DEFAULT 0, focused_count INTEGER DEFAULT 0)')
+    conn.execute('INSERT INTO eeg_sessions (id, user_id) VALUES (1, 1)')
+    conn.executescript(rollups.SCHEMA)
+    conn.executescript(rollups.RISK_COUNT_SQL)
+    for ts in ['2000-01-01 00:00:00'] * 5 + ['2999-01-01 00:00:00']:
+        conn.execute('INSERT INTO brain_states (session_id, timestamp, state, confidence, risk_score) '
+                     'VALUES (1, ?, "focused", 0.9, 0.1)', (ts,))
+        conn.execute('INSERT INTO chat_history (user_id, message, sender, timestamp) '
+                     'VALUES (1, "hi", "user", ?)', (ts,))
+    # Upgraded from the original schema: none of these rows are summarised yet
+    conn.executescript(analytics_backfill.SCHEMA)
+    conn.commit()
+
+    # Rows the backfill has not passed are never deleted
+    from retention import delete_in_batches, retention_cutoff
+    assert delete_in_batches(lambda: sqlite3.connect(db_path), 'brain_states', 'timestamp',
+                             retention_cutoff(90), 2, condition=analytics_backfill.FOLDED_ROW) == 0
+    conn.close()
+
+    stats = compact(lambda: sqlite3.connect(db_path), retention_days=90, batch_size=2,
+                    archive_folder=str(tmp_path / 'archive'))
+
+    assert stats['brain_states_folded'] == 6
+    assert stats['brain_states_deleted'] == 5
+    assert stats['chat_messages_archived'] == 5
+
+    # The deleted rows live on in the session aggregates and the day rollups
+    conn = sqlite3.connect(db_path)
+    assert conn.execute('SELECT focused_count FROM eeg_sessions').fetchone()[0] == 6
+    assert conn.execute('SELECT SUM(sample_count) FROM brain_state_rollup_day').fetchone()[0] == 6
+    conn.close()
+
+    conn = sqlite3.connect(db_path)
+    assert conn.execute('SELECT COUNT(*) FROM brain_states').fetchone()[0] == 1
+    assert conn.execute('SELECT COUNT(*) FROM chat_history').fetchone()[0] == 1
+    conn.close()
+
+    archive_file = next((tmp_path / 'archive').iterdir())
+    with gzip.open(archive_file, 'rt') as f:
+        assert len(f.readlines()) == 5
+
+    # Existing files are converted to incremental auto_vacuum once
+    from retention import ensure_incremental_auto_vacuum
+    legacy = sqlite3.connect(str(tmp_path / 'legacy.db'))
+    legacy.execute('CREATE TABLE t (x)')
+    assert ensure_incremental_auto_vacuum(legacy)
+    assert legacy.execute('PRAGMA auto_vacuum').fetchone()[0] == 2
+    assert not ensure_incremental_auto_vacuum(legacy)
+    legacy.close()
+
+    # The job reports one stats dict per database, sharded or not
+    job = RetentionJob(lambda: sqlite3.connect(db_path), retention_days=90,
+                       archive_folder=str(tmp_path / 'archive'), pause=0)
+    assert [run['brain_states_deleted'] for run in job.run_once()] == [0]
+    assert len(job.last_run) == 1
+
+
 # ==================== Admin Tests ====================
 
 def test_admin_dashboard(client):
@@ -267,6 +817,27 @@ def test_coach_detect_intent():
     assert coach.detect_intent("Hello") == 'general'
 
 
+def test_intent_matcher_word_boundaries_and_priority():
+    """Test whole-word matching, all matched intents and pluggable rules"""
+    from intent_matcher import IntentMatcher
+
+    matcher = IntentMatcher()
+    assert matcher.best('goodbye for now') == 'general'
+    assert matcher.best("I'm broken-hearted") == 'general'
+    assert matcher.best('I broke my streak') == 'relapse'
+    assert matcher.best('Strong urges tonight') == 'urge'
+    assert matcher.best('This is urgent') == 'general'
+    assert matcher.match('So stressed, I want  to give in') == ['urge', 'anxiety']
+
+    custom = IntentMatcher([('gratitude', 5, ['thanks', 'thank you'])], default='other')
+    assert custom.match('Thank you so much') == ['gratitude']
+    assert custom.best('hi') == 'other'
+
+    # Intents without response templates fall back to the general replies
+    coach = SupportCoach(use_ai=False, intent_rules=[('gratitude', 5, ['thanks'])])
+    assert coach.get_rule_based_response('thanks') in coach.responses['general']
+
+
 def test_coach_get_response():
     """Test response generation"""
     coach = SupportCoach()
@@ -289,6 +860,349 @@ def test_coach_personalization():
     assert '{streak}' not in response
 
 
+class SlowCompletions:
+    """Provider double whose completions take `delay` seconds"""
+
+    def __init__(self, delay, text='AI reply'):
+        self.delay = delay
+        self.text = text
+        self.chat = self
+        self.completions = self
+
+    def create(self, **kwargs):
+        import time
+        from types import SimpleNamespace
+        time.sleep(self.delay)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=self.text))])
+
+
+def test_coach_llm_deadline_fallback():
+    """Test slow provider calls fall back to rules at the deadline and are capped"""
+    import time
+
+    coach = SupportCoach(llm_deadline=0.2, llm_max_in_flight=1, triage_enabled=False)
+    coach.use_ai = True
+    coach.client = SlowCompletions(delay=0.01)
+    assert coach.get_response(1, 'hello', {'streak': 1}) == 'AI reply'
+
+    coach.client = SlowCompletions(delay=1.0)
+    started = time.perf_counter()
+    response = coach.get_response(1, 'hello', {'streak': 1})
+    assert time.perf_counter() - started < 0.5
+    assert response in coach.responses['general']
+    assert coach.llm_pool.stats['timed_out'] == 1
+
+    # The timed-out call still holds the only slot, so the next one is rejected at once
+    response = coach.get_response(1, 'hello', {'streak': 1})
+    assert response in coach.responses['general']
+    assert coach.llm_pool.stats['rejected'] == 1
+    coach.llm_pool.shutdown()
+
+
+def test_coach_response_cache():
+    """Test identical openers are served from the cache and history changes the key"""
+    coach = SupportCoach(triage_enabled=False)
+    coach.use_ai = True
+    coach.client = SlowCompletions(delay=0, text='Cached reply')
+
+    assert coach.get_response(1, "I'm feeling anxious!", {'streak': 5}) == 'Cached reply'
+    coach.client = SlowCompletions(delay=0, text='Fresh reply')
+    # Same opener, same streak band, different user: cache hit
+    assert coach.get_response(2, "i'm feeling   anxious", {'streak': 6}) == 'Cached reply'
+    # User 1 now has history, so the context differs
+    assert coach.get_response(1, "I'm feeling anxious!", {'streak': 5}) == 'Fresh reply'
+
+    stats = coach.response_cache.stats()
+    assert (stats['hits'], stats['misses']) == (1, 2)
+    assert stats['hit_rate'] == pytest.approx(1 / 3)
+
+    assert SupportCoach(cache_enabled=False).response_cache is None
+
+
+def test_coach_triage_answers_locally():
+    """Test small talk and clear single-intent messages skip the provider"""
+    class Counting(SlowCompletions):
+        calls = 0
+
+        def create(self, **kwargs):
+            self.calls += 1
+            return super().create(**kwargs)
+
+    coach = SupportCoach(cache_enabled=False)
+    coach.use_ai = True
+    coach.client = Counting(delay=0)
+
+    assert coach.get_response(1, 'thanks!', {'streak': 3}) in coach.responses['acknowledgement']
+    assert coach.get_response(1, 'I have an urge', {'streak': 3}) in [
+        r.format(streak=3) for r in coach.responses['urge']]
+    assert coach.client.calls == 0
+    assert coach.get_response(1, 'Why do urges get stronger at night?', {'streak': 3}) == 'AI reply'
+    assert coach.client.calls == 1
+    assert coach.triage.stats == {'rules': 2, 'cache': 0, 'llm': 1}
+    # Locally answered turns still become conversation context
+    assert [role for role, _ in coach.memory.get(1)][:4] == ['user', 'assistant', 'user', 'assistant']
+
+    router = coach.triage
+    assert router.decide('hello, I relapsed') == ('rules', 'relapse')
+    assert router.decide('what is dopamine?')[0] == 'remote'
+    assert router.decide('OK') == ('rules', 'acknowledgement')
+    # Small talk counts only as the whole message; negation and risk always reach the LLM
+    for message in ['I am not okay', 'not ok', 'not good', 'no, not great', 'bye forever',
+                    'I feel so broke and alone', 'ok but I can’t stop', 'thanks for nothing',
+                    'hello, I want to give up', 'I never feel strong']:
+        assert router.decide(message) == ('remote', None), message
+
+
+def test_mock_llm_provider():
+    """Test the mock provider drives the coach and speaks the OpenAI HTTP protocol"""
+    import httpx
+    from flask import Flask
+    from openai import OpenAI
+    from mock_llm import MockLLM, create_blueprint
+
+    provider = MockLLM(latency=0.01, distribution='fixed', tokens_per_second=0, reply_tokens=5)
+    coach = SupportCoach(use_ai=True, llm_provider='mock', mock_llm=provider,
+                         triage_enabled=False, cache_enabled=False)
+    reply = coach.get_response(1, 'Tell me about cravings', {'streak': 2})
+    assert len(reply.split()) == 5
+    deltas = []
+    assert coach.stream_response(2, 'Tell me about cravings', {'streak': 2}, deltas.append) == reply
+    assert len(deltas) == 5
+
+    provider.error_rate = 1.0
+    assert coach.get_response(3, 'Why is this so hard', {'streak': 2}) in coach.responses['general']
+    assert provider.stats['errors'] == 1
+    coach.llm_pool.shutdown()
+
+    # The real SDK against the HTTP endpoint, as AutoGen uses it via base_url
+    provider.error_rate = 0.0
+    server = Flask('mock')
+    server.register_blueprint(create_blueprint(provider), url_prefix='/v1')
+    client = OpenAI(api_key='mock', base_url='http://mock/v1', max_retries=0,
+                    http_client=httpx.Client(transport=httpx.WSGITransport(app=server)))
+    messages = [{'role': 'user', 'content': 'hi'}]
+    completion = client.chat.completions.create(model='mock', messages=messages)
+    text = completion.choices[0].message.content
+    stream = client.chat.completions.create(model='mock', messages=messages, stream=True)
+    assert ''.join(c.choices[0].delta.content or '' for c in stream) == text
+
+    provider.error_rate, provider.error_status = 1.0, 429
+    with pytest.raises(Exception) as error:
+        client.chat.completions.create(model='mock', messages=messages)
+    assert getattr(error.value, 'status_code', None) == 429
+
+
+def test_coach_circuit_breaker():
+    """Test provider failures trip the breaker to rules and a trial call closes it"""
+    from circuit_breaker import CircuitBreaker
+    from mock_llm import MockLLM
+
+    now = [0.0]
+    breaker = CircuitBreaker(window=10, min_calls=4, error_rate=0.5, latency_slo=1.0, open_seconds=5,
+                             clock=lambda: now[0])
+    for latency in (0.1, 0.2, 0.1):
+        breaker.record(True, latency)
+    breaker.record(True, 3.0)  # p95 over the SLO
+    assert breaker.state == 'open' and not breaker.allow()
+
+    now[0] = 6.0
+    assert breaker.allow() and not breaker.allow()  # one trial call at a time
+    breaker.record(False, 0.1)
+    assert breaker.state == 'open'
+    now[0] = 12.0
+    assert breaker.allow()
+    breaker.record(True, 0.1)
+    assert breaker.state == 'closed' and breaker.snapshot()['calls'] == 1
+
+    provider = MockLLM(latency=0, distribution='fixed', tokens_per_second=0, error_rate=1.0)
+    coach = SupportCoach(use_ai=True, llm_provider='mock', mock_llm=provider, triage_enabled=False,
+                         cache_enabled=False, breaker_min_calls=3, breaker_open_seconds=60)
+    for i in range(5):
+        assert coach.get_response(1, f'Question number {i}', {'streak': 1}) in coach.responses['general']
+    assert provider.stats['requests'] == 3
+    stats = coach.breaker.snapshot()
+    assert (stats['state'], stats['trips'], stats['short_circuited']) == ('open', 1, 2)
+    coach.llm_pool.shutdown()
+
+
+def test_coach_hedged_completions():
+    """Test slow primaries are hedged to the next provider within the hedging budget"""
+    import time
+
+    providers = [{'name': 'primary', 'model': 'a', 'client': SlowCompletions(0.5, 'primary reply')},
+                 {'name': 'backup', 'model': 'b', 'client': SlowCompletions(0.01, 'backup reply')}]
+    coach = SupportCoach(use_ai=True, llm_providers=providers, hedge_delay=0.05, hedge_max_ratio=0.5,
+                         triage_enabled=False, cache_enabled=False, breaker_enabled=False)
+
+    started = time.perf_counter()
+    assert coach.get_response(1, 'Why do evenings feel harder', {'streak': 1}) == 'backup reply'
+    assert time.perf_counter() - started < 0.4
+    # Budget is 0.5 hedges per request: the second request must wait for the primary
+    assert coach.get_response(2, 'Why do evenings feel harder', {'streak': 1}) == 'primary reply'
+
+    providers[0]['client'] = SlowCompletions(0, 'unused')
+    providers[0]['client'].create = lambda **kwargs: 1 / 0  # provider error: immediate failover
+    assert coach.get_response(3, 'Why do evenings feel harder', {'streak': 1}) == 'backup reply'
+
+    stats = coach.hedger.snapshot()
+    assert (stats['requests'], stats['hedges'], stats['hedges_denied']) == (3, 1, 1)
+    assert (stats['hedge_wins'], stats['failovers'], stats['hedge_win_rate']) == (1, 1, 1.0)
+    assert stats['wins'] == {'primary': 1, 'backup': 2}
+    coach.hedger.shutdown()
+    coach.llm_pool.shutdown()
+
+
+def test_outbound_http_retries_and_local_dispatch(auth_client):
+    """Test the shared HTTP client retries within budget and the debate proxy stays in-process"""
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from http_clients import OutboundHTTP
+
+    statuses = [503, 200, 503]
+    connections = set()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def respond(self):
+            connections.add(self.client_address)
+            self.send_response(statuses.pop(0) if statuses else 200)
+            self.send_header('Content-Length', '2')
+            self.end_headers()
+            # A remote agents server answering with a non-JSON error page
+            self.wfile.write(b'<h' if self.path.startswith('/api/agents') else b'{}')
+
+        do_GET = do_POST = respond
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_port}/'
+    outbound = OutboundHTTP(backoff=0, retry_reserve=1, retry_budget=0, local_port=server.server_port)
+    try:
+        assert outbound.get(url).status_code == 200  # 503 retried
+        assert outbound.post(url).status_code == 503  # POST is not replayed
+        assert outbound.get(url).status_code == 200
+        assert len(connections) == 1  # one kept-alive connection
+        assert outbound.stats['retries'] == 1 and outbound.is_local(url)
+
+        import app as app_module
+        agents_server, app_module.AGENTS_SERVER = app_module.AGENTS_SERVER, url.rstrip('/')
+        try:
+            response = auth_client.post('/api/debate/start', json={'topic': 'urges'})
+        finally:
+            app_module.AGENTS_SERVER = agents_server
+        assert response.status_code == 502
+        assert 'invalid response' in json.loads(response.data)['error']
+    finally:
+        outbound.close()
+        server.shutdown()
+
+    # AGENTS_SERVER is this app: no HTTP request to localhost:5000
+    response = auth_client.post('/api/debate/start', json={'topic': 'no-such-topic'})
+    assert response.status_code == 400
+    assert 'Invalid topic' in json.loads(response.data)['error']
+
+
+def test_conversation_memory_budget_and_rehydration():
+    """Test memory evicts least recently used users and reloads them on demand"""
+    from conversation_memory import ConversationMemory
+
+    stored = {1: [('user', 'old question'), ('assistant', 'old answer')]}
+    loads = []
+
+    def loader(user_id, limit):
+        loads.append(user_id)
+        return stored.get(user_id, [])[-limit:]
+
+    memory = ConversationMemory(max_users=2, max_turns=3, loader=loader)
+    assert memory.get(1) == stored[1]
+    memory.append(1, 'user', 'new question')
+    memory.append(1, 'assistant', 'new answer')
+    assert [content for _, content in memory.get(1)] == ['old answer', 'new question', 'new answer']
+
+    memory.append(2, 'user', 'hi')
+    memory.append(3, 'user', 'hello')
+    assert 1 not in memory and memory.stats()['evictions'] == 1
+    assert memory.get(1) == stored[1] and loads.count(1) == 2
+
+    small = ConversationMemory(max_bytes=1000)
+    for user_id in range(10):
+        small.append(user_id, 'user', 'x' * 300)
+    assert small.stats()['bytes'] <= 1000 and len(small.users) < 10
+
+
+def test_coach_context_survives_restart(auth_client):
+    """Test the coach rebuilds context from chat_history after losing memory"""
+    from app import coach
+
+    class Recording(SlowCompletions):
+        def create(self, **kwargs):
+            self.messages = kwargs['messages']
+            return super().create(**kwargs)
+
+    recording = Recording(delay=0, text='Noted.')
+    cache = coach.response_cache
+    coach.use_ai, coach.client, coach.response_cache = True, recording, None
+    try:
+        auth_client.post('/api/nlp/message', json={'message': 'My trigger is late nights'})
+        coach.memory.users.clear()  # as after a restart
+        auth_client.post('/api/nlp/message', json={'message': 'What was my trigger?'})
+    finally:
+        coach.use_ai, coach.response_cache = False, cache
+
+    contents = [m['content'] for m in recording.messages[1:]]
+    assert contents == ['My trigger is late nights', 'Noted.', 'What was my trigger?']
+
+
+def test_context_builder_budget_and_rolling_summary():
+    """Test history is fitted to the token budget and older turns are folded once"""
+    from context_builder import ContextBuilder, count_tokens
+
+    builder = ContextBuilder(budget=150, summary_budget=60)
+    turns = [(i + 1, 'user' if i % 2 == 0 else 'assistant', f'Turn {i}. ' + 'word ' * 30) for i in range(8)]
+
+    messages = builder.build(1, 'System prompt.', turns)
+    assert messages[0]['content'] == 'System prompt.'
+    assert messages[1]['content'].startswith('Summary of earlier conversation:')
+    assert messages[-1]['content'] == turns[-1][2]
+    assert sum(count_tokens(m['content']) for m in messages) <= 150
+    folded = builder.stats['turns_folded']
+    assert folded == len(turns) - (len(messages) - 2)
+
+    # Two new turns push two more out of the window; only those are folded
+    turns += [(9, 'user', 'Turn 8. ' + 'word ' * 30), (10, 'assistant', 'Turn 9. ' + 'word ' * 30)]
+    messages = builder.build(1, 'System prompt.', turns[2:])
+    assert builder.stats['turns_folded'] == folded + 2
+    summary = messages[1]['content']
+    assert len(set(summary.splitlines())) == len(summary.splitlines())
+
+    # Short follow-ups drop nothing, yet the summary is still sent
+    turns += [(11, 'user', 'ok'), (12, 'assistant', 'Sure.')]
+    messages = builder.build(1, 'System prompt.', turns[-3:])
+    assert messages[1]['content'] == summary and builder.stats['turns_folded'] == folded + 2
+
+    # The newest turn is kept even when it alone is over budget
+    huge = [(1, 'user', 'word ' * 1000)]
+    assert builder.build(2, 'System prompt.', huge)[-1]['content'] == huge[0][2]
+
+
+def test_coach_context_folds_turns_leaving_memory():
+    """Test turns trimmed from memory are summarized once, even with repeated content"""
+    coach = SupportCoach(memory_turns=4, context_tokens=2000, summary_tokens=500)
+    for text in ['My trigger is late nights.', 'Noted.', 'I walk at night.', 'Noted.', 'It helps.', 'Noted.']:
+        coach.memory.append(1, 'user' if text != 'Noted.' else 'assistant', text)
+
+    messages = coach.build_messages(1, 'What helps?', {'streak': 1})
+    summary = messages[1]['content'].splitlines()[1:]
+    # Three turns left memory (max 4 kept) and were folded exactly once, duplicates included
+    assert summary == ['User: My trigger is late nights.', 'Coach: Noted.', 'User: I walk at night.']
+    assert [m['content'] for m in messages[2:]] == ['Noted.', 'It helps.', 'Noted.', 'What helps?']
+    assert coach.context.stats['turns_folded'] == 3
+
+
 # ==================== Integration Tests ====================
 
 def test_full_user_flow(client):
@@ -450,6 +1364,269 @@ def test_database_initialization(client):
         assert 'chat_history' in table_names
 
 
+def test_connection_manager_pooling(tmp_path):
+    """Test pooled connections are reused and tuned for WAL"""
+    from database import ConnectionManager
+
+    manager = ConnectionManager(str(tmp_path / 'pool.db'), pool_size=2)
+    conn = manager.connect()
+    assert conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+    assert conn.execute('PRAGMA synchronous').fetchone()[0] == 1  # NORMAL
+    assert conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2  # INCREMENTAL
+    conn.close()
+
+    assert manager.connect() is conn
+    conn.close()
+    manager.close_all()
+
+
+def test_request_connection_released_on_teardown(client):
+    """Test each app context reuses one connection and returns it to the pool"""
+    from app import get_db
+
+    with app.app_context():
+        db = get_db()
+        assert get_db() is db
+    assert db_manager.connect() is db
+    db.close()
+
+
+def test_query_count_header(auth_client):
+    """Test each response reports how many queries it issued"""
+    response = auth_client.get('/api/user/streak')
+    assert response.headers['X-DB-Query-Count'] == '1'
+
+    response = auth_client.post('/api/nlp/message', json={'message': 'hello'})
+    assert response.headers['X-DB-Query-Count'] == '3'
+
+
+def test_auth_helpers_use_repository(client):
+    """Test account helpers work on a raw connection through the repository"""
+    from auth_helpers import get_user_info, change_password, delete_user_account
+
+    client.post('/api/register', json={'username': 'helperuser', 'password': 'oldpass1'})
+    db = db_manager.connect()
+    user_id = db.execute('SELECT id FROM users WHERE username = ?', ('helperuser',)).fetchone()[0]
+
+    assert get_user_info(db, user_id)['username'] == 'helperuser'
+    assert change_password(db, user_id, 'oldpass1', 'newpass2')[0]
+    assert not change_password(db, user_id, 'oldpass1', 'newpass3')[0]
+
+    # A sample without a risk score leaves the bucket's min/max alone
+    import rollups
+    rollups.apply_rollups(db, [(user_id, '2025-01-01 10:00:00', 'focused', 0.3)])
+    rollups.apply_rollups(db, [(user_id, '2025-01-01 10:00:30', 'focused', None)])
+    assert tuple(db.execute('SELECT risk_min, risk_max FROM brain_state_rollup_minute WHERE user_id = ?',
+                            (user_id,)).fetchone()) == (0.3, 0.3)
+    db.commit()
+
+    assert delete_user_account(db, user_id)[0]
+    assert get_user_info(db, user_id) is None
+    for table, _, _, _ in rollups.RESOLUTIONS.values():
+        assert db.execute(f'SELECT COUNT(*) FROM {table} WHERE user_id = ?', (user_id,)).fetchone()[0] == 0
+    db.close()
+
+
+def test_async_repository(auth_client):
+    """Test the async repository mirrors the sync API without blocking the loop"""
+    import asyncio
+    from app import async_repo
+
+    user_id = json.loads(auth_client.post('/api/login', json={
+        'username': 'testuser', 'password': 'testpass123'
+    }).data)['user_id']
+
+    async def scenario():
+        await async_repo.add_chat_message(user_id, 'async hello', 'user')
+        streak, history = await asyncio.gather(
+            async_repo.get_streak(user_id),
+            async_repo.list_chat_history(user_id)
+        )
+        return streak, history
+
+    streak, history = asyncio.run(scenario())
+    assert streak.current_streak == 0
+    assert [m.message for m in history] == ['async hello']
+
+    with pytest.raises(AttributeError):
+        async_repo._execute
+
+
+def test_sharded_storage(tmp_path):
+    """Test user rows land on the user's shard and admin stats fan out"""
+    from brain_state_buffer import BrainStateBuffer
+    from database import ConnectionManager
+    from migrations import apply_migrations
+    from repository import Repository
+    from sharding import ShardRouter, shard_path
+
+    base_path = str(tmp_path / 'catalog.db')
+    assert shard_path(base_path, 2) == str(tmp_path / 'catalog.shard2.db')
+
+    catalog = ConnectionManager(base_path)
+    router = ShardRouter(base_path, 3)
+    for connect in [catalog.connect] + [m.connect for m in router.managers]:
+        db = connect()
+        apply_migrations(db)
+        db.close()
+
+    repo = Repository(catalog.connect(), router)
+    user_ids = [repo.create_user(f'user{i}', 'hash', f'anon{i}', 0) for i in range(6)]
+    for user_id in user_ids:
+        repo.add_journal_entry(user_id, '2025-01-01', 'good', '', 'note')
+        repo.update_streak(user_id, 2, 2, 2, '2025-01-01')
+    session_id = repo.create_eeg_session(user_ids[0])
+    repo.commit()
+
+    buffer = BrainStateBuffer(catalog.connect, route=router.connect_for)
+    buffer.add(session_id, {'state': 'focused', 'confidence': 0.9, 'risk_score': 0.2}, user_ids[0])
+    buffer.flush()
+
+    for index, manager in enumerate(router.managers):
+        db = manager.connect()
+        owners = {row[0] for row in db.execute('SELECT user_id FROM journal_entries')}
+        assert owners == {u for u in user_ids if router.index_for(u) == index}
+        db.close()
+
+    home = router.manager_for(user_ids[0]).connect()
+    assert home.execute('SELECT COUNT(*) FROM brain_states').fetchone()[0] == 1
+    home.close()
+    assert catalog.connect().execute('SELECT COUNT(*) FROM journal_entries').fetchone()[0] == 0
+
+    stats = repo.admin_stats()
+    assert stats['total_users'] == 6
+    assert stats['total_clean_days'] == 12
+    assert stats['avg_current_streak'] == 2
+    assert stats['active_sessions'] == 1
+    assert len(repo.list_journal(user_ids[3])) == 1
+
+    # Account helpers given the router delete the user's shard rows too
+    from auth_helpers import change_password, delete_user_account, hash_password
+    catalog_db = catalog.connect()
+    catalog_db.execute('UPDATE users SET password_hash = ? WHERE id = ?',
+                       (hash_password('oldpass1'), user_ids[3]))
+    catalog_db.commit()
+    assert change_password(catalog_db, user_ids[3], 'oldpass1', 'newpass2', shards=router)[0]
+    assert delete_user_account(catalog_db, user_ids[3], shards=router)[0]
+    shard = router.manager_for(user_ids[3]).connect()
+    assert shard.execute('SELECT COUNT(*) FROM journal_entries WHERE user_id = ?',
+                         (user_ids[3],)).fetchone()[0] == 0
+    shard.close()
+    catalog_db.close()
+
+    repo.close()
+    assert not repo.borrowed
+
+
+def test_generate_load_data(tmp_path):
+    """Test the load generator writes consistent data and rebuilds indexes"""
+    import sqlite3
+    from db_setup import generate_load_data, secondary_indexes
+
+    db_path = str(tmp_path / 'load.db')
+    stats = generate_load_data(users=3, days=2, sessions_per_day=1, session_minutes=2,
+                               samples_per_minute=6, database=db_path, batch_size=50, seed=7)
+    assert stats['users'] == 3
+    assert stats['eeg_sessions'] == 6
+    assert stats['brain_states'] == 3 * 2 * 2 * 6
+    assert stats['rows_per_second'] > 0
+
+    db = sqlite3.connect(db_path)
+    indexes = {row[0] for row in db.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    assert set(secondary_indexes()) <= indexes
+    sampled = db.execute('SELECT SUM(triggered_count + focused_count) FROM eeg_sessions').fetchone()[0]
+    rolled = db.execute('SELECT SUM(sample_count) FROM brain_state_rollup_day').fetchone()[0]
+    assert sampled == rolled == stats['brain_states']
+    db.close()
+
+
+# ==================== Query Plan Tests ====================
+
+# Whole-table scans that are intended: admin totals over every user's streak,
+# and the analytics backfill watermark, which holds a single row
+ALLOWED_SCANS = {'SCAN streaks', 'SCAN analytics_backfill'}
+
+
+def record_statements(connect, run):
+    """SQL statements (parameters expanded) executed by run() on traced connections"""
+    statements = []
+
+    def traced():
+        db = connect()
+        db.set_trace_callback(statements.append)
+        return db
+
+    run(traced)
+    return [sql for sql in statements
+            if sql.lstrip().upper().startswith(('SELECT', 'WITH', 'UPDATE', 'DELETE'))
+            # FTS5 reads its own shadow tables ('main'.'chat_fts_config', ...)
+            and "'main'." not in sql]
+
+
+def assert_uses_index(db, sql, params=()):
+    plan = [row[3] for row in db.execute('EXPLAIN QUERY PLAN ' + sql, params).fetchall()]
+    full_scans = [step for step in plan
+                  if step.startswith('SCAN') and 'INDEX' not in step and step not in ALLOWED_SCANS]
+    assert not full_scans, f'{sql!r} scans without an index: {plan}'
+
+
+def test_migrations_are_idempotent(client):
+    """Test migrations record the schema version and re-run as a no-op"""
+    from migrations import MIGRATIONS, apply_migrations, schema_version
+
+    db = db_manager.connect()
+    assert schema_version(db) == MIGRATIONS[-1][0]
+    assert apply_migrations(db) == []
+    db.close()
+
+
+def test_hot_queries_use_indexes(client, tmp_path):
+    """Test the statements repository and retention calls execute are served by indexes"""
+    from datetime import datetime, timedelta
+    from repository import Repository
+    from retention import compact
+
+    db = db_manager.connect()
+    repo = Repository(db)
+    user_id = repo.create_user('planner', 'hash', 'anon_planner', 0)
+    session_id = repo.create_eeg_session(user_id)
+    db.execute("INSERT INTO brain_states (session_id, state, confidence, risk_score) "
+               "VALUES (?, 'focused', 0.9, 0.1)", (session_id,))
+    state_id = db.execute('SELECT MAX(id) FROM brain_states').fetchone()[0]
+    repo.commit()
+
+    def run_repository(connect):
+        repo = Repository(connect())
+        now = datetime.utcnow()
+        repo.get_user_info(user_id)
+        repo.get_streak(user_id)
+        repo.get_current_streak(user_id)
+        repo.list_journal(user_id)
+        repo.list_journal(user_id, before=('2999-01-01', 10))
+        repo.list_eeg_sessions(user_id)
+        repo.list_recent_states(user_id)
+        repo.list_recent_states(user_id, before=('2999-01-01', state_id))
+        repo.state_timeline(user_id, now - timedelta(days=1), now, 'hour')
+        repo.list_chat_history(user_id)
+        repo.list_chat_history(user_id, before=('2999-01-01', 10))
+        repo.search(user_id, 'stress')
+        repo.admin_stats()
+        repo.end_eeg_session(user_id, session_id)
+        repo.rollback()
+        repo.close()
+
+    def run_retention(connect):
+        compact(connect, 90, archive_folder=str(tmp_path / 'archive'), pause=0)
+
+    statements = (record_statements(db_manager.connect, run_repository)
+                  + record_statements(db_manager.connect, run_retention))
+    assert any('FROM chat_history' in sql for sql in statements)
+    assert any(sql.lstrip().startswith('DELETE FROM brain_states') for sql in statements)
+    for sql in statements:
+        assert_uses_index(db, sql)
+    db.close()
+
+
 # ==================== Run Tests ====================
 
 if __name__ == '__main__':
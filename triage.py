@@ -0,0 +1,86 @@
+"""
+Coach Triage for NeuroShield
+Local, sub-millisecond routing of coach messages to rules, cache or the LLM
+"""
+
+import re
+import threading
+
+
+# Whole messages (after normalize()) that are plain small talk and get a template reply
+SMALL_TALK = {
+    'acknowledgement': ['thanks', 'thank you', 'thanks a lot', 'thank you so much', 'thx', 'ty',
+                        'ok', 'okay', 'k', 'ok thanks', 'okay thanks', 'ok thank you', 'okay thank you',
+                        'got it', 'cool', 'will do', 'sure', 'bye', 'goodbye', 'see you'],
+    'general': ['hi', 'hello', 'hey', 'hi there', 'hello there', 'hey there',
+                'good morning', 'good afternoon', 'good evening'],
+}
+
+# Negation or risk language: never answered from templates ("not okay", "alone", "forever")
+RISK_WORDS = [
+    'not', 'no', 'never', 'nothing', 'nobody', 'none', 'cannot', "can't", 'cant', "don't", 'dont',
+    "won't", 'wont', "isn't", "wasn't", "didn't", "doesn't", 'alone', 'lonely', 'forever', 'hopeless',
+    'worthless', 'pointless', 'hate', 'hurt', 'harm', 'die', 'dying', 'dead', 'death', 'kill',
+    'suicide', 'suicidal', 'end it', 'give up', 'giving up', 'goodbye forever', 'anymore',
+]
+
+_risk = re.compile(r"(?<![\w'])(?:" + '|'.join(
+    r'\s+'.join(re.escape(word) for word in phrase.split())
+    for phrase in sorted(RISK_WORDS, key=len, reverse=True)
+) + r")(?![\w'])", re.IGNORECASE)
+_words = re.compile(r"[\w']+")
+
+
+def normalize(message):
+    """Lowercase words only: 'Thanks!!' -> 'thanks', 'Can’t' -> "can't" """
+    return ' '.join(_words.findall(message.lower().replace('’', "'")))
+
+
+class TriageRouter:
+    """
+    Decide how a coach message is answered: 'rules', 'cache' or 'llm'.
+
+    A message that is exactly a small-talk phrase, or a short message with
+    one clear intent, scores high and is answered from templates.
+    Negation or risk language, questions, long or mixed messages go to the
+    cache and then the LLM. `rule_threshold` and `max_rule_words` tune how
+    much traffic stays local.
+    """
+
+    def __init__(self, intent_matcher, rule_threshold=0.8, max_rule_words=6):
+        self.intent_matcher = intent_matcher
+        self.small_talk = {phrase: intent for intent, phrases in SMALL_TALK.items() for phrase in phrases}
+        self.rule_threshold = rule_threshold
+        self.max_rule_words = max_rule_words
+        self.lock = threading.Lock()
+        self.stats = {'rules': 0, 'cache': 0, 'llm': 0}
+
+    def score(self, message):
+        """(confidence that templates can answer, intent for the template)"""
+        text = normalize(message)
+        if _risk.search(text):
+            return 0.0, self.intent_matcher.default
+        if text in self.small_talk:
+            return 1.0, self.small_talk[text]
+
+        intents = self.intent_matcher.match(message)
+        if not intents:
+            return 0.2, self.intent_matcher.default
+
+        score = 0.9 if len(intents) == 1 else 0.5
+        score -= 0.1 * max(0, len(text.split()) - self.max_rule_words)
+        if '?' in message:
+            score -= 0.3
+        return score, intents[0]
+
+    def decide(self, message):
+        """('rules', template intent) when templates can answer, else ('remote', None)"""
+        score, intent = self.score(message)
+        if score >= self.rule_threshold:
+            self.record('rules')
+            return 'rules', intent
+        return 'remote', None
+
+    def record(self, route):
+        with self.lock:
+            self.stats[route] += 1